@@ -4,6 +4,28 @@ set -euo pipefail
 # Caminho do DB: pode passar como argumento, senão usa o default
 DB_PATH="${1:-checkpoints/ingest.db}"
 MAX_RETRIES="${2:-3}"
+# /metrics.json da ingestão em andamento (ingest_incremental --metrics-port)
+METRICS_URL="${INGEST_METRICS_URL:-http://localhost:${INGEST_METRICS_PORT:-9108}/metrics.json}"
+
+# 0) Telemetria ao vivo (se houver uma ingestão rodando com --metrics-port)
+if command -v curl >/dev/null 2>&1 && SNAP="$(curl -fsS --max-time 2 "$METRICS_URL" 2>/dev/null)"; then
+  echo "== Telemetria ao vivo ($METRICS_URL) =="
+  if command -v python3 >/dev/null 2>&1; then
+    printf '%s' "$SNAP" | python3 -c '
+import json, sys
+s = json.load(sys.stdin)
+print("uptime=%ss  pág/s(60s)=%s" % (s["uptime_s"], s["pages_per_second"]))
+for k, v in list(s["counters"].items()) + list(s["gauges"].items()):
+    print("  %s = %s" % (k, v))
+print("latência por etapa (count / avg / p50 / p95, s):")
+for k, v in s["stages"].items():
+    print("  %s: %s / %s / %s / %s" % (k, v["count"], v["avg_s"], v["p50_s"], v["p95_s"]))
+'
+  else
+    echo "$SNAP"
+  fi
+  echo
+fi
 
 if [ ! -f "$DB_PATH" ]; then
   echo "ERRO: banco não encontrado em '$DB_PATH'"
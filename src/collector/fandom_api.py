@@ -1,20 +1,173 @@
 # src/collector/fandom_api.py
-import os, time, requests
-from typing import Dict, Iterator, Optional
+import os, time, threading, requests
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from .metrics import metrics
 
 API_BASE = os.getenv("FANDOM_API_BASE", "https://whitewolf.fandom.com/api.php")
+# limite de títulos por action=query para usuários comuns (bots: 500)
+MAX_TITLES_PER_QUERY = 50
+USER_AGENT = os.getenv("FANDOM_USER_AGENT", "wod-fandom-rag/1.0 (ingest)")
+# maxlag: o servidor recusa (com Retry-After) quando a replicação está atrasada
+MAXLAG = int(os.getenv("FANDOM_MAXLAG", "5"))
+MIN_RPS = float(os.getenv("FANDOM_MIN_RPS", "0.5"))
+MAX_RPS = float(os.getenv("FANDOM_MAX_RPS", "10"))
+START_RPS = float(os.getenv("FANDOM_START_RPS", "3"))
+MAX_ATTEMPTS = int(os.getenv("FANDOM_MAX_ATTEMPTS", "6"))
 
-def _throttle(delay: float = 0.35):
-    time.sleep(delay)
+class RateLimiter:
+    """
+    Token bucket adaptativo (AIMD), thread-safe.
+
+    - acquire(): bloqueia até haver um token na taxa atual.
+    - on_success(): aumento aditivo da taxa (até max_rate).
+    - on_backoff(retry_after): corte multiplicativo da taxa (até min_rate)
+      e pausa global até `retry_after` segundos.
+    - snapshot(): taxa atual e contadores, para observabilidade.
+
+    O bucket é por processo: com N processos batendo na API, set_share(N)
+    divide as taxas configuradas para que o total fique na taxa configurada.
+    """
+
+    def __init__(self, rate: float = START_RPS, min_rate: float = MIN_RPS,
+                 max_rate: float = MAX_RPS, step: float = 0.1, factor: float = 0.5):
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.step = step
+        self.factor = factor
+        self._tokens = 1.0
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.backoffs = 0
+        self.slept = 0.0
+        self.share = 1
+
+    def set_share(self, n: int):
+        """Este processo é um de `n` dividindo a taxa configurada."""
+        n = max(1, int(n))
+        with self._lock:
+            k = self.share / n
+            self.min_rate *= k
+            self.max_rate *= k
+            self.rate *= k
+            self.step *= k
+            self.share = n
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(1.0, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        self.requests += 1
+                        return
+                    wait = (1.0 - self._tokens) / self.rate
+                self.slept += wait
+            metrics.observe("stage_seconds", wait, stage="throttle")
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def on_backoff(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.backoffs += 1
+            self.rate = max(self.min_rate, self.rate * self.factor)
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            self._tokens = 0.0
+
+    def current_rate(self) -> float:
+        return self.rate
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "rate": round(self.rate, 3),
+                "share": self.share,
+                "requests": self.requests,
+                "backoffs": self.backoffs,
+                "slept_s": round(self.slept, 3),
+            }
+
+limiter = RateLimiter()
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """Sessão HTTP compartilhada: keep-alive + gzip, pool de conexões."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers.update({
+                "User-Agent": USER_AGENT,
+                "Accept-Encoding": "gzip, deflate",
+                "Connection": "keep-alive",
+            })
+            _session = s
+        return _session
+
+def _retry_after(r: requests.Response) -> Optional[float]:
+    v = r.headers.get("Retry-After")
+    if not v:
+        return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        return None
 
 def api_get(params: Dict):
-    _throttle()
     params = dict(params)
     params.setdefault("format", "json")
     params.setdefault("formatversion", "2")
-    r = requests.get(API_BASE, params=params, timeout=30)
-    r.raise_for_status()
-    return r.json()
+    if MAXLAG > 0:
+        params.setdefault("maxlag", MAXLAG)
+    session = get_session()
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        limiter.acquire()
+        try:
+            with metrics.time("api"):
+                r = session.get(API_BASE, params=params, timeout=30)
+        except requests.RequestException as e:
+            metrics.inc("errors_total", stage="api", type=type(e).__name__)
+            raise
+        metrics.inc("bytes_fetched_total", len(r.content))
+        metrics.inc("api_requests_total", status=r.status_code)
+        if r.status_code == 429 or r.status_code >= 500:
+            limiter.on_backoff(_retry_after(r))
+            if attempt < MAX_ATTEMPTS:
+                metrics.inc("retries_total", reason="429" if r.status_code == 429 else "5xx")
+                continue
+        r.raise_for_status()
+        data = r.json()
+        err = data.get("error") if isinstance(data, dict) else None
+        if isinstance(err, dict) and err.get("code") == "maxlag":
+            limiter.on_backoff(_retry_after(r) or float(MAXLAG))
+            if attempt < MAX_ATTEMPTS:
+                metrics.inc("retries_total", reason="maxlag")
+                continue
+            raise RuntimeError(f"MediaWiki maxlag persistente: {err.get('info')}")
+        limiter.on_success()
+        # sem label de pid: workers reciclados deixariam séries órfãs
+        metrics.set_gauge("api_rate", limiter.current_rate())
+        return data
+
+def rate_snapshot() -> Dict:
+    """Taxa atual do limitador e contadores (req, backoffs, tempo dormindo)."""
+    return limiter.snapshot()
 
 def get_parse(title: str):
     return api_get({
@@ -24,9 +177,126 @@ def get_parse(title: str):
         "redirects": 1,
     })
 
-def iter_allpages(ap_namespace: int = 0, limit: Optional[int] = None) -> Iterator[str]:
-    fetched = 0
-    apcontinue = None
+def _empty_page(title: str) -> Dict:
+    return {
+        "title": title,
+        "pageid": None,
+        "revid": None,
+        "wikitext": "",
+        "categories": [],
+        "links": [],
+        "missing": False,
+    }
+
+def _merge_query_pages(acc: Dict[str, Dict], data: Dict):
+    for p in data.get("query", {}).get("pages", []) or []:
+        title = p.get("title")
+        if not title:
+            continue
+        page = acc.setdefault(title, _empty_page(title))
+        if p.get("missing") or p.get("invalid"):
+            page["missing"] = True
+        if p.get("pageid"):
+            page["pageid"] = p["pageid"]
+        revs = p.get("revisions") or []
+        if revs and page["revid"] is None:
+            rev = revs[0]
+            page["revid"] = rev.get("revid")
+            main = (rev.get("slots") or {}).get("main") or {}
+            page["wikitext"] = main.get("content") or rev.get("content") or ""
+        for c in p.get("categories") or []:
+            name = c.get("title") or ""
+            if name.startswith("Category:"):
+                name = name[len("Category:"):]
+            if name:
+                page["categories"].append(name)
+        for l in p.get("links") or []:
+            if l.get("title"):
+                page["links"].append(l["title"])
+
+def _query_pages_chunk(titles: List[str]) -> Iterator[Dict]:
+    params = {
+        "action": "query",
+        "titles": "|".join(titles),
+        "prop": "revisions|categories|links",
+        "rvprop": "ids|content",
+        "rvslots": "main",
+        "cllimit": "max",
+        "pllimit": "max",
+        "plnamespace": 0,
+        "redirects": 1,
+    }
+    acc: Dict[str, Dict] = {}
+    aliases: Dict[str, str] = {}
+    cont: Dict = {}
+    while True:
+        data = api_get({**params, **cont})
+        q = data.get("query", {})
+        for key in ("normalized", "redirects"):
+            for r in q.get(key) or []:
+                if r.get("from") and r.get("to"):
+                    aliases[r["from"]] = r["to"]
+        _merge_query_pages(acc, data)
+        cont = data.get("continue") or {}
+        if not cont:
+            break
+
+    for requested in titles:
+        final = requested
+        seen = set()
+        while final in aliases and final not in seen:
+            seen.add(final)
+            final = aliases[final]
+        page = dict(acc.get(final) or _empty_page(final))
+        if final not in acc:
+            page["missing"] = True
+        page["requested"] = requested
+        yield page
+
+def get_pages(titles: Iterable[str], chunk_size: int = MAX_TITLES_PER_QUERY) -> Iterator[Dict]:
+    """
+    Busca em lote via action=query (até 50 títulos por requisição):
+    wikitext, categorias, links (ns 0) e revid de cada página.
+
+    Gera um dict por título pedido, na mesma ordem:
+        {"requested", "title", "pageid", "revid", "wikitext",
+         "categories": [str], "links": [str], "missing": bool}
+    `title` é o título final (após normalização/redirect).
+    """
+    chunk_size = max(1, min(int(chunk_size), MAX_TITLES_PER_QUERY))
+    batch: List[str] = []
+    for t in titles:
+        if not t:
+            continue
+        batch.append(t)
+        if len(batch) >= chunk_size:
+            yield from _query_pages_chunk(batch)
+            batch = []
+    if batch:
+        yield from _query_pages_chunk(batch)
+
+def page_as_parse(page: Dict) -> Dict:
+    """
+    Converte um item de get_pages no formato de get_parse (formatversion=2),
+    para os consumidores que esperam parsed["parse"][...].
+    """
+    return {
+        "parse": {
+            "title": page.get("title"),
+            "pageid": page.get("pageid"),
+            "revid": page.get("revid"),
+            "wikitext": page.get("wikitext") or "",
+            "categories": [{"category": c} for c in page.get("categories") or []],
+            "links": [{"ns": 0, "title": l} for l in page.get("links") or []],
+        }
+    }
+
+def iter_allpages_batches(ap_namespace: int = 0, apcontinue: Optional[str] = None) -> Iterator[Tuple[List[str], Optional[str]]]:
+    """
+    allpages página a página da API: gera (títulos, próximo apcontinue).
+    O apcontinue devolvido permite retomar a listagem exatamente dali
+    (None = fim da listagem).
+    """
     while True:
         params = {
             "action": "query",
@@ -40,18 +310,52 @@ def iter_allpages(ap_namespace: int = 0, limit: Optional[int] = None) -> Iterato
 
         data = api_get(params)
         pages = data.get("query", {}).get("allpages", [])
+        apcontinue = data.get("continue", {}).get("apcontinue")
+        titles = [p["title"] for p in pages if p.get("title")]
         if not pages:
-            break
+            return
+        yield titles, apcontinue
+        if not apcontinue:
+            return
+
+def iter_allpages(ap_namespace: int = 0, limit: Optional[int] = None) -> Iterator[str]:
+    fetched = 0
+    for titles, _cont in iter_allpages_batches(ap_namespace):
+        for title in titles:
+            yield title
+            fetched += 1
+            if limit and fetched >= limit:
+                return
 
+def iter_allpages_revisions(ap_namespace: int = 0, limit: Optional[int] = None) -> Iterator[Tuple[str, int]]:
+    """
+    Como iter_allpages, mas já traz o lastrevid de cada página
+    (generator=allpages + prop=info): até 500 páginas por requisição,
+    sem baixar conteúdo. Usado pelo refresh incremental.
+    """
+    fetched = 0
+    cont: Dict = {}
+    while True:
+        params = {
+            "action": "query",
+            "generator": "allpages",
+            "gapnamespace": ap_namespace,
+            "gaplimit": "max",
+            "gapfilterredir": "nonredirects",
+            "prop": "info",
+            **cont,
+        }
+        data = api_get(params)
+        pages = data.get("query", {}).get("pages", [])
         for p in pages:
             title = p.get("title")
             if not title:
                 continue
-            yield title
+            yield title, int(p.get("lastrevid") or 0)
             fetched += 1
             if limit and fetched >= limit:
                 return
 
-        apcontinue = data.get("continue", {}).get("apcontinue")
-        if not apcontinue:
+        cont = data.get("continue") or {}
+        if not cont:
             break
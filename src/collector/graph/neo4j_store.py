@@ -1,11 +1,38 @@
 import os
-from typing import Dict, Iterable, List, Any
+from typing import Dict, Iterable, List, Any, Optional
 from neo4j import GraphDatabase
 
 URI = os.getenv('NEO4J_URI', 'bolt://neo4j:7687')
 USER = os.getenv('NEO4J_USER', 'neo4j')
 PWD  = os.getenv('NEO4J_PASSWORD', 'please_change_me')
-driver = GraphDatabase.driver(URI, auth=(USER, PWD))
+BATCH = int(os.getenv('NEO4J_BATCH_SIZE', '5000'))
+# evidências distintas guardadas por aresta (as mais recentes)
+EVIDENCE_MAX = int(os.getenv('NEO4J_EVIDENCE_MAX', '20'))
+# execute_write re-tenta erros transitórios (deadlock, líder trocado...) até este tempo
+driver = GraphDatabase.driver(
+    URI,
+    auth=(USER, PWD),
+    max_transaction_retry_time=float(os.getenv('NEO4J_TX_RETRY_SECONDS', '30')),
+)
+
+# ---------- Schema ----------
+SCHEMA = [
+    'CREATE CONSTRAINT entity_id IF NOT EXISTS FOR (n:Entity) REQUIRE n.id IS UNIQUE',
+    'CREATE INDEX entity_name IF NOT EXISTS FOR (n:Entity) ON (n.name)',
+    'CREATE INDEX entity_type IF NOT EXISTS FOR (n:Entity) ON (n.type)',
+    'CREATE INDEX entity_updated IF NOT EXISTS FOR (n:Entity) ON (n.updated_at)',
+]
+_schema_ready = False
+
+def ensure_schema():
+    """Constraint de unicidade em :Entity(id) (MERGE vira index seek) + índices auxiliares."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with driver.session() as s:
+        for q in SCHEMA:
+            s.run(q).consume()
+    _schema_ready = True
 
 # ---------- Sanitização ----------
 def _to_primitive(x: Any) -> Any:
@@ -35,7 +62,36 @@ def _ev_to_str(ev: Any) -> str:
     return (v or '')[:600]
 
 # ---------- Upserts ----------
-def upsert_nodes(nodes: Iterable[Dict]):
+NODES_Q = '''
+UNWIND $rows AS row
+MERGE (n:Entity {id: row.id})
+SET n += {
+    name: row.name,
+    type: row.type,
+    aliases: row.aliases,
+    line: row.line,
+    edition: row.edition,
+    source: row.source,
+    updated_at: timestamp()
+}
+'''
+
+# re-ingerir a mesma página não repete evidência (replay é idempotente) e a
+# lista fica limitada às EVIDENCE_MAX mais recentes
+EDGES_Q = '''
+UNWIND $rows AS row
+MERGE (a:Entity {id: row.src}) ON CREATE SET a.updated_at = timestamp()
+MERGE (b:Entity {id: row.dst}) ON CREATE SET b.updated_at = timestamp()
+MERGE (a)-[r:REL {rel: row.rel}]->(b)
+ON CREATE SET r.evidence = [row.evidence], r.confidence = row.confidence
+ON MATCH  SET r.evidence = CASE
+               WHEN row.evidence IN coalesce(r.evidence, []) THEN r.evidence
+               ELSE (coalesce(r.evidence, []) + [row.evidence])[-%d..]
+             END,
+             r.confidence = row.confidence
+''' % EVIDENCE_MAX
+
+def node_rows(nodes: Iterable[Dict]) -> List[Dict]:
     clean_rows: List[Dict] = []
     for n in nodes:
         clean_rows.append({
@@ -47,22 +103,9 @@ def upsert_nodes(nodes: Iterable[Dict]):
             'edition': _to_primitive(n.get('edition')),
             'source':  _to_primitive(n.get('source')),
         })
-    q = '''
-    UNWIND $rows AS row
-    MERGE (n:Entity {id: row.id})
-    SET n += {
-        name: row.name,
-        type: row.type,
-        aliases: row.aliases,
-        line: row.line,
-        edition: row.edition,
-        source: row.source
-    }
-    '''
-    with driver.session() as s:
-        s.run(q, rows=clean_rows)
+    return clean_rows
 
-def upsert_edges(edges: Iterable[Dict]):
+def edge_rows(edges: Iterable[Dict]) -> List[Dict]:
     rows: List[Dict] = []
     for e in edges:
         rows.append({
@@ -72,14 +115,65 @@ def upsert_edges(edges: Iterable[Dict]):
             'confidence': _to_primitive(e.get('confidence') or 'low'),
             'evidence': _ev_to_str(e.get('evidence')),
         })
-    q = '''
-    UNWIND $rows AS row
-    MERGE (a:Entity {id: row.src})
-    MERGE (b:Entity {id: row.dst})
-    MERGE (a)-[r:REL {rel: row.rel}]->(b)
-    ON CREATE SET r.evidence = [row.evidence], r.confidence = row.confidence
-    ON MATCH  SET r.evidence = coalesce(r.evidence, []) + [row.evidence],
-                 r.confidence = row.confidence
-    '''
+    return rows
+
+def _write_rows(q: str, rows: List[Dict], batch: int = BATCH):
+    """UNWIND em lotes, cada lote numa transação gerenciada (execute_write, com retry)."""
+    if not rows:
+        return
+    ensure_schema()
+    def work(tx, chunk):
+        tx.run(q, rows=chunk).consume()
     with driver.session() as s:
-        s.run(q, rows=rows)
+        for i in range(0, len(rows), batch):
+            s.execute_write(work, rows[i:i + batch])
+
+def upsert_nodes(nodes: Iterable[Dict]):
+    _write_rows(NODES_Q, node_rows(nodes))
+
+def upsert_edges(edges: Iterable[Dict]):
+    _write_rows(EDGES_Q, edge_rows(edges))
+
+# ---------- Writer bufferizado ----------
+class GraphWriter:
+    """
+    Acumula linhas de nós/arestas de vários títulos e grava em lotes grandes
+    de UNWIND (nós antes das arestas). flush() quando o buffer passa de
+    `batch` linhas ou quando o chamador pede; close() faz o flush final.
+    """
+
+    def __init__(self, batch: int = BATCH):
+        self.batch = batch
+        self._nodes: List[Dict] = []
+        self._edges: List[Dict] = []
+
+    def __len__(self) -> int:
+        return len(self._nodes) + len(self._edges)
+
+    def add_nodes(self, nodes: Iterable[Dict]):
+        self._nodes.extend(node_rows(nodes))
+        if len(self) >= self.batch:
+            self.flush()
+
+    def add_edges(self, edges: Iterable[Dict]):
+        self._edges.extend(edge_rows(edges))
+        if len(self) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        nodes, self._nodes = self._nodes, []
+        edges, self._edges = self._edges, []
+        _write_rows(NODES_Q, nodes, self.batch)
+        _write_rows(EDGES_Q, edges, self.batch)
+
+    def close(self):
+        self.flush()
+
+_writer: Optional[GraphWriter] = None
+
+def get_writer() -> GraphWriter:
+    """Writer global do processo (reaproveitado entre títulos)."""
+    global _writer
+    if _writer is None:
+        _writer = GraphWriter()
+    return _writer
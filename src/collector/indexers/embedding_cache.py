@@ -0,0 +1,93 @@
+# src/collector/indexers/embedding_cache.py
+"""
+Cache persistente de embeddings de passagens (SQLite).
+
+- Chave: sha1(modelo + texto da passagem) — o mesmo texto com o mesmo
+  modelo nunca é re-embeddado, mesmo entre execuções/re-ingestões.
+- Valor: vetor float32 serializado (array('f')), com a dimensão.
+- WAL + timeout, então vários workers (processos) podem usar o mesmo arquivo.
+"""
+
+import os
+import sqlite3
+import hashlib
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "checkpoints/embeddings.db")
+
+DDL = """
+CREATE TABLE IF NOT EXISTS emb(
+  hash TEXT PRIMARY KEY,
+  dim  INTEGER NOT NULL,
+  vec  BLOB NOT NULL
+);
+"""
+
+# limite de parâmetros por SELECT ... IN (...)
+_IN_CHUNK = 500
+
+
+def passage_hash(model: str, text: str) -> str:
+    return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _pack(vec: Sequence[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = EMBED_CACHE_PATH):
+        self.path = path
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._con = sqlite3.connect(path, timeout=60)
+        self._con.execute("PRAGMA journal_mode=WAL;")
+        self._con.execute("PRAGMA synchronous=NORMAL;")
+        self._con.executescript(DDL)
+        self._con.commit()
+
+    def get_many(self, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        hashes = list(dict.fromkeys(hashes))
+        out: Dict[str, List[float]] = {}
+        for i in range(0, len(hashes), _IN_CHUNK):
+            chunk = hashes[i : i + _IN_CHUNK]
+            q = f"SELECT hash, vec FROM emb WHERE hash IN ({','.join('?' * len(chunk))})"
+            for h, blob in self._con.execute(q, chunk):
+                out[h] = _unpack(blob)
+        return out
+
+    def put_many(self, items: Iterable[Tuple[str, Sequence[float]]]):
+        rows = [(h, len(v), _pack(v)) for h, v in items]
+        if not rows:
+            return
+        self._con.executemany(
+            "INSERT OR IGNORE INTO emb(hash, dim, vec) VALUES(?,?,?)", rows
+        )
+        self._con.commit()
+
+    def __len__(self) -> int:
+        return int(self._con.execute("SELECT COUNT(*) FROM emb").fetchone()[0])
+
+    def close(self):
+        self._con.close()
+
+
+_cache: Optional[EmbeddingCache] = None
+
+
+def get_cache() -> Optional[EmbeddingCache]:
+    """Cache global do processo; None se EMBED_CACHE_PATH estiver vazio (desligado)."""
+    global _cache
+    if not EMBED_CACHE_PATH:
+        return None
+    if _cache is None:
+        _cache = EmbeddingCache(EMBED_CACHE_PATH)
+    return _cache
@@ -0,0 +1,408 @@
+# src/collector/indexers/mmap_index.py
+"""
+Backend vetorial embutido (VECTOR_BACKEND=mmap), sem container do Qdrant.
+
+Layout em <VECTOR_MMAP_DIR>:
+  vectors.bin        matriz (n x dim) float16 ou int8, linha a linha
+  scales.bin         float32 por linha (só int8: x ≈ int8 * scale)
+  rows.db            SQLite: meta(dim, dtype, ivf_rows, tombstones),
+                     rows(row -> pid, title, payload JSON) — o "sidecar"
+                     id→passagem — e tombstones(row) das linhas removidas
+  ivf_centroids.npy  (opcional) centróides do IVF  (nlist x dim)
+  ivf_order.npy      linhas ordenadas por lista
+  ivf_offsets.npy    início de cada lista em ivf_order (nlist + 1)
+
+- Escrita (ingestão): append/overwrite de linhas de tamanho fixo, dentro de
+  um BEGIN IMMEDIATE no rows.db, então vários workers podem escrever.
+- Leitura (QA): np.memmap somente-leitura; vários workers do uvicorn
+  compartilham as mesmas páginas do page cache do SO em vez de cada um
+  carregar sua cópia. O mapa é refeito quando o arquivo cresce.
+- Remoção (delete_stale): a linha sai do sidecar e vira tombstone; o
+  slot na matriz não é reaproveitado e a busca dá score -inf a ele.
+- Busca: produto matricial NumPy em blocos de VECTOR_BLOCK_ROWS linhas
+  (plano) ou só nas `nprobe` listas mais próximas (IVF), mais as linhas
+  gravadas depois do último build do IVF. Vetores normalizados:
+  produto interno == cosseno.
+
+Build do IVF (k-means esférico numa amostra):
+  python -m src.collector.indexers.mmap_index build-ivf --nlist 256
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+VECTOR_MMAP_DIR = os.getenv("VECTOR_MMAP_DIR", "checkpoints/vectors")
+VECTOR_MMAP_DTYPE = os.getenv("VECTOR_MMAP_DTYPE", "float16")  # float16 | int8
+VECTOR_BLOCK_ROWS = int(os.getenv("VECTOR_BLOCK_ROWS", "65536"))
+VECTOR_IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "8"))
+
+DDL = """
+CREATE TABLE IF NOT EXISTS meta(
+  key   TEXT PRIMARY KEY,
+  value TEXT
+);
+CREATE TABLE IF NOT EXISTS rows(
+  row     INTEGER PRIMARY KEY,
+  pid     TEXT NOT NULL UNIQUE,
+  payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tombstones(
+  row INTEGER PRIMARY KEY
+);
+"""
+
+# depois da migração da coluna title (índices antigos não a têm)
+DDL_TITLE = "CREATE INDEX IF NOT EXISTS rows_title ON rows(title);"
+
+_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+def _quantize(vecs: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    if dtype == "int8":
+        scale = np.abs(vecs).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        q = np.clip(np.rint(vecs / scale[:, None]), -127, 127).astype(np.int8)
+        return q, scale.astype(np.float32)
+    return vecs.astype(np.float16), None
+
+
+class MmapBackend:
+    name = "mmap"
+
+    def __init__(self, path: str = VECTOR_MMAP_DIR, dtype: str = VECTOR_MMAP_DTYPE):
+        if dtype not in _DTYPES:
+            raise ValueError(f"VECTOR_MMAP_DTYPE inválido: {dtype!r}")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._vec_path = os.path.join(path, "vectors.bin")
+        self._scale_path = os.path.join(path, "scales.bin")
+        self._con = sqlite3.connect(
+            os.path.join(path, "rows.db"), timeout=60, check_same_thread=False
+        )
+        self._con.execute("PRAGMA journal_mode=WAL;")
+        self._con.executescript(DDL)
+        cols = {r[1] for r in self._con.execute("PRAGMA table_info(rows)")}
+        if "title" not in cols:
+            self._con.execute("ALTER TABLE rows ADD COLUMN title TEXT")
+            self._con.execute("UPDATE rows SET title=json_extract(payload, '$.title')")
+        self._con.executescript(DDL_TITLE)
+        self._con.commit()
+        self._lock = threading.Lock()
+        self.dim = self._meta("dim")
+        self.dim = int(self.dim) if self.dim else None
+        self.dtype = self._meta("dtype") or dtype
+        self._map: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._ivf = None
+        self._ivf_rows = 0
+        self._ivf_mtime = None
+        # máscara das linhas removidas (None = nenhuma) e a versão lida
+        self._dead: Optional[np.ndarray] = None
+        self._dead_version = None
+
+    # --- meta ---
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._con.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self._con.execute(
+            "INSERT INTO meta(key,value) VALUES(?,?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (key, str(value)),
+        )
+
+    @property
+    def _row_bytes(self) -> int:
+        return self.dim * np.dtype(_DTYPES[self.dtype]).itemsize
+
+    # --- escrita ---
+    def ensure(self, dim: int):
+        if self.dim is None:
+            with self._lock:
+                self._set_meta("dim", dim)
+                self._set_meta("dtype", self.dtype)
+                self._con.commit()
+                self.dim = dim
+        elif self.dim != dim:
+            raise ValueError(f"dimensão {dim} != {self.dim} do índice em {self.path}")
+
+    def upsert(self, points: Sequence[Tuple[str, List[float], Dict]]):
+        if not points:
+            return
+        vecs = np.asarray([p[1] for p in points], dtype=np.float32)
+        self.ensure(vecs.shape[1])
+        q, scales = _quantize(vecs, self.dtype)
+        rb = self._row_bytes
+        with self._lock:
+            con = self._con
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                existing = dict(
+                    con.execute(
+                        f"SELECT pid, row FROM rows WHERE pid IN ({','.join('?' * len(points))})",
+                        [p[0] for p in points],
+                    ).fetchall()
+                )
+                # tombstones contam: slot de linha removida não é reaproveitado
+                nxt = con.execute(
+                    "SELECT COALESCE(MAX(m) + 1, 0) FROM ("
+                    " SELECT MAX(row) AS m FROM rows UNION ALL SELECT MAX(row) FROM tombstones)"
+                ).fetchone()[0]
+                rows = []
+                for pid, _v, _pl in points:
+                    if pid in existing:
+                        rows.append(existing[pid])
+                    else:
+                        existing[pid] = nxt
+                        rows.append(nxt)
+                        nxt += 1
+                mode = "r+b" if os.path.exists(self._vec_path) else "w+b"
+                with open(self._vec_path, mode) as f:
+                    for i, row in enumerate(rows):
+                        f.seek(row * rb)
+                        f.write(q[i].tobytes())
+                if scales is not None:
+                    mode = "r+b" if os.path.exists(self._scale_path) else "w+b"
+                    with open(self._scale_path, mode) as f:
+                        for i, row in enumerate(rows):
+                            f.seek(row * 4)
+                            f.write(scales[i].tobytes())
+                con.executemany(
+                    "INSERT INTO rows(row,pid,title,payload) VALUES(?,?,?,?) "
+                    "ON CONFLICT(pid) DO UPDATE SET title=excluded.title, payload=excluded.payload",
+                    [
+                        (row, pid, pl.get("title"), json.dumps(pl, ensure_ascii=False))
+                        for row, (pid, _v, pl) in zip(rows, points)
+                    ],
+                )
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+
+    def delete_stale(self, keep: Dict[str, List[str]]) -> int:
+        """
+        Para cada título em `keep`, remove as linhas cujo pid não está na
+        lista (tombstone). Retorna quantas linhas saíram.
+        """
+        dead: List[int] = []
+        with self._lock:
+            con = self._con
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                for title, pids in keep.items():
+                    kept = set(pids)
+                    dead.extend(
+                        row
+                        for row, pid in con.execute("SELECT row, pid FROM rows WHERE title=?", (title,))
+                        if pid not in kept
+                    )
+                if dead:
+                    con.executemany("INSERT OR IGNORE INTO tombstones(row) VALUES(?)", [(r,) for r in dead])
+                    con.executemany("DELETE FROM rows WHERE row=?", [(r,) for r in dead])
+                    version = int(self._meta("tombstones") or 0) + 1
+                    self._set_meta("tombstones", version)
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+        return len(dead)
+
+    # --- leitura ---
+    def _matrix(self) -> Optional[np.ndarray]:
+        """memmap somente-leitura; remapeia se o arquivo cresceu."""
+        if self.dim is None:
+            d = self._meta("dim")
+            if not d:
+                return None
+            self.dim, self.dtype = int(d), self._meta("dtype") or self.dtype
+        if not os.path.exists(self._vec_path):
+            return None
+        n = os.path.getsize(self._vec_path) // self._row_bytes
+        if self.dtype == "int8":
+            # só linhas completas (vetor e escala já gravados)
+            n = min(n, os.path.getsize(self._scale_path) // 4 if os.path.exists(self._scale_path) else 0)
+        if self._map is None or self._map.shape[0] != n:
+            if n == 0:
+                return None
+            self._map = np.memmap(
+                self._vec_path, dtype=_DTYPES[self.dtype], mode="r", shape=(n, self.dim)
+            )
+            if self.dtype == "int8":
+                self._scales = np.memmap(self._scale_path, dtype=np.float32, mode="r", shape=(n,))
+        self._load_ivf()
+        self._load_dead(n)
+        return self._map
+
+    def _load_dead(self, n: int):
+        version = self._meta("tombstones")
+        if version == self._dead_version and (self._dead is None or self._dead.shape[0] == n):
+            return
+        dead = np.zeros(n, dtype=bool)
+        rows = [r for (r,) in self._con.execute("SELECT row FROM tombstones WHERE row < ?", (n,))]
+        dead[rows] = True
+        self._dead = dead if rows else None
+        self._dead_version = version
+
+    def _load_ivf(self):
+        p = os.path.join(self.path, "ivf_offsets.npy")
+        if not os.path.exists(p):
+            self._ivf = None
+            return
+        mtime = os.path.getmtime(p)
+        if mtime == self._ivf_mtime:
+            return
+        load = lambda name: np.load(os.path.join(self.path, name), mmap_mode="r")
+        self._ivf = (load("ivf_centroids.npy"), load("ivf_order.npy"), load("ivf_offsets.npy"))
+        self._ivf_rows = int(self._meta("ivf_rows") or 0)
+        self._ivf_mtime = mtime
+
+    def _score(self, X: np.ndarray, Q: np.ndarray, rows) -> np.ndarray:
+        """Q (m x dim) contra as linhas `rows` (slice ou índices) -> (m x r)."""
+        S = np.asarray(X[rows], dtype=np.float32) @ Q.T
+        if self._scales is not None:
+            S *= np.asarray(self._scales[rows], dtype=np.float32)[:, None]
+        if self._dead is not None:
+            S[self._dead[rows]] = -np.inf
+        return S.T
+
+    def _topk_flat(self, X: np.ndarray, Q: np.ndarray, k: int, start: int = 0):
+        best_s = np.full((Q.shape[0], 0), -np.inf, dtype=np.float32)
+        best_i = np.zeros((Q.shape[0], 0), dtype=np.int64)
+        for b in range(start, X.shape[0], VECTOR_BLOCK_ROWS):
+            e = min(b + VECTOR_BLOCK_ROWS, X.shape[0])
+            S = self._score(X, Q, slice(b, e))
+            best_s = np.concatenate([best_s, S], axis=1)
+            best_i = np.concatenate([best_i, np.broadcast_to(np.arange(b, e), S.shape)], axis=1)
+            if best_s.shape[1] > k:
+                part = np.argpartition(-best_s, k - 1, axis=1)[:, :k]
+                best_s = np.take_along_axis(best_s, part, axis=1)
+                best_i = np.take_along_axis(best_i, part, axis=1)
+        return best_s, best_i
+
+    def _topk_ivf(self, X: np.ndarray, q: np.ndarray, k: int, nprobe: int):
+        centroids, order, offsets = self._ivf
+        lists = np.argsort(-(np.asarray(centroids) @ q))[:nprobe]
+        cand = np.concatenate([order[offsets[l] : offsets[l + 1]] for l in lists])
+        tail = np.arange(min(self._ivf_rows, X.shape[0]), X.shape[0])
+        cand = np.sort(np.concatenate([cand, tail]).astype(np.int64))
+        if cand.size == 0:
+            return np.zeros(0, np.float32), np.zeros(0, np.int64)
+        s = self._score(X, q[None, :], cand)[0]
+        top = np.argpartition(-s, min(k, s.size) - 1)[:k] if s.size > k else np.arange(s.size)
+        return s[top], cand[top]
+
+    def search_batch(
+        self, vectors: Sequence[Sequence[float]], k: int, nprobe: int = VECTOR_IVF_NPROBE
+    ) -> List[List[Tuple[float, Dict]]]:
+        """Top-k de várias consultas de uma vez (uma passada na matriz no modo plano)."""
+        with self._lock:
+            X = self._matrix()
+        if X is None or not len(vectors) or k <= 0:
+            return [[] for _ in vectors]
+        Q = np.asarray(vectors, dtype=np.float32)
+        if self._ivf is not None and nprobe > 0:
+            res = [self._topk_ivf(X, q, k, nprobe) for q in Q]
+        else:
+            S, I = self._topk_flat(X, Q, k)
+            res = list(zip(S, I))
+
+        wanted = {int(i) for _s, idx in res for i in idx}
+        payloads: Dict[int, Dict] = {}
+        if wanted:
+            rows = list(wanted)
+            with self._lock:
+                for i in range(0, len(rows), 500):
+                    chunk = rows[i : i + 500]
+                    q = f"SELECT row, payload FROM rows WHERE row IN ({','.join('?' * len(chunk))})"
+                    for row, pl in self._con.execute(q, chunk):
+                        payloads[row] = json.loads(pl)
+        out = []
+        for s, idx in res:
+            order = np.argsort(-s)
+            # linhas sem payload: escritas por um worker que ainda não comitou
+            out.append(
+                [(float(s[j]), payloads[int(idx[j])]) for j in order if int(idx[j]) in payloads]
+            )
+        return out
+
+    def search(self, vector: List[float], k: int) -> List[Tuple[float, Dict]]:
+        return self.search_batch([vector], k)[0]
+
+    def __len__(self) -> int:
+        return int(self._con.execute("SELECT COUNT(*) FROM rows").fetchone()[0])
+
+    # --- IVF ---
+    def build_ivf(self, nlist: int = 256, iters: int = 10, sample: int = 100_000, seed: int = 0):
+        """k-means esférico numa amostra; depois atribui todas as linhas às listas."""
+        with self._lock:
+            X = self._matrix()
+        if X is None:
+            raise RuntimeError(f"índice vazio em {self.path}")
+        n = X.shape[0]
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(seed)
+        idx = np.sort(rng.choice(n, size=min(sample, n), replace=False))
+
+        def rows_f32(rows):
+            A = np.asarray(X[rows], dtype=np.float32)
+            if self._scales is not None:
+                A *= np.asarray(self._scales[rows], dtype=np.float32)[:, None]
+            return A
+
+        S = rows_f32(idx)
+        C = S[rng.choice(S.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            a = np.argmax(S @ C.T, axis=1)
+            for c in range(nlist):
+                m = S[a == c]
+                if len(m):
+                    C[c] = m.mean(axis=0)
+            C /= np.maximum(np.linalg.norm(C, axis=1, keepdims=True), 1e-12)
+
+        assign = np.empty(n, dtype=np.int32)
+        for b in range(0, n, VECTOR_BLOCK_ROWS):
+            e = min(b + VECTOR_BLOCK_ROWS, n)
+            assign[b:e] = np.argmax(rows_f32(slice(b, e)) @ C.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1)).astype(np.int64)
+
+        # offsets por último: é o arquivo cujo mtime dispara o reload nos leitores
+        np.save(os.path.join(self.path, "ivf_centroids.npy"), C.astype(np.float32))
+        np.save(os.path.join(self.path, "ivf_order.npy"), order)
+        with self._lock:
+            self._set_meta("ivf_rows", n)
+            self._con.commit()
+        np.save(os.path.join(self.path, "ivf_offsets.npy"), offsets)
+        return {"rows": n, "nlist": nlist}
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser("Índice vetorial mmap (VECTOR_BACKEND=mmap)")
+    ap.add_argument("cmd", choices=["stats", "build-ivf"])
+    ap.add_argument("--dir", default=VECTOR_MMAP_DIR)
+    ap.add_argument("--nlist", type=int, default=256)
+    ap.add_argument("--iters", type=int, default=10)
+    args = ap.parse_args()
+
+    b = MmapBackend(args.dir)
+    if args.cmd == "build-ivf":
+        print(f"[ivf] {b.build_ivf(nlist=args.nlist, iters=args.iters)}")
+    else:
+        X = b._matrix()
+        print(
+            f"[stats] linhas={len(b)} dim={b.dim} dtype={b.dtype} "
+            f"matriz={None if X is None else X.shape} ivf={'sim' if b._ivf is not None else 'não'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 import os
-from typing import Dict, Iterable
+import json
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
 from opensearchpy import OpenSearch
+from opensearchpy.exceptions import NotFoundError, TransportError
+
+from ..metrics import metrics
 
 INDEX = os.getenv("OPENSEARCH_INDEX", "passages-wod")
 URL = os.getenv("OPENSEARCH_URL", "http://localhost:9200")
@@ -20,49 +25,234 @@ MAPPING = {
 }
 
 
-def ensure_index():
+_index_ready = False
+
+
+def ensure_index(force: bool = False):
+    """
+    Cria o índice se não existir. O resultado fica em cache no processo,
+    então chamadas repetidas não custam um HEAD por título.
+    """
+    global _index_ready
+    if _index_ready and not force:
+        return
     exists = client.indices.exists(index=INDEX)
     if not exists:
         client.indices.create(index=INDEX, body=MAPPING)
+    _index_ready = True
+
 
+# --- Geração do índice ---
+# Contador num índice auxiliar (<INDEX>-meta, doc "generation"), incrementado
+# pela ingestão depois de gravar; o lado de QA usa como marcador para
+# invalidar caches (respostas, snapshots) quando o índice muda.
+META_INDEX = os.getenv("OPENSEARCH_META_INDEX", f"{INDEX}-meta")
+GENERATION_DOC = "generation"
 
-def bulk_upsert(passages: Iterable[Dict]):
+
+def bump_generation() -> None:
     """
-    Faz bulk upsert em batches.
-    - Garante que o índice exista.
-    - Remove campos inválidos (_id) do documento.
-    - Loga erros retornados pelo OpenSearch.
+    Incrementa a geração do índice (upsert atômico no doc de meta). Antes
+    faz refresh do índice de passagens: o QA só vê a geração nova quando
+    os docs da ingestão já são buscáveis — senão ele cacheia o resultado
+    antigo sob a geração nova até o TTL.
     """
-    from itertools import islice
+    client.indices.refresh(index=INDEX)
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    client.update(
+        index=META_INDEX,
+        id=GENERATION_DOC,
+        body={
+            "script": {
+                "source": "ctx._source.generation += 1; ctx._source.updated_at = params.now",
+                "params": {"now": now},
+            },
+            "upsert": {"generation": 1, "updated_at": now},
+        },
+        retry_on_conflict=5,
+        refresh=True,
+    )
+
 
-    ensure_index()
+def get_generation() -> int:
+    try:
+        doc = client.get(index=META_INDEX, id=GENERATION_DOC)
+    except NotFoundError:
+        return 0
+    return int((doc.get("_source") or {}).get("generation", 0))
 
-    def chunks(iterable, n=500):
-        it = iter(iterable)
-        while True:
-            batch = list(islice(it, n))
-            if not batch:
+
+# status/erros de item que valem retry (fila de bulk cheia no cluster)
+_RETRY_STATUS = {429}
+_RETRY_ERRORS = {"es_rejected_execution_exception", "rejected_execution_exception"}
+
+
+def _retryable(item: Dict) -> bool:
+    if item.get("status") in _RETRY_STATUS:
+        return True
+    err = item.get("error") or {}
+    return isinstance(err, dict) and err.get("type") in _RETRY_ERRORS
+
+
+class BulkWriter:
+    """
+    Writer de bulk de longa duração para OpenSearch.
+
+    - Acumula passagens de vários títulos e faz flush por quantidade
+      (max_docs) ou tamanho do payload (max_bytes).
+    - Usa o `_id` determinístico da passagem (_stable_id) como _id do doc:
+      re-ingerir a mesma página sobrescreve em vez de duplicar; passagens
+      que a versão nova não produz mais são removidas com delete_stale().
+    - Não força refresh por request; quem quiser visibilidade imediata chama
+      refresh() (ou close(refresh=True)) uma vez no fim.
+    - Itens rejeitados com 429 / es_rejected_execution são reenviados com
+      backoff exponencial; flush() devolve o resultado de cada item enviado
+      desde o último flush() explícito (inclusive flushes automáticos):
+        {"_id", "title", "status", "error"}
+    """
+
+    def __init__(
+        self,
+        os_client: OpenSearch = None,
+        index: str = INDEX,
+        max_docs: int = int(os.getenv("OPENSEARCH_BULK_DOCS", "1000")),
+        max_bytes: int = int(os.getenv("OPENSEARCH_BULK_BYTES", str(5 * 1024 * 1024))),
+        max_retries: int = 5,
+        backoff: float = 0.5,
+    ):
+        self.client = os_client or client
+        self.index = index
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # buffer: (_id, title, linha de ação, linha do doc)
+        self._buf: List[Tuple[Optional[str], Optional[str], str, str]] = []
+        self._bytes = 0
+        # resultados de flushes automáticos, entregues no próximo flush()
+        self._carry: List[Dict] = []
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def add(self, doc: Dict):
+        doc = dict(doc)
+        doc_id = doc.pop("_id", None)
+        action = {"index": {"_index": self.index}}
+        if doc_id:
+            action["index"]["_id"] = doc_id
+        a = json.dumps(action)
+        d = json.dumps(doc, ensure_ascii=False)
+        self._buf.append((doc_id, doc.get("title"), a, d))
+        self._bytes += len(a) + len(d) + 2
+        if len(self._buf) >= self.max_docs or self._bytes >= self.max_bytes:
+            self._carry.extend(self._flush_buffer())
+
+    def add_many(self, docs: Iterable[Dict]):
+        for doc in docs:
+            self.add(doc)
+
+    def _send(self, entries) -> List[Dict]:
+        body = "".join(f"{a}\n{d}\n" for _id, _t, a, d in entries)
+        resp = self.client.bulk(body=body)
+        return [item.get("index", {}) for item in resp.get("items", [])]
+
+    def flush(self) -> List[Dict]:
+        carry, self._carry = self._carry, []
+        return carry + self._flush_buffer()
+
+    def _flush_buffer(self) -> List[Dict]:
+        if not self._buf:
+            return []
+        ensure_index()
+        pending = self._buf
+        self._buf = []
+        self._bytes = 0
+
+        results: List[Dict] = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                items = self._send(pending)
+            except TransportError as e:
+                if e.status_code in _RETRY_STATUS and attempt < self.max_retries:
+                    metrics.inc("retries_total", reason="opensearch_429")
+                    time.sleep(self.backoff * (2 ** attempt))
+                    continue
+                raise
+            retry = []
+            for entry, item in zip(pending, items):
+                if _retryable(item) and attempt < self.max_retries:
+                    retry.append(entry)
+                    continue
+                results.append({
+                    "_id": item.get("_id", entry[0]),
+                    "title": entry[1],
+                    "status": item.get("status"),
+                    "error": item.get("error"),
+                })
+            if not retry:
                 break
-            yield batch
+            metrics.inc("retries_total", len(retry), reason="opensearch_rejected")
+            pending = retry
+            time.sleep(self.backoff * (2 ** attempt))
 
-    ops = []
+        errors = [r for r in results if r["error"]]
+        if errors:
+            print(f"[WARN] OpenSearch bulk: {len(errors)} erros em index={self.index}:")
+            for r in errors[:10]:
+                print("  -", r["title"], r["error"])
+        return results
 
-    for batch in chunks(passages, 500):
-        ops.clear()
-        for doc in batch:
-            # Evita conflito com metadados do OpenSearch
-            if "_id" in doc:
-                doc = dict(doc)  # copia rasa pra não mutar o original em outros lugares
-                doc.pop("_id", None)
+    def delete_stale(self, keep: Dict[str, List[str]]) -> int:
+        """
+        Remove, para cada título em `keep`, os docs cujo _id não está na
+        lista (passagens de uma versão anterior da página). Um único
+        delete_by_query para todos os títulos; retorna quantos docs saíram.
+        """
+        if not keep:
+            return 0
+        should = []
+        for title, ids in keep.items():
+            q: Dict = {"filter": [{"term": {"title": title}}]}
+            if ids:
+                q["must_not"] = [{"ids": {"values": list(ids)}}]
+            should.append({"bool": q})
+        resp = self.client.delete_by_query(
+            index=self.index,
+            body={"query": {"bool": {"should": should, "minimum_should_match": 1}}},
+            conflicts="proceed",
+        )
+        deleted = int(resp.get("deleted", 0))
+        if deleted:
+            metrics.inc("stale_passages_deleted_total", deleted)
+        return deleted
 
-            ops.append({"index": {"_index": INDEX}})
-            ops.append(doc)
+    def refresh(self):
+        self.client.indices.refresh(index=self.index)
 
-        resp = client.bulk(body=ops, refresh=True)
+    def close(self, refresh: bool = False) -> List[Dict]:
+        results = self.flush()
+        if refresh:
+            self.refresh()
+        return results
 
-        if resp.get("errors"):
-            print(f"[WARN] OpenSearch bulk errors em index={INDEX}:")
-            for item in resp.get("items", []):
-                err = item.get("index", {}).get("error")
-                if err:
-                    print("  -", err)
+
+_writer: Optional[BulkWriter] = None
+
+
+def get_writer() -> BulkWriter:
+    """Writer global do processo (reaproveitado entre títulos)."""
+    global _writer
+    if _writer is None:
+        _writer = BulkWriter()
+    return _writer
+
+
+def bulk_upsert(passages: Iterable[Dict]) -> List[Dict]:
+    """
+    Upsert imediato (sem buffer entre chamadas) usando o `_id` das passagens.
+    Para ingestão em volume prefira get_writer().
+    """
+    writer = BulkWriter()
+    writer.add_many(passages)
+    return writer.flush()
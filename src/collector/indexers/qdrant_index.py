@@ -1,27 +1,308 @@
 # src/collector/indexers/qdrant_index.py
 """
-Stub de integração com Qdrant.
+Perna vetorial da ingestão (embeddings + índice vetorial).
 
-Motivo:
-- Evitar download de modelos SentenceTransformer via HuggingFace
-  durante o ingest.
-- Neste momento só estamos usando OpenSearch para RAG.
-
-Se no futuro você quiser reativar Qdrant, basta restaurar a
-implementação original e configurar o serviço.
+- Passagens são acumuladas num writer bufferizado (VectorWriter) e, no
+  flush, embeddadas em lotes grandes via qa.embeddings.embed_passages.
+- Cada vetor fica num cache persistente (embedding_cache) pela hash do
+  texto: re-ingerir passagens inalteradas nunca recalcula embedding.
+- O índice vetorial é um backend trocável (VECTOR_BACKEND):
+    qdrant  — Qdrant (upsert em lote, coleção criada sob demanda)
+    memory  — tudo em memória, força bruta; para testes/CI
+    mmap    — matriz float16/int8 em arquivo mapeado (mmap_index), sem serviço
+    none    — desligado
+  Por padrão só liga se EMBEDDING_MODEL_PATH (modelo local) estiver
+  definido, para a ingestão nunca baixar modelo do HuggingFace sozinha.
 """
 
-from typing import Dict, Iterable
+import os
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..metrics import metrics
+from .embedding_cache import get_cache, passage_hash
+
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "passages-wod")
+VECTOR_BACKEND = os.getenv(
+    "VECTOR_BACKEND", "qdrant" if os.getenv("EMBEDDING_MODEL_PATH") else "none"
+)
+# passagens acumuladas antes de embeddar/enviar
+VECTOR_BATCH = int(os.getenv("VECTOR_BATCH", "512"))
+# pontos por chamada de upsert
+UPSERT_BATCH = int(os.getenv("QDRANT_UPSERT_BATCH", "256"))
+
+PAYLOAD_FIELDS = ("title", "url", "section", "text", "offset")
+
+Point = Tuple[str, List[float], Dict]
+
+
+def point_id(passage_id: str) -> str:
+    """Qdrant só aceita inteiro ou UUID: o _id (md5 hex) vira UUID direto."""
+    try:
+        return str(uuid.UUID(hex=passage_id))
+    except (ValueError, TypeError):
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, str(passage_id)))
+
+
+# -----------------------------------------------------------------------------
+# Backends
+# -----------------------------------------------------------------------------
+class QdrantBackend:
+    name = "qdrant"
+
+    def __init__(self, url: str = QDRANT_URL, collection: str = QDRANT_COLLECTION):
+        from qdrant_client import QdrantClient
+
+        self.client = QdrantClient(url=url, timeout=30)
+        self.collection = collection
+        self._ready = False
+
+    def ensure(self, dim: int):
+        if self._ready:
+            return
+        from qdrant_client.models import Distance, PayloadSchemaType, VectorParams
+
+        if not self.client.collection_exists(self.collection):
+            self.client.create_collection(
+                self.collection,
+                vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+            )
+            # delete_stale filtra por título
+            self.client.create_payload_index(
+                self.collection, "title", field_schema=PayloadSchemaType.KEYWORD
+            )
+        self._ready = True
+
+    def upsert(self, points: List[Point]):
+        from qdrant_client.models import PointStruct
+
+        # wait=True: um lote rejeitado vira exceção aqui (e a página falha),
+        # em vez de sumir no servidor com a página marcada ok
+        for i in range(0, len(points), UPSERT_BATCH):
+            batch = points[i : i + UPSERT_BATCH]
+            self.client.upsert(
+                self.collection,
+                points=[PointStruct(id=pid, vector=vec, payload=pl) for pid, vec, pl in batch],
+                wait=True,
+            )
+
+    def delete_stale(self, keep: Dict[str, List[str]]):
+        """Remove os pontos de cada título em `keep` cujo id não está na lista."""
+        from qdrant_client.models import (
+            FieldCondition,
+            Filter,
+            FilterSelector,
+            HasIdCondition,
+            MatchValue,
+        )
+
+        should = []
+        for title, pids in keep.items():
+            cond = Filter(
+                must=[FieldCondition(key="title", match=MatchValue(value=title))],
+                must_not=[HasIdCondition(has_id=list(pids))] if pids else None,
+            )
+            should.append(cond)
+        if not should or not self.client.collection_exists(self.collection):
+            return
+        self.client.delete(
+            self.collection,
+            points_selector=FilterSelector(filter=Filter(should=should)),
+            wait=True,
+        )
+
+    def search(self, vector: List[float], k: int) -> List[Tuple[float, Dict]]:
+        hits = self.client.search(
+            self.collection, query_vector=vector, limit=k, with_payload=True
+        )
+        return [(float(h.score), h.payload or {}) for h in hits]
+
+
+class MemoryBackend:
+    """Stand-in local do Qdrant: dict em memória, busca por força bruta."""
+
+    name = "memory"
+
+    def __init__(self):
+        self.points: Dict[str, Tuple[List[float], Dict]] = {}
+
+    def ensure(self, dim: int):
+        pass
+
+    def upsert(self, points: List[Point]):
+        for pid, vec, pl in points:
+            self.points[pid] = (vec, pl)
+
+    def delete_stale(self, keep: Dict[str, List[str]]):
+        keep = {t: set(pids) for t, pids in keep.items()}
+        for pid, (_vec, pl) in list(self.points.items()):
+            kept = keep.get(pl.get("title"))
+            if kept is not None and pid not in kept:
+                del self.points[pid]
+
+    def search(self, vector: List[float], k: int) -> List[Tuple[float, Dict]]:
+        # vetores normalizados: produto interno == cosseno
+        scored = [
+            (sum(a * b for a, b in zip(vector, vec)), pl)
+            for vec, pl in self.points.values()
+        ]
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return scored[:k]
 
 
-def bulk_upsert(passages: Iterable[Dict]):
+def _mmap_backend():
+    # NumPy só é exigido por quem escolhe o backend embutido
+    from .mmap_index import MmapBackend
+
+    return MmapBackend()
+
+
+BACKENDS = {
+    "qdrant": QdrantBackend,
+    "memory": MemoryBackend,
+    "mmap": _mmap_backend,
+}
+
+_backend = None
+
+
+def get_backend():
+    """Backend vetorial do processo (VECTOR_BACKEND); None se desligado."""
+    global _backend
+    if _backend is None and VECTOR_BACKEND != "none":
+        if VECTOR_BACKEND not in BACKENDS:
+            raise ValueError(f"VECTOR_BACKEND inválido: {VECTOR_BACKEND!r}")
+        _backend = BACKENDS[VECTOR_BACKEND]()
+    return _backend
+
+
+def set_backend(backend):
+    """Troca o backend (ex.: MemoryBackend() em testes)."""
+    global _backend
+    _backend = backend
+
+
+# -----------------------------------------------------------------------------
+# Embeddings com cache
+# -----------------------------------------------------------------------------
+def embed_cached(texts: List[str]) -> List[List[float]]:
+    """
+    Embeddings de `texts` na mesma ordem; só o que não está no cache vai
+    para o modelo (num único embed_passages, que já agrupa em lotes).
+    """
+    from ...qa.embeddings import MODEL_ID, embed_passages
+
+    hashes = [passage_hash(MODEL_ID, t) for t in texts]
+    cache = get_cache()
+    found = cache.get_many(hashes) if cache is not None else {}
+    missing: Dict[str, str] = {}
+    for h, t in zip(hashes, texts):
+        if h not in found:
+            missing.setdefault(h, t)
+    metrics.inc("embed_cache_total", len(hashes) - len(missing), result="hit")
+    metrics.inc("embed_cache_total", len(missing), result="miss")
+    if missing:
+        with metrics.time("embed"):
+            vecs = embed_passages(list(missing.values()))
+        new = dict(zip(missing.keys(), vecs))
+        if cache is not None:
+            cache.put_many(new.items())
+        found.update(new)
+    return [found[h] for h in hashes]
+
+
+# -----------------------------------------------------------------------------
+# Writer bufferizado
+# -----------------------------------------------------------------------------
+class VectorWriter:
     """
-    Stub: simplesmente consome o iterável (para manter o fluxo igual)
-    e não envia nada para lugar nenhum.
+    Acumula passagens e, a cada `max_docs` (ou flush), embedda com cache e
+    faz upsert em lote no backend. Se o modelo não carregar, a perna
+    vetorial se desliga com um aviso em vez de falhar página por página.
     """
-    count = 0
-    for _ in passages:
-        count += 1
 
-    if count:
-        print(f"[INFO] Qdrant bulk_upsert desativado — ignorando {count} vetores.")
+    def __init__(self, backend=None, max_docs: int = VECTOR_BATCH):
+        self.backend = backend
+        self.max_docs = max_docs
+        self._buf: List[Dict] = []
+        self.disabled = False
+
+    @property
+    def enabled(self) -> bool:
+        if self.disabled:
+            return False
+        if self.backend is None:
+            self.backend = get_backend()
+        return self.backend is not None
+
+    def add_many(self, passages: Iterable[Dict]) -> int:
+        if not self.enabled:
+            return 0
+        n = 0
+        for p in passages:
+            if p.get("text"):
+                self._buf.append(p)
+                n += 1
+        if len(self._buf) >= self.max_docs:
+            self.flush()
+        return n
+
+    def flush(self) -> int:
+        if not self._buf or not self.enabled:
+            self._buf = []
+            return 0
+        pending, self._buf = self._buf, []
+        try:
+            vecs = embed_cached([p["text"] for p in pending])
+        except (ImportError, OSError) as e:
+            # sem sentence-transformers ou sem o modelo local
+            self.disabled = True
+            print(f"[WARN] embeddings indisponíveis — perna vetorial desligada: {e}", flush=True)
+            return 0
+        points = [
+            (
+                point_id(p.get("_id") or passage_hash("", p["text"])[:32]),
+                vec,
+                {k: p.get(k) for k in PAYLOAD_FIELDS} | {"passage_id": p.get("_id")},
+            )
+            for p, vec in zip(pending, vecs)
+        ]
+        with metrics.time("qdrant"):
+            self.backend.ensure(len(vecs[0]))
+            self.backend.upsert(points)
+        return len(points)
+
+    def delete_stale(self, keep: Dict[str, List[str]]):
+        """
+        Remove do backend os pontos de versões anteriores das páginas:
+        `keep` é {título: _ids das passagens atuais} (o mesmo mapa do
+        BulkWriter.delete_stale do OpenSearch).
+        """
+        if not keep or not self.enabled:
+            return
+        with metrics.time("qdrant"):
+            self.backend.delete_stale(
+                {t: [point_id(i) for i in ids] for t, ids in keep.items()}
+            )
+
+    def close(self):
+        self.flush()
+
+
+_writer: Optional[VectorWriter] = None
+
+
+def get_writer() -> VectorWriter:
+    """Writer global do processo (um buffer por worker)."""
+    global _writer
+    if _writer is None:
+        _writer = VectorWriter()
+    return _writer
+
+
+def bulk_upsert(passages: Iterable[Dict]) -> int:
+    """Embedda e envia `passages` de uma vez (writer temporário)."""
+    w = VectorWriter()
+    w.add_many(passages)
+    return w.flush()
@@ -3,13 +3,20 @@ import os
 import sys
 import time
 import signal
+import socket
 import sqlite3
+import heapq
+import threading
 import argparse
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from typing import Iterable, List
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-from .fandom_api import iter_allpages
+from .fandom_api import MAX_TITLES_PER_QUERY, iter_allpages_batches, iter_allpages_revisions
+from .metrics import metrics, serve as serve_metrics
+from .indexers.opensearch_index import bump_generation
 
 # --- OpenSearch: checar existência por title (keyword) ---
 from opensearchpy import OpenSearch
@@ -19,24 +26,101 @@ OS_INDEX = os.getenv("OPENSEARCH_INDEX", "passages-wod")
 _os_client = OpenSearch(OS_URL)
 
 
-def already_indexed_in_os(title: str) -> bool:
+def indexed_titles_in_os(titles: Iterable[str]) -> Set[str]:
     """
-    Retorna True se já existir qualquer doc com title == <title> no índice.
-    (title é 'keyword' no mapping, então term query casa exato)
+    Resolve um batch inteiro de títulos em UMA requisição (terms query +
+    terms aggregation em `title`; title é 'keyword' no mapping).
+    Retorna o subconjunto de títulos que já têm algum doc no índice.
     """
+    titles = [t for t in dict.fromkeys(titles) if t]
+    if not titles:
+        return set()
     try:
-        body = {"query": {"term": {"title": title}}, "size": 0}
+        body = {
+            "size": 0,
+            "query": {"terms": {"title": titles}},
+            "aggs": {"titles": {"terms": {"field": "title", "size": len(titles)}}},
+        }
         res = _os_client.search(index=OS_INDEX, body=body)
-        return res.get("hits", {}).get("total", {}).get("value", 0) > 0
+        buckets = res.get("aggregations", {}).get("titles", {}).get("buckets", [])
+        return {b.get("key") for b in buckets if b.get("key")}
     except Exception:
         # se OS estiver indisponível, não bloqueia ingestão
-        return False
+        return set()
+
+
+class IndexedTitles:
+    """
+    Conjunto local de títulos já indexados no OpenSearch.
+
+    - seed(): varre o índice UMA vez (composite aggregation paginada em
+      `title`) e carrega todos os títulos em memória.
+    - filter_indexed(batch): devolve os títulos do batch já indexados.
+      Quem está no conjunto local não gera requisição nenhuma; o resto é
+      resolvido com um único indexed_titles_in_os(batch).
+    - add(title): registra títulos ingeridos durante o run.
+    """
+
+    def __init__(self):
+        self._known: Set[str] = set()
+        self.seeded = False
+
+    def __len__(self) -> int:
+        return len(self._known)
+
+    def seed(self, page_size: int = 1000) -> int:
+        after = None
+        try:
+            while True:
+                comp = {
+                    "size": page_size,
+                    "sources": [{"title": {"terms": {"field": "title"}}}],
+                }
+                if after:
+                    comp["after"] = after
+                body = {"size": 0, "aggs": {"titles": {"composite": comp}}}
+                res = _os_client.search(index=OS_INDEX, body=body)
+                agg = res.get("aggregations", {}).get("titles", {})
+                for b in agg.get("buckets", []):
+                    t = (b.get("key") or {}).get("title")
+                    if t:
+                        self._known.add(t)
+                after = agg.get("after_key")
+                if not after or not agg.get("buckets"):
+                    break
+            self.seeded = True
+        except Exception as e:
+            # índice ainda não existe / OS indisponível: segue só com o lote
+            print(f"[WARN] seed de títulos indexados falhou: {e!r}", flush=True)
+        return len(self._known)
+
+    def add(self, title: str):
+        self._known.add(title)
+
+    def filter_indexed(self, titles: Iterable[str]) -> Set[str]:
+        titles = list(titles)
+        hits = {t for t in titles if t in self._known}
+        unknown = [t for t in titles if t not in self._known]
+        if unknown:
+            found = indexed_titles_in_os(unknown)
+            self._known.update(found)
+            hits |= found
+        return hits
 
 
 # --- Checkpoint (SQLite) ---
 DB_PATH = os.getenv("INGEST_DB_PATH", "checkpoints/ingest.db")
 DEFAULT_BATCH = int(os.getenv("INGEST_BATCH_SIZE", "100"))
 DEFAULT_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "3"))
+DEFAULT_EXEC_MODE = os.getenv("INGEST_EXEC_MODE", "inprocess")
+DEFAULT_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+DEFAULT_RECYCLE_AFTER = int(os.getenv("INGEST_RECYCLE_AFTER", "500"))
+# commit em grupo: no máximo a cada N atualizações de página
+COMMIT_EVERY = int(os.getenv("INGEST_COMMIT_EVERY", "200"))
+# lease de cada batch reivindicado; renovado enquanto o worker progride
+DEFAULT_LEASE_SECONDS = int(os.getenv("INGEST_LEASE_SECONDS", "900"))
+DEFAULT_WORKER_ID = os.getenv("INGEST_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+DEFAULT_METRICS_PORT = int(os.getenv("INGEST_METRICS_PORT", "9108"))
 
 STOP = False
 
@@ -52,13 +136,54 @@ signal.signal(signal.SIGTERM, _signal_handler)
 DDL_PAGES = """
 CREATE TABLE IF NOT EXISTS pages(
   title TEXT PRIMARY KEY,
-  status TEXT NOT NULL,              -- pending | ok | failed | skipped
+  status TEXT NOT NULL,              -- pending | claimed | ok | failed | skipped
   tries  INTEGER NOT NULL DEFAULT 0,
   last_error TEXT,
-  updated_at TEXT NOT NULL
+  updated_at TEXT NOT NULL,
+  revid INTEGER,                     -- revisão ingerida por último
+  content_hash TEXT,                 -- sha1 do wikitext ingerido
+  claimed_by TEXT,                   -- worker dono do lease (status=claimed)
+  lease_until REAL                   -- epoch em que o lease expira
 );
 """
 
+# colunas adicionadas depois da criação da tabela (migração in-place)
+PAGES_EXTRA_COLUMNS = {
+    "revid": "INTEGER",
+    "content_hash": "TEXT",
+    "claimed_by": "TEXT",
+    "lease_until": "REAL",
+}
+
+# fila: (status, tries, updated_at) cobre pending_titles sem sort/scan
+DDL_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_pages_queue ON pages(status, tries, updated_at, title);
+"""
+
+# contadores por (status, tries) mantidos por trigger: remaining()/summary
+# leem poucas linhas em vez de COUNT(*) na tabela inteira
+DDL_COUNTS = """
+CREATE TABLE IF NOT EXISTS page_counts(
+  status TEXT NOT NULL,
+  tries  INTEGER NOT NULL,
+  n      INTEGER NOT NULL,
+  PRIMARY KEY(status, tries)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS pages_counts_ai AFTER INSERT ON pages BEGIN
+  INSERT INTO page_counts(status,tries,n) VALUES(NEW.status,NEW.tries,1)
+  ON CONFLICT(status,tries) DO UPDATE SET n=n+1;
+END;
+CREATE TRIGGER IF NOT EXISTS pages_counts_ad AFTER DELETE ON pages BEGIN
+  UPDATE page_counts SET n=n-1 WHERE status=OLD.status AND tries=OLD.tries;
+END;
+CREATE TRIGGER IF NOT EXISTS pages_counts_au AFTER UPDATE OF status, tries ON pages
+WHEN OLD.status IS NOT NEW.status OR OLD.tries IS NOT NEW.tries BEGIN
+  UPDATE page_counts SET n=n-1 WHERE status=OLD.status AND tries=OLD.tries;
+  INSERT INTO page_counts(status,tries,n) VALUES(NEW.status,NEW.tries,1)
+  ON CONFLICT(status,tries) DO UPDATE SET n=n+1;
+END;
+"""
+
 DDL_META = """
 CREATE TABLE IF NOT EXISTS meta(
   key TEXT PRIMARY KEY,
@@ -74,21 +199,38 @@ def now_iso() -> str:
 def open_db():
     # garante diretório
     os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
-    con = sqlite3.connect(DB_PATH)
+    # vários workers/containers podem compartilhar o arquivo: espera o lock
+    con = sqlite3.connect(DB_PATH, timeout=60)
     con.execute("PRAGMA journal_mode=WAL;")
     con.execute(DDL_PAGES)
     con.execute(DDL_META)
+    cols = {r[1] for r in con.execute("PRAGMA table_info(pages)")}
+    for col, typ in PAGES_EXTRA_COLUMNS.items():
+        if col not in cols:
+            con.execute(f"ALTER TABLE pages ADD COLUMN {col} {typ}")
+    con.executescript(DDL_INDEXES)
+    had_counts = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='page_counts'"
+    ).fetchone()
+    con.executescript(DDL_COUNTS)
+    if not had_counts:
+        # checkpoint antigo: um único scan para popular os contadores
+        con.execute(
+            "INSERT INTO page_counts(status,tries,n) "
+            "SELECT status, tries, COUNT(*) FROM pages GROUP BY status, tries"
+        )
     con.commit()
     return con
 
 
-def meta_set(con, key, value):
+def meta_set(con, key, value, commit=True):
     con.execute(
         "INSERT INTO meta(key,value) VALUES(?,?) "
         "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
         (key, value),
     )
-    con.commit()
+    if commit:
+        con.commit()
 
 
 def meta_get(con, key, default=None):
@@ -96,63 +238,321 @@ def meta_get(con, key, default=None):
     return row[0] if row else default
 
 
-def page_set(con, title, status, err=None, reset_tries=False):
+def page_set(con, title, status, err=None, reset_tries=False, owner=None):
+    """
+    Grava o status da página e libera o lease. Com `owner`, só atualiza se
+    a página ainda estiver reivindicada por esse worker (um lease expirado e
+    re-reivindicado por outro não é sobrescrito).
+    """
+    guard = "WHERE pages.claimed_by IS ?" if owner else ""
+    params = (title, status, 0, err, now_iso()) + ((owner,) if owner else ())
     if reset_tries:
         con.execute(
-            """
+            f"""
             INSERT INTO pages(title,status,tries,last_error,updated_at)
             VALUES(?,?,?,?,?)
             ON CONFLICT(title) DO UPDATE SET
               status=excluded.status,
               tries=0,
               last_error=excluded.last_error,
-              updated_at=excluded.updated_at
+              updated_at=excluded.updated_at,
+              claimed_by=NULL,
+              lease_until=NULL
+            {guard}
             """,
-            (title, status, 0, err, now_iso()),
+            params,
         )
     else:
         con.execute(
-            """
+            f"""
             INSERT INTO pages(title,status,tries,last_error,updated_at)
             VALUES(?,?,?,?,?)
             ON CONFLICT(title) DO UPDATE SET
               status=excluded.status,
               last_error=excluded.last_error,
-              updated_at=excluded.updated_at
+              updated_at=excluded.updated_at,
+              claimed_by=NULL,
+              lease_until=NULL
+            {guard}
             """,
-            (title, status, 0, err, now_iso()),
+            params,
         )
 
 
-def page_inc_try(con, title):
+def status_counts(con, max_retries: int) -> Dict[str, int]:
+    """Contadores O(1) (tabela page_counts): total, ok, skipped, failed(final), pending(retry)."""
+    out = {"total": 0, "ok": 0, "skipped": 0, "failed": 0, "pending": 0, "claimed": 0}
+    for status, tries, n in con.execute("SELECT status, tries, n FROM page_counts WHERE n > 0"):
+        out["total"] += n
+        if status in ("ok", "skipped", "claimed"):
+            out[status] += n
+        elif status in ("pending", "failed") and tries < max_retries:
+            out["pending"] += n
+        elif status == "failed":
+            out["failed"] += n
+    return out
+
+
+# --- Claims (lease) ---
+# Vários workers (processos ou containers com o mesmo volume) dividem a fila:
+# claim_batch marca um lote como status='claimed' para um worker por
+# `lease` segundos, numa transação IMMEDIATE (atômica entre processos).
+# Leases expirados — worker que morreu — voltam para a fila como 'failed'.
+def reclaim_expired(con) -> int:
+    cur = con.execute(
+        """
+        UPDATE pages
+        SET status='failed', last_error='lease expirado (' || claimed_by || ')',
+            claimed_by=NULL, lease_until=NULL, updated_at=?
+        WHERE status='claimed' AND lease_until < ?
+        """,
+        (now_iso(), time.time()),
+    )
+    return cur.rowcount
+
+
+def claim_batch(con, worker_id: str, limit: int, max_retries: int, lease: int) -> List[str]:
+    """Reivindica atomicamente até `limit` títulos pendentes (conta a tentativa)."""
+    con.commit()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        n = reclaim_expired(con)
+        if n:
+            print(f"[lease] {n} títulos com lease expirado voltaram para a fila", flush=True)
+        titles = pending_titles(con, limit, max_retries)
+        con.executemany(
+            """
+            UPDATE pages
+            SET status='claimed', claimed_by=?, lease_until=?,
+                tries=tries+1, updated_at=?
+            WHERE title=?
+            """,
+            [(worker_id, time.time() + lease, now_iso(), t) for t in titles],
+        )
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    return titles
+
+
+def renew_leases(con, worker_id: str, lease: int):
     con.execute(
-        "UPDATE pages SET tries=tries+1, updated_at=? WHERE title=?",
-        (now_iso(), title),
+        "UPDATE pages SET lease_until=? WHERE status='claimed' AND claimed_by=?",
+        (time.time() + lease, worker_id),
     )
 
 
-def seed_pending(con, titles: Iterable[str]):
+class LeaseHeartbeat:
+    """
+    Renova os leases de `worker_id` a cada `every` segundos numa thread com
+    conexão própria, independente de algum lote terminar: workers presos em
+    lotes lentos (API limitada + backoff) não deixam o lease expirar.
+    """
+
+    def __init__(self, worker_id: str, lease: int, every: Optional[float] = None, db_path: Optional[str] = None):
+        self.worker_id = worker_id
+        self.lease = lease
+        self.every = every if every is not None else max(1.0, lease / 3)
+        self.db_path = db_path or DB_PATH
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        con = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            while not self._stop.wait(self.every):
+                try:
+                    renew_leases(con, self.worker_id, self.lease)
+                    con.commit()
+                except sqlite3.Error as e:
+                    print(f"[WARN] renovação de lease falhou: {e}", flush=True)
+        finally:
+            con.close()
+
+    def start(self) -> "LeaseHeartbeat":
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def release_claims(con, worker_id: str) -> int:
+    """Devolve à fila o que este worker reivindicou e não terminou (parada limpa)."""
+    cur = con.execute(
+        """
+        UPDATE pages SET status='pending', claimed_by=NULL, lease_until=NULL
+        WHERE status='claimed' AND claimed_by=?
+        """,
+        (worker_id,),
+    )
+    con.commit()
+    return cur.rowcount
+
+
+def page_set_revision(con, title, revid, chash, owner=None):
+    """Grava revid/hash; com `owner`, só se a página ainda for desse worker (como page_set)."""
+    guard = " AND claimed_by IS ?" if owner else ""
+    con.execute(
+        f"UPDATE pages SET revid=?, content_hash=? WHERE title=?{guard}",
+        (revid, chash, title) + ((owner,) if owner else ()),
+    )
+
+
+def record_results(con, updates: List[Tuple], owner: Optional[str] = None):
+    """
+    Grava no checkpoint os resultados (title, status, erro, reset_tries, info)
+    de um lote. revid/content_hash só são gravados quando a página foi de
+    fato indexada (ok) ou confirmada inalterada (skipped): o hash de uma
+    página que falhou faria o retry considerá-la inalterada e pulá-la.
+    """
+    for title, status, e, reset, info in updates:
+        if info.get("content_hash") and status in ("ok", "skipped"):
+            page_set_revision(con, title, info.get("revid"), info["content_hash"], owner=owner)
+        page_set(con, title, status, err=e, reset_tries=reset, owner=owner)
+
+
+def page_revisions(con, titles: List[str]) -> Dict[str, Tuple[Optional[int], Optional[str]]]:
+    """(revid, content_hash) gravados no checkpoint para cada título."""
+    out: Dict[str, Tuple[Optional[int], Optional[str]]] = {}
+    for i in range(0, len(titles), 500):
+        chunk = titles[i : i + 500]
+        marks = ",".join("?" * len(chunk))
+        for t, revid, chash in con.execute(
+            f"SELECT title, revid, content_hash FROM pages WHERE title IN ({marks})",
+            chunk,
+        ):
+            out[t] = (revid, chash)
+    return out
+
+
+def refresh_from_api(con, namespace: int, limit: int = 0) -> Dict[str, int]:
+    """
+    Compara o lastrevid atual de cada página (iter_allpages_revisions, em lote
+    e sem conteúdo) com o revid gravado no checkpoint:
+
+    - título novo              -> pending
+    - revid diferente          -> pending (tries zerado)
+    - revid igual              -> nada a fazer
+    - revid diferente, mas a página está reivindicada por um worker agora
+                               -> não mexe (o claim continua com o dono); o
+                                  próximo refresh a pega se o worker gravar
+                                  o revid antigo
+    - sem revid no checkpoint  -> ingerido antes do controle de revisão: se já
+                                  está ok/skipped, adota o revid atual (mesma
+                                  premissa do --skip-existing-os)
+    """
+    stats = {"seen": 0, "new": 0, "changed": 0, "unchanged": 0, "adopted": 0, "claimed": 0}
+    batch: List[Tuple[str, int]] = []
+
+    def flush():
+        known = page_revisions(con, [t for t, _ in batch])
+        for title, revid in batch:
+            if title not in known:
+                con.execute(
+                    "INSERT OR IGNORE INTO pages(title,status,tries,last_error,updated_at) "
+                    "VALUES(?,?,?,?,?)",
+                    (title, "pending", 0, None, now_iso()),
+                )
+                stats["new"] += 1
+            elif known[title][0] is None:
+                cur = con.execute(
+                    "UPDATE pages SET revid=? WHERE title=? AND status IN ('ok','skipped')",
+                    (revid, title),
+                )
+                stats["adopted"] += cur.rowcount
+            elif known[title][0] != revid:
+                cur = con.execute(
+                    "UPDATE pages SET status='pending', tries=0, last_error=NULL, updated_at=? "
+                    "WHERE title=? AND status<>'claimed'",
+                    (now_iso(), title),
+                )
+                stats["changed" if cur.rowcount else "claimed"] += 1
+            else:
+                stats["unchanged"] += 1
+        con.commit()
+        batch.clear()
+
+    for title, revid in iter_allpages_revisions(ap_namespace=namespace, limit=limit or None):
+        if STOP:
+            break
+        batch.append((title, revid))
+        stats["seen"] += 1
+        if len(batch) >= 500:
+            flush()
+    if batch:
+        flush()
+    return stats
+
+
+def seed_pending(con, titles: Iterable[str], commit=True):
     con.executemany(
         "INSERT OR IGNORE INTO pages(title,status,tries,last_error,updated_at) "
         "VALUES(?,?,?,?,?)",
         [(t, "pending", 0, None, now_iso()) for t in titles],
     )
-    con.commit()
+    if commit:
+        con.commit()
+
+
+def seed_streaming(con, namespace: int, limit: int = 0) -> int:
+    """
+    Seed em streaming: cada página do allpages é inserida e o apcontinue
+    gravado em `meta` na MESMA transação. Se o processo morrer no meio,
+    o próximo run retoma do último apcontinue em vez de recomeçar.
+    Retorna quantos títulos foram semeados no total.
+    """
+    if meta_get(con, "seed_done") == "1":
+        return int(meta_get(con, "seed_count", "0"))
+    apcontinue = meta_get(con, "seed_apcontinue") or None
+    seeded = int(meta_get(con, "seed_count", "0"))
+    done = False
+    for titles, nxt in iter_allpages_batches(namespace, apcontinue):
+        if STOP:
+            break
+        if limit:
+            titles = titles[: max(0, limit - seeded)]
+        seed_pending(con, titles, commit=False)
+        seeded += len(titles)
+        done = not nxt or bool(limit and seeded >= limit)
+        meta_set(con, "seed_apcontinue", nxt or "", commit=False)
+        meta_set(con, "seed_count", str(seeded), commit=False)
+        if done:
+            meta_set(con, "seed_done", "1", commit=False)
+        con.commit()
+        print(f"[seed] {seeded} títulos semeados", flush=True)
+        if done:
+            break
+    if not done and not STOP:
+        # listagem vazia / terminou sem continue
+        meta_set(con, "seed_done", "1")
+    return seeded
 
 
 def pending_titles(con, limit: int, max_retries: int) -> List[str]:
-    cur = con.execute(
-        """
-        SELECT title
-        FROM pages
-        WHERE status IN ('pending','failed')
-          AND tries < ?
-        ORDER BY updated_at
-        LIMIT ?
-        """,
-        (max_retries, limit),
-    )
-    return [r[0] for r in cur.fetchall()]
+    """
+    Os `limit` títulos pendentes mais antigos (por updated_at).
+
+    Uma consulta por (status, tries) — cada uma é um range scan já ordenado
+    em idx_pages_queue, sem sort — e um merge das listas em Python: custo
+    proporcional a limit * max_retries, não ao tamanho da tabela.
+    """
+    runs = []
+    for status in ("pending", "failed"):
+        for tries in range(max_retries):
+            runs.append(
+                con.execute(
+                    "SELECT updated_at, title FROM pages "
+                    "WHERE status=? AND tries=? ORDER BY updated_at LIMIT ?",
+                    (status, tries, limit),
+                ).fetchall()
+            )
+    return [t for _u, t in heapq.merge(*runs)][:limit]
 
 
 def process_title_via_cli(title: str):
@@ -175,6 +575,183 @@ def process_title_via_cli(title: str):
     subprocess.run(cmd, check=True)
 
 
+# --- Execução in-process (workers com clientes quentes) ---
+# True dentro dos processos do pool: as métricas de lá voltam como delta
+_IN_POOL = False
+
+
+def _worker_init(workers: int = 1):
+    """
+    Inicializador de cada worker do pool: importa o run_ingest uma única vez
+    (OpenSearch/Neo4j/mwparserfromhell ficam quentes no processo) e garante
+    o índice lexical. Cada worker fica com 1/workers da taxa da API. Workers
+    ignoram SIGINT; quem decide parar é o pai.
+    """
+    global _IN_POOL
+    _IN_POOL = True
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from .fandom_api import limiter
+
+    limiter.set_share(workers)
+    from .run_ingest import os_ensure_index, graph_ensure_schema
+
+    os_ensure_index()
+    try:
+        graph_ensure_schema()
+    except Exception as e:
+        print(f"[WARN] schema do Neo4j não criado: {e}", flush=True)
+
+
+def _worker_ingest_many(
+    titles: List[str],
+    known_hashes: Optional[Dict[str, str]] = None,
+) -> Tuple[List[Tuple[str, Optional[str], Dict]], Optional[Dict]]:
+    """
+    Ingere um lote de títulos (um fetch em lote via get_pages) e devolve
+    (title, erro, info) para cada um — erro como string para atravessar o
+    pool; info traz revid/content_hash/unchanged para o checkpoint.
+    Junto vai o delta de métricas do worker (None fora do pool).
+    """
+    from .run_ingest import ingest_titles
+
+    out = [
+        (title, None if err is None else repr(err), info)
+        for title, _counts, err, info in ingest_titles(titles, known_hashes)
+    ]
+    return out, (metrics.drain() if _IN_POOL else None)
+
+
+def _subset(d: Dict[str, str], keys: List[str]) -> Dict[str, str]:
+    return {k: d[k] for k in keys if k in d}
+
+
+class TitleRunner:
+    """
+    Executa ingest_title para uma lista de títulos, em um de três modos:
+
+    - "cli": um subprocesso `python -m src.collector.run_ingest` por título
+      (comportamento antigo, máximo isolamento, máximo custo de startup).
+    - "inprocess" com workers=0: chama ingest_title direto no processo atual.
+    - "inprocess" com workers>=1: pool de processos com clientes quentes.
+      Cada worker é reciclado após `recycle_after` títulos e, se um worker
+      morrer, o pool é recriado e os títulos em voo são marcados como falha
+      (serão re-tentados pelo checkpoint normalmente).
+    """
+
+    def __init__(self, mode: str = "inprocess", workers: int = 1, recycle_after: int = 500):
+        if mode not in ("cli", "inprocess"):
+            raise ValueError(f"exec mode inválido: {mode!r}")
+        self.mode = mode
+        self.workers = max(0, int(workers))
+        self.recycle_after = max(1, int(recycle_after)) if recycle_after else None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inline_ready = False
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # cada task é um lote de até MAX_TITLES_PER_QUERY títulos;
+            # max_tasks_per_child força o start method "spawn" (Python >= 3.11)
+            tasks = None
+            if self.recycle_after:
+                tasks = max(1, -(-self.recycle_after // MAX_TITLES_PER_QUERY))
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_worker_init,
+                initargs=(self.workers,),
+                max_tasks_per_child=tasks,
+            )
+        return self._pool
+
+    def _reset_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def run(
+        self,
+        titles: List[str],
+        known_hashes: Optional[Dict[str, str]] = None,
+    ) -> Iterator[Tuple[str, Optional[str], Dict]]:
+        """
+        Gera (title, erro, info) para cada título; erro=None quando deu certo.
+        No modo in-process os títulos vão em lotes de MAX_TITLES_PER_QUERY,
+        cada lote com um único fetch no MediaWiki (get_pages), e páginas cujo
+        hash bate com `known_hashes` não são re-indexadas.
+        """
+        if self.mode == "cli":
+            for title in titles:
+                if STOP:
+                    return
+                try:
+                    with metrics.time("cli_title"):
+                        process_title_via_cli(title)
+                    metrics.inc("pages_total", result="ok")
+                    yield title, None, {}
+                except Exception as e:
+                    metrics.inc("pages_total", result="failed")
+                    metrics.inc("errors_total", stage="page", type=type(e).__name__)
+                    yield title, repr(e), {}
+            return
+
+        known_hashes = known_hashes or {}
+
+        chunks = [
+            titles[i : i + MAX_TITLES_PER_QUERY]
+            for i in range(0, len(titles), MAX_TITLES_PER_QUERY)
+        ]
+
+        if self.workers == 0:
+            if not self._inline_ready:
+                from .run_ingest import os_ensure_index
+
+                os_ensure_index()
+                self._inline_ready = True
+            for chunk in chunks:
+                if STOP:
+                    return
+                out, _ = _worker_ingest_many(chunk, _subset(known_hashes, chunk))
+                yield from out
+            return
+
+        pool = self._get_pool()
+        futures = {
+            pool.submit(_worker_ingest_many, c, _subset(known_hashes, c)): c
+            for c in chunks
+        }
+        broken = False
+        for fut in as_completed(futures):
+            if STOP:
+                # sinal recebido: não inicia novos lotes, só drena os em voo
+                for f in futures:
+                    f.cancel()
+            if fut.cancelled():
+                continue
+            chunk = futures[fut]
+            try:
+                out, delta = fut.result()
+            except BrokenProcessPool as e:
+                broken = True
+                metrics.inc("errors_total", len(chunk), stage="pool", type="BrokenProcessPool")
+                for title in chunk:
+                    yield title, repr(e), {}
+                continue
+            except Exception as e:
+                metrics.inc("errors_total", len(chunk), stage="pool", type=type(e).__name__)
+                for title in chunk:
+                    yield title, repr(e), {}
+                continue
+            metrics.merge(delta)
+            yield from out
+        if broken:
+            print("[pool] worker morreu — recriando pool de ingestão.", flush=True)
+            self._reset_pool()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
 def run(
     namespace: int,
     limit: int,
@@ -182,6 +759,13 @@ def run(
     reset: bool,
     skip_existing_os: bool,
     max_retries: int,
+    exec_mode: str = DEFAULT_EXEC_MODE,
+    workers: int = DEFAULT_WORKERS,
+    recycle_after: int = DEFAULT_RECYCLE_AFTER,
+    refresh: bool = False,
+    worker_id: str = DEFAULT_WORKER_ID,
+    lease_seconds: int = DEFAULT_LEASE_SECONDS,
+    metrics_port: int = DEFAULT_METRICS_PORT,
 ):
     con = open_db()
     if reset:
@@ -193,41 +777,67 @@ def run(
     meta_set(con, "namespace", str(namespace))
     meta_set(con, "started_at", meta_get(con, "started_at", now_iso()))
 
-    # Seed inicial (só se vazio)
-    count = con.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
-    if count == 0:
+    # Seed inicial (streaming e retomável); checkpoints antigos, já
+    # semeados antes do controle por apcontinue, contam como seed completo
+    if meta_get(con, "seed_done") != "1" and meta_get(con, "seed_apcontinue") is None:
+        if status_counts(con, max_retries)["total"] > 0:
+            meta_set(con, "seed_done", "1")
+    if meta_get(con, "seed_done") != "1":
         print(
             f"[seed] listando allpages(ns={namespace}) aplimit=max + nonredirects ...",
             flush=True,
         )
-        titles = list(iter_allpages(ap_namespace=namespace, limit=limit or None))
-        if limit:
-            titles = titles[:limit]
-        seed_pending(con, titles)
-        print(f"[seed] {len(titles)} títulos pendentes", flush=True)
+        n = seed_streaming(con, namespace, limit)
+        print(f"[seed] {n} títulos pendentes", flush=True)
+    elif refresh:
+        print(f"[refresh] comparando revisões (ns={namespace}) ...", flush=True)
+        st = refresh_from_api(con, namespace, limit)
+        print(
+            f"[refresh] vistos={st['seen']} novos={st['new']} "
+            f"alterados={st['changed']} inalterados={st['unchanged']} "
+            f"adotados={st['adopted']} em_uso={st['claimed']}",
+            flush=True,
+        )
 
     def remaining() -> int:
-        return int(
-            con.execute(
-                """
-                SELECT COUNT(*)
-                FROM pages
-                WHERE status IN ('pending','failed')
-                  AND tries < ?
-                """,
-                (max_retries,),
-            ).fetchone()[0]
-        )
+        return status_counts(con, max_retries)["pending"]
 
-    total = int(con.execute("SELECT COUNT(*) FROM pages").fetchone()[0])
+    total = status_counts(con, max_retries)["total"]
     print(
         f"[stats] total no checkpoint: {total}, pendentes: {remaining()} (max_retries={max_retries})",
         flush=True,
     )
 
+    runner = TitleRunner(mode=exec_mode, workers=workers, recycle_after=recycle_after)
+    print(
+        f"[exec] worker={worker_id} mode={exec_mode} workers={workers} "
+        f"recycle_after={recycle_after} lease={lease_seconds}s",
+        flush=True,
+    )
+
+    indexed = IndexedTitles()
+    if skip_existing_os:
+        n = indexed.seed()
+        print(f"[skip] {n} títulos já indexados no OpenSearch (seed local)", flush=True)
+
+    def checkpoint_gauges(m):
+        # roda na thread do servidor HTTP: conexão própria, só leitura
+        c2 = sqlite3.connect(DB_PATH, timeout=5)
+        try:
+            for k, v in status_counts(c2, max_retries).items():
+                m.set_gauge("checkpoint_pages", v, status=k)
+        finally:
+            c2.close()
+
+    metrics.add_collector(checkpoint_gauges)
+    if metrics_port:
+        serve_metrics(metrics_port)
+
+    # leases renovados a cada lease/3 s enquanto o run durar
+    heartbeat = LeaseHeartbeat(worker_id, lease_seconds).start()
     processed = 0
     while not STOP:
-        titles = pending_titles(con, batch_size, max_retries)
+        titles = claim_batch(con, worker_id, batch_size, max_retries, lease_seconds)
         if not titles:
             print(
                 "[done] nada pendente dentro de max_retries — fim.",
@@ -235,36 +845,66 @@ def run(
             )
             break
 
-        ok = err = skipped = 0
+        ok = err = skipped = unchanged = 0
 
-        for title in titles:
-            if STOP:
-                break
+        revs = page_revisions(con, titles)
+        known_hashes = {t: h for t, (_r, h) in revs.items() if h}
+
+        # uma única checagem de existência para o batch inteiro; só vale para
+        # páginas sem revid no checkpoint (as demais foram marcadas pendentes
+        # justamente porque mudaram e precisam ser re-indexadas)
+        legacy = [t for t in titles if revs.get(t, (None, None))[0] is None]
+        in_os = indexed.filter_indexed(legacy) if skip_existing_os else set()
 
-            # marca a tentativa
-            page_inc_try(con, title)
+        # resultados ficam em memória e são gravados em transações curtas
+        # (commit em grupo), para não segurar o lock de escrita do SQLite
+        # enquanto outros workers tentam reivindicar lotes
+        updates: List[Tuple] = []
+
+        def flush_updates():
+            record_results(con, updates, owner=worker_id)
+            updates.clear()
+            renew_leases(con, worker_id, lease_seconds)
             con.commit()
 
+        to_process: List[str] = []
+        for title in titles:
             # pula se já existe no OpenSearch
-            if skip_existing_os and already_indexed_in_os(title):
-                page_set(con, title, "skipped", reset_tries=True)
+            if title in in_os:
+                updates.append((title, "skipped", None, True, {}))
                 skipped += 1
                 continue
 
-            try:
-                process_title_via_cli(title)
-                page_set(con, title, "ok", reset_tries=True)
+            to_process.append(title)
+        flush_updates()
+
+        for title, exc, info in runner.run(to_process, known_hashes):
+            if exc is None and info.get("unchanged"):
+                updates.append((title, "skipped", None, True, info))
+                unchanged += 1
+            elif exc is None:
+                updates.append((title, "ok", None, True, info))
+                indexed.add(title)
                 ok += 1
-            except Exception as e:
-                print(f"[ERROR] falhou em '{title}': {repr(e)}", flush=True)
-                page_set(con, title, "failed", err=repr(e))
+            else:
+                print(f"[ERROR] falhou em '{title}': {exc}", flush=True)
+                updates.append((title, "failed", exc, False, info))
                 err += 1
+            if len(updates) >= COMMIT_EVERY:
+                flush_updates()
 
-        con.commit()
+        flush_updates()
+        if ok:
+            # páginas novas/alteradas no índice: invalida caches do QA
+            try:
+                bump_generation()
+            except Exception as e:
+                print(f"[WARN] geração do índice não atualizada: {e}", flush=True)
         processed += len(titles)
         print(
-            f"[batch] ok={ok} skipped={skipped} err={err} | "
-            f"progresso: {processed}/{total} | pendentes: {remaining()}",
+            f"[batch] ok={ok} skipped={skipped} unchanged={unchanged} err={err} | "
+            f"progresso: {processed}/{total} | pendentes: {remaining()} | "
+            f"{metrics.pages_per_second():.2f} pág/s",
             flush=True,
         )
 
@@ -272,24 +912,16 @@ def run(
             print("[stop] encerrado por sinal — checkpoints salvos.", flush=True)
             break
 
-    ok_count = con.execute(
-        "SELECT COUNT(*) FROM pages WHERE status='ok'"
-    ).fetchone()[0]
-    skip_count = con.execute(
-        "SELECT COUNT(*) FROM pages WHERE status='skipped'"
-    ).fetchone()[0]
-    fail_count = con.execute(
-        "SELECT COUNT(*) FROM pages WHERE status='failed' AND tries>=?",
-        (max_retries,),
-    ).fetchone()[0]
-    pend_count = con.execute(
-        "SELECT COUNT(*) FROM pages WHERE status IN ('pending','failed') AND tries<?",
-        (max_retries,),
-    ).fetchone()[0]
+    runner.close()
+    heartbeat.stop()
+    n = release_claims(con, worker_id)
+    if n:
+        print(f"[lease] {n} títulos não concluídos devolvidos à fila", flush=True)
 
+    c = status_counts(con, max_retries)
     print(
-        f"[summary] ok={ok_count} skipped={skip_count} "
-        f"failed(final)={fail_count} pend(retry)={pend_count}",
+        f"[summary] ok={c['ok']} skipped={c['skipped']} "
+        f"failed(final)={c['failed']} pend(retry)={c['pending']}",
         flush=True,
     )
 
@@ -333,6 +965,46 @@ def main():
         default=True,
         help="Pula títulos que já existem no OpenSearch (default: True)",
     )
+    ap.add_argument(
+        "--exec-mode",
+        choices=["inprocess", "cli"],
+        default=DEFAULT_EXEC_MODE,
+        help="inprocess = pool com clientes quentes; cli = um subprocesso por título",
+    )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Workers do pool in-process (0 = no próprio processo, sem isolamento)",
+    )
+    ap.add_argument(
+        "--recycle-after",
+        type=int,
+        default=DEFAULT_RECYCLE_AFTER,
+        help="Recicla cada worker após N títulos (isolamento contra vazamentos)",
+    )
+    ap.add_argument(
+        "--worker-id",
+        default=DEFAULT_WORKER_ID,
+        help="Identificador deste worker nos leases (default: host:pid)",
+    )
+    ap.add_argument(
+        "--lease-seconds",
+        type=int,
+        default=DEFAULT_LEASE_SECONDS,
+        help="Duração do lease de cada lote; expirado, outro worker reassume",
+    )
+    ap.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Compara revid atual da wiki com o checkpoint e re-ingere só o que mudou",
+    )
+    ap.add_argument(
+        "--metrics-port",
+        type=int,
+        default=DEFAULT_METRICS_PORT,
+        help="Porta HTTP de /metrics (Prometheus) e /metrics.json (0 = desligado)",
+    )
     args = ap.parse_args()
 
     run(
@@ -342,6 +1014,13 @@ def main():
         reset=args.reset,
         skip_existing_os=args.skip_existing_os,
         max_retries=args.max_retries,
+        exec_mode=args.exec_mode,
+        workers=args.workers,
+        recycle_after=args.recycle_after,
+        refresh=args.refresh,
+        worker_id=args.worker_id,
+        lease_seconds=args.lease_seconds,
+        metrics_port=args.metrics_port,
     )
 
 
@@ -0,0 +1,239 @@
+# src/collector/metrics.py
+"""
+Telemetria da ingestão: contadores, gauges e histogramas de latência por
+etapa (api, throttle, parse, opensearch, neo4j, qdrant...), thread-safe e
+sem dependências externas.
+
+- `metrics.time("parse")` / `metrics.observe(...)` / `metrics.inc(...)`
+- `metrics.prometheus()` -> texto no formato de exposição do Prometheus
+- `metrics.snapshot()`   -> dict (JSON)
+- `serve(port)`          -> HTTP em thread daemon: /metrics e /metrics.json
+
+Workers em outros processos acumulam no próprio registro e mandam o delta
+(`drain()`) junto com os resultados; o processo pai faz `merge()`.
+"""
+
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = "ingest_"
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in items)
+    return "{" + body + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Key, float] = {}
+        self._gauges: Dict[Key, float] = {}
+        # histograma: [contagem por bucket (+Inf no fim), soma, total]
+        self._hists: Dict[Key, List] = {}
+        self._pages = deque(maxlen=100_000)
+        self.started = time.time()
+        # callbacks chamados antes de exportar (ex.: contadores do checkpoint)
+        self._collectors: List[Callable[["Metrics"], None]] = []
+
+    # --- escrita ---
+    def inc(self, name: str, value: float = 1, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self._counters[k] = self._counters.get(k, 0) + value
+            if name == "pages_total":
+                now = time.time()
+                for _ in range(int(value)):
+                    self._pages.append(now)
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            h = self._hists.get(k)
+            if h is None:
+                h = self._hists[k] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            h[0][bisect_left(BUCKETS, seconds)] += 1
+            h[1] += seconds
+            h[2] += 1
+
+    @contextmanager
+    def time(self, stage: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - t0, stage=stage, **labels)
+
+    def add_collector(self, fn: Callable[["Metrics"], None]):
+        self._collectors.append(fn)
+
+    # --- agregação entre processos ---
+    def drain(self) -> Dict:
+        """Delta serializável (contadores/histogramas zerados aqui; gauges copiados)."""
+        with self._lock:
+            delta = {
+                "counters": [[n, list(l), v] for (n, l), v in self._counters.items()],
+                "gauges": [[n, list(l), v] for (n, l), v in self._gauges.items()],
+                "hists": [[n, list(l), h] for (n, l), h in self._hists.items()],
+            }
+            self._counters.clear()
+            self._hists.clear()
+        return delta
+
+    def merge(self, delta: Optional[Dict]):
+        if not delta:
+            return
+        for n, l, v in delta.get("counters", []):
+            self.inc(n, v, **dict(l))
+        with self._lock:
+            for n, l, v in delta.get("gauges", []):
+                self._gauges[(n, tuple(tuple(x) for x in l))] = v
+            for n, l, (counts, total, count) in delta.get("hists", []):
+                k = (n, tuple(tuple(x) for x in l))
+                h = self._hists.get(k)
+                if h is None:
+                    h = self._hists[k] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+                h[0] = [a + b for a, b in zip(h[0], counts)]
+                h[1] += total
+                h[2] += count
+
+    # --- leitura ---
+    def _collect(self):
+        for fn in self._collectors:
+            try:
+                fn(self)
+            except Exception as e:
+                print(f"[WARN] coletor de métricas falhou: {e!r}", flush=True)
+
+    def pages_per_second(self, window: float = 60.0) -> float:
+        now = time.time()
+        with self._lock:
+            recent = len(self._pages) - bisect_left(self._pages, now - window)
+        return recent / min(window, max(1.0, now - self.started))
+
+    def snapshot(self) -> Dict:
+        self._collect()
+        with self._lock:
+            counters = {
+                n + _fmt_labels(l): v for (n, l), v in sorted(self._counters.items())
+            }
+            gauges = {n + _fmt_labels(l): v for (n, l), v in sorted(self._gauges.items())}
+            stages = {}
+            for (n, l), (counts, total, count) in sorted(self._hists.items()):
+                key = dict(l).get("stage", "") if n == "stage_seconds" else n + _fmt_labels(l)
+                stages[key] = {
+                    "count": count,
+                    "sum_s": round(total, 4),
+                    "avg_s": round(total / count, 4) if count else 0.0,
+                    "p50_s": _quantile(counts, count, 0.5),
+                    "p95_s": _quantile(counts, count, 0.95),
+                }
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "pages_per_second": round(self.pages_per_second(), 3),
+            "counters": counters,
+            "gauges": gauges,
+            "stages": stages,
+        }
+
+    def prometheus(self) -> str:
+        self._collect()
+        lines: List[str] = []
+        with self._lock:
+            seen = set()
+            for (n, l), v in sorted(self._counters.items()):
+                if n not in seen:
+                    lines.append(f"# TYPE {PREFIX}{n} counter")
+                    seen.add(n)
+                lines.append(f"{PREFIX}{n}{_fmt_labels(l)} {v}")
+            for (n, l), v in sorted(self._gauges.items()):
+                if n not in seen:
+                    lines.append(f"# TYPE {PREFIX}{n} gauge")
+                    seen.add(n)
+                lines.append(f"{PREFIX}{n}{_fmt_labels(l)} {v}")
+            for (n, l), (counts, total, count) in sorted(self._hists.items()):
+                if n not in seen:
+                    lines.append(f"# TYPE {PREFIX}{n} histogram")
+                    seen.add(n)
+                acc = 0
+                for le, c in zip(BUCKETS + (float("inf"),), counts):
+                    acc += c
+                    le_s = "+Inf" if le == float("inf") else repr(le)
+                    lines.append(f"{PREFIX}{n}_bucket{_fmt_labels(l, ('le', le_s))} {acc}")
+                lines.append(f"{PREFIX}{n}_sum{_fmt_labels(l)} {total}")
+                lines.append(f"{PREFIX}{n}_count{_fmt_labels(l)} {count}")
+        lines.append(f"# TYPE {PREFIX}pages_per_second gauge")
+        lines.append(f"{PREFIX}pages_per_second {self.pages_per_second()}")
+        return "\n".join(lines) + "\n"
+
+
+def _quantile(counts: List[int], count: int, q: float) -> Optional[float]:
+    """Quantil aproximado: limite superior do bucket que contém q."""
+    if not count:
+        return None
+    target = q * count
+    acc = 0
+    for le, c in zip(BUCKETS + (float("inf"),), counts):
+        acc += c
+        if acc >= target:
+            return le if le != float("inf") else None
+    return None
+
+
+metrics = Metrics()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+            ctype = "application/json"
+        elif self.path.startswith("/metrics"):
+            body = metrics.prometheus().encode("utf-8")
+            ctype = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # sem log por scrape
+
+
+def serve(port: int = int(os.getenv("INGEST_METRICS_PORT", "9108"))) -> Optional[ThreadingHTTPServer]:
+    """Sobe /metrics (Prometheus) e /metrics.json numa thread daemon; 0 desliga."""
+    if not port:
+        return None
+    try:
+        srv = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    except OSError as e:
+        print(f"[WARN] métricas: porta {port} indisponível ({e})", flush=True)
+        return None
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    print(f"[metrics] http://0.0.0.0:{port}/metrics e /metrics.json", flush=True)
+    return srv
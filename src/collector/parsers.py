@@ -1,6 +1,9 @@
 
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import re, mwparserfromhell
+from mwparserfromhell.wikicode import Wikicode
+
+from .utils.text import chunk_passages
 
 INFOBOX_KEYS = {
     "clan": ["clan", "Clan"],
@@ -11,11 +14,21 @@ INFOBOX_KEYS = {
     "aliases": ["aka", "aliases", "Alias", "Nicknames"],
 }
 
-def clean_text(s: str) -> str: return re.sub(r"\s+", " ", s or "").strip()
+# regexes pré-compiladas (eram recompiladas / re-importadas a cada página)
+_WS_RE = re.compile(r"\s+")
+_ID_RE = re.compile(r"[^a-z0-9]+")
+_LIST_SPLIT_RE = re.compile(r"[;,/]| and ", re.I)
+_SECT_MENTION_RE = re.compile(r"\b(Camarilla|Sabbat|Anarchs?)\b", re.I)
 
-def parse_infobox(wikitext: str) -> Dict:
+def clean_text(s: str) -> str: return _WS_RE.sub(" ", s or "").strip()
+
+def to_id(name: str) -> str: return _ID_RE.sub("-", (name or "").lower()).strip("-")
+
+def split_list(value: str) -> List[str]:
+    return [x.strip() for x in _LIST_SPLIT_RE.split(value or "") if x and x.strip()]
+
+def _infobox_from_code(code: Wikicode) -> Dict:
     out: Dict[str, str] = {}
-    code = mwparserfromhell.parse(wikitext or "")
     for tmpl in code.filter_templates():
         name = str(tmpl.name).strip().lower()
         if "infobox" in name:
@@ -27,21 +40,29 @@ def parse_infobox(wikitext: str) -> Dict:
             break
     return out
 
-def extract_sections(wikitext: str) -> List[Tuple[str, str]]:
-    code = mwparserfromhell.parse(wikitext or ""); text = code.strip_code()
-    sections = re.split(r"\n={2,}\s*(.+?)\s*={2,}\n", text)
-    out=[]; 
-    if sections:
-        lead = sections[0].strip()
-        if lead: out.append(("Lead", lead))
-        for i in range(1, len(sections), 2):
-            title = sections[i].strip()
-            body = (sections[i+1] if i+1 < len(sections) else "").strip()
-            if body: out.append((title, body))
-    else:
-        out.append(("Lead", text.strip()))
+def _sections_from_code(code: Wikicode) -> List[Tuple[str, str]]:
+    out: List[Tuple[str, str]] = []
+    # strip_code() descarta os "==" dos headings, então o split por regex no
+    # texto limpo nunca acha seção: usamos as seções do próprio parser
+    # (sem mutar `code`, que é compartilhado com o infobox)
+    for sec in code.get_sections(include_lead=True, flat=True):
+        nodes = list(sec.nodes)
+        heads = sec.filter_headings(recursive=False)
+        if heads and nodes and nodes[0] is heads[0]:
+            title = clean_text(heads[0].title.strip_code())
+            nodes = nodes[1:]
+        else:
+            title = "Lead"
+        body = Wikicode(nodes).strip_code().strip()
+        if title and body: out.append((title, body))
     return out
 
+def parse_infobox(wikitext: str) -> Dict:
+    return _infobox_from_code(mwparserfromhell.parse(wikitext or ""))
+
+def extract_sections(wikitext: str) -> List[Tuple[str, str]]:
+    return _sections_from_code(mwparserfromhell.parse(wikitext or ""))
+
 def guess_entity_type(title: str, cats: List[str]) -> str:
     t=title.lower(); cats_l=[c.lower() for c in cats]
     if "clan" in t or any("clans" in c for c in cats_l): return "Clan"
@@ -58,32 +79,39 @@ def extract_relations(title: str, infobox: Dict, cats: List[str], sections: List
     rels=[]
     def add(src, rel, dst, evidence, confidence="high"):
         rels.append({"src": src, "rel": rel, "dst": dst, "evidence": evidence, "confidence": confidence})
-    def to_id(name: str) -> str:
-        import re; return re.sub(r"[^a-z0-9]+", "-", (name or "").lower()).strip("-")
     title_id = to_id(title)
     sect_val = infobox.get("sect") or ""
-    if sect_val:
-        import re
-        for s in re.split(r"[;,/]| and ", sect_val, flags=re.I):
-            s=s.strip(); 
-            if s: add(title_id,"MEMBER_OF",to_id(s),{"type":"infobox","text":sect_val})
+    for s in split_list(sect_val):
+        add(title_id,"MEMBER_OF",to_id(s),{"type":"infobox","text":sect_val})
     discs = infobox.get("disciplines") or ""
-    if discs:
-        import re
-        for d in re.split(r"[;,/]| and ", discs, flags=re.I):
-            d=d.strip()
-            if d: add(title_id,"HAS_DISCIPLINE",to_id(d),{"type":"infobox","text":discs})
+    for d in split_list(discs):
+        add(title_id,"HAS_DISCIPLINE",to_id(d),{"type":"infobox","text":discs})
     blof = infobox.get("bloodline_of") or ""
     if blof: add(title_id,"DERIVES_FROM",to_id(blof.strip()),{"type":"infobox","text":blof})
     app = infobox.get("appears_in") or ""
-    if app:
-        import re
-        for b in re.split(r"[;,/]| and ", app, flags=re.I):
-            b=b.strip()
-            if b: add(title_id,"APPEARS_IN",to_id(b),{"type":"infobox","text":app})
+    for b in split_list(app):
+        add(title_id,"APPEARS_IN",to_id(b),{"type":"infobox","text":app})
     if sections:
         lead = sections[0][1][:400]
-        import re
-        m = re.search(r"\b(Camarilla|Sabbat|Anarchs?)\b", lead, flags=re.I)
+        m = _SECT_MENTION_RE.search(lead)
         if m: add(title_id,"MEMBER_OF",to_id(m.group(1)),{"type":"text","text":lead},"low")
     return rels
+
+def analyze_page(title: str, wikitext: str, categories: Optional[List[str]] = None, url: str = "") -> Dict:
+    """
+    Análise completa de uma página com UM único mwparserfromhell.parse:
+    infobox, seções, passagens (chunk_passages), tipo de entidade e relações.
+    Só recebe/retorna tipos simples, então pode rodar num pool de processos.
+    """
+    cats = list(categories or [])
+    code = mwparserfromhell.parse(wikitext or "")
+    infobox = _infobox_from_code(code)
+    sections = _sections_from_code(code)
+    return {
+        "title": title,
+        "infobox": infobox,
+        "sections": sections,
+        "passages": list(chunk_passages(title, url, sections)),
+        "entity_type": guess_entity_type(title, cats),
+        "relations": extract_relations(title, infobox, cats, sections),
+    }
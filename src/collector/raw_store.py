@@ -0,0 +1,153 @@
+# src/collector/raw_store.py
+"""
+Armazém local das páginas brutas vindas da API (get_pages).
+
+- Registros comprimidos (zstd se `zstandard` estiver instalado, senão zlib)
+  num arquivo append-only: <dir>/pages.log
+- Índice SQLite (<dir>/index.db) endereçado por conteúdo:
+    blobs(hash -> offset, length, codec)   — um blob por conteúdo distinto
+    pages(title -> hash, revid, fetched_at) — versão mais recente de cada título
+- A escrita é serializada por BEGIN IMMEDIATE no SQLite, então vários
+  workers (processos) podem gravar no mesmo store.
+
+Serve para re-indexar sem rede (`run_ingest --mode replay`) depois de mudar
+parser/chunking/grafo, e como fixture offline.
+"""
+
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+try:
+    import zstandard as _zstd
+except Exception:
+    _zstd = None  # fallback zlib
+
+RAW_STORE_DIR = os.getenv("RAW_STORE_DIR", "checkpoints/raw")
+
+DDL = """
+CREATE TABLE IF NOT EXISTS blobs(
+  hash   TEXT PRIMARY KEY,
+  offset INTEGER NOT NULL,
+  length INTEGER NOT NULL,
+  codec  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages(
+  title      TEXT PRIMARY KEY,
+  hash       TEXT NOT NULL,
+  revid      INTEGER,
+  fetched_at TEXT NOT NULL
+);
+"""
+
+
+def _compress(raw: bytes):
+    if _zstd is not None:
+        return _zstd.ZstdCompressor(level=3).compress(raw), "zstd"
+    return zlib.compress(raw, 6), "zlib"
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if _zstd is None:
+            raise RuntimeError("registro zstd no store, mas `zstandard` não está instalado")
+        return _zstd.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class RawStore:
+    def __init__(self, path: str = RAW_STORE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._log_path = os.path.join(path, "pages.log")
+        self._con = sqlite3.connect(os.path.join(path, "index.db"), timeout=60)
+        self._con.execute("PRAGMA journal_mode=WAL;")
+        self._con.executescript(DDL)
+        self._con.commit()
+
+    def put(self, page: Dict) -> str:
+        """
+        Grava uma página (dict de get_pages) e aponta o título para ela.
+        Conteúdo idêntico ao já armazenado não é regravado.
+        Retorna o hash do registro.
+        """
+        title = page.get("title") or page.get("requested")
+        page = {k: v for k, v in page.items() if k != "requested"}
+        raw = json.dumps(page, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        h = hashlib.sha1(raw).hexdigest()
+        con = self._con
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            if con.execute("SELECT 1 FROM blobs WHERE hash=?", (h,)).fetchone() is None:
+                data, codec = _compress(raw)
+                with open(self._log_path, "ab") as f:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(data)
+                con.execute(
+                    "INSERT INTO blobs(hash,offset,length,codec) VALUES(?,?,?,?)",
+                    (h, offset, len(data), codec),
+                )
+            con.execute(
+                "INSERT INTO pages(title,hash,revid,fetched_at) VALUES(?,?,?,?) "
+                "ON CONFLICT(title) DO UPDATE SET hash=excluded.hash, "
+                "revid=excluded.revid, fetched_at=excluded.fetched_at",
+                (title, h, page.get("revid"), datetime.utcnow().isoformat(timespec="seconds") + "Z"),
+            )
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        return h
+
+    def _read(self, f, offset: int, length: int, codec: str) -> Dict:
+        f.seek(offset)
+        return json.loads(_decompress(f.read(length), codec).decode("utf-8"))
+
+    def get(self, title: str) -> Optional[Dict]:
+        row = self._con.execute(
+            "SELECT b.offset, b.length, b.codec FROM pages p "
+            "JOIN blobs b ON b.hash = p.hash WHERE p.title=?",
+            (title,),
+        ).fetchone()
+        if row is None:
+            return None
+        with open(self._log_path, "rb") as f:
+            return self._read(f, *row)
+
+    def iter_pages(self, limit: Optional[int] = None) -> Iterator[Dict]:
+        """Versão mais recente de cada título, em ordem de offset (leitura sequencial)."""
+        q = (
+            "SELECT b.offset, b.length, b.codec FROM pages p "
+            "JOIN blobs b ON b.hash = p.hash ORDER BY b.offset"
+        )
+        if limit:
+            q += f" LIMIT {int(limit)}"
+        rows = self._con.execute(q).fetchall()
+        if not rows:
+            return
+        with open(self._log_path, "rb") as f:
+            for offset, length, codec in rows:
+                yield self._read(f, offset, length, codec)
+
+    def __len__(self) -> int:
+        return int(self._con.execute("SELECT COUNT(*) FROM pages").fetchone()[0])
+
+    def close(self):
+        self._con.close()
+
+
+_store: Optional[RawStore] = None
+
+
+def get_store() -> Optional[RawStore]:
+    """Store global do processo; None se RAW_STORE_DIR estiver vazio (desligado)."""
+    global _store
+    if not RAW_STORE_DIR:
+        return None
+    if _store is None:
+        _store = RawStore(RAW_STORE_DIR)
+    return _store
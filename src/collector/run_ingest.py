@@ -1,36 +1,52 @@
 import os
 import re
+import time
 import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Union, Any
 
 # --- Fandom API (lista de páginas + parse) ---
-from .fandom_api import iter_allpages, get_parse
+from .fandom_api import (
+    MAX_TITLES_PER_QUERY,
+    iter_allpages,
+    get_parse,
+    get_pages,
+    page_as_parse,
+    rate_snapshot,
+)
 
 # --- Indexadores ---
 from .indexers.opensearch_index import (
+    bump_generation,
     ensure_index as os_ensure_index,
-    bulk_upsert as os_bulk_upsert,
+    get_writer as os_writer,
 )
 
-# Qdrant é opcional: tenta importar, se falhar, segue sem vetor
-_qdrant_upsert = None
-try:
-    from .indexers.qdrant_index import bulk_upsert as _qdrant_upsert
-except Exception:
-    try:
-        from .indexers.qdrant_index import upsert_points as _qdrant_upsert
-    except Exception:
-        _qdrant_upsert = None  # vetorial opcional
+# Vetorial é opcional: desligado sem VECTOR_BACKEND/EMBEDDING_MODEL_PATH
+from .indexers.qdrant_index import get_writer as vec_writer
+
+# --- Parsing (análise de página em passada única) ---
+from .parsers import analyze_page
+
+# --- Store local de páginas brutas (replay offline) ---
+from .raw_store import get_store as get_raw_store
+
+# --- Telemetria (latência por etapa, /metrics) ---
+from .metrics import metrics, serve as serve_metrics
 
 # --- Grafo ---
 from .extract_graph import extract as extract_graph
-from .graph.neo4j_store import upsert_nodes, upsert_edges
+from .graph.neo4j_store import ensure_schema as graph_ensure_schema, get_writer as graph_writer
 
 
 # -----------------------------------------------------------------------------
 # Config
 # -----------------------------------------------------------------------------
 OS_INDEX = os.getenv("OPENSEARCH_INDEX", "passages-wod")
+REPLAY_CHUNK = int(os.getenv("REPLAY_CHUNK", "200"))
+# processos dedicados ao parse (CPU); 0 = parse no próprio processo
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
 
 
 # -----------------------------------------------------------------------------
@@ -45,6 +61,11 @@ def _stable_id(*parts: str) -> str:
     return hashlib.md5(base.encode("utf-8")).hexdigest()
 
 
+def content_hash(wikitext: str) -> str:
+    """Hash do wikitext, gravado no checkpoint para detectar páginas inalteradas."""
+    return hashlib.sha1((wikitext or "").encode("utf-8")).hexdigest()
+
+
 def _page_url(title: str) -> str:
     base = os.getenv("FANDOM_BASE_URL", "https://whitewolf.fandom.com")
     return f"{base}/wiki/{title.replace(' ', '_')}"
@@ -53,110 +74,385 @@ def _page_url(title: str) -> str:
 # -----------------------------------------------------------------------------
 # Extração de passagens (defensiva)
 # -----------------------------------------------------------------------------
-def extract_passages(title: str, parsed: Any) -> List[Dict]:
+def _wikitext_of(parsed: Any) -> str:
     """
-    Transforma o resultado de get_parse(title) em passagens.
-
     - Se parsed vier como dict no formato do action=parse, usa:
         parsed["parse"]["wikitext"]["*"]  (ou equivalente)
     - Se vier como string ou qualquer outra coisa, converte para string.
     - NUNCA chama .get() em algo que não seja dict.
-    - Para simplificar, gera por enquanto apenas uma passagem "Intro"
-      com o texto inteiro.
     """
-    passages: List[Dict] = []
-
-    wikitext = ""
-
     # Caso 1: parsed é dict no formato padrão do MediaWiki
     if isinstance(parsed, dict):
         parse_block = parsed.get("parse") or {}
-        wt = parse_block.get("wikitext")
+        wt = parse_block.get("wikitext") if isinstance(parse_block, dict) else None
 
         # wt pode ser dict {"*": "..."} ou string
         if isinstance(wt, dict):
-            wikitext = wt.get("*", "") or ""
-        elif isinstance(wt, str):
-            wikitext = wt
-        else:
-            wikitext = ""
-    else:
-        # Caso 2: qualquer outra coisa (str, None, etc.)
-        wikitext = str(parsed or "")
+            return wt.get("*", "") or ""
+        if isinstance(wt, str):
+            return wt
+        return ""
+    # Caso 2: qualquer outra coisa (str, None, etc.)
+    return str(parsed or "")
 
-    # Se não vier nada de texto, não há passagens para indexar
-    if not wikitext:
+
+def _categories_of(parsed: Any) -> List[str]:
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("parse"), dict):
         return []
+    out: List[str] = []
+    for c in parsed["parse"].get("categories") or []:
+        name = c.get("category") or c.get("*") if isinstance(c, dict) else c
+        if name:
+            out.append(str(name).replace("_", " "))
+    return out
+
+
+def _analyze_job(job: Tuple[str, str, List[str]]) -> Dict:
+    """
+    Análise completa de uma página (parse único + passagens com _id).
+    Função de módulo para poder rodar no pool de parse.
+    """
+    title, wikitext, cats = job
+    t0 = time.perf_counter()
+    analysis = analyze_page(title, wikitext, cats, _page_url(title))
+    # ordinal na página, não o offset (relativo à seção): duas seções com o
+    # mesmo título ("Camarilla" sob clãs diferentes) não colidem
+    for i, p in enumerate(analysis["passages"]):
+        p["_id"] = _stable_id(title, p["section"], str(i))
+    # medido aqui (talvez em outro processo) e registrado por quem consome
+    analysis["parse_s"] = time.perf_counter() - t0
+    return analysis
+
+
+def _safe_analyze_job(job: Tuple[str, str, List[str]]) -> Tuple[Optional[Dict], Optional[str]]:
+    # nunca levanta: um erro de parse não pode derrubar o iterador do pool
+    try:
+        return _analyze_job(job), None
+    except Exception as e:
+        return None, repr(e)
+
+
+def analyze(title: str, parsed: Any) -> Dict:
+    """Resultado de get_parse/page_as_parse -> analyze_page (infobox, seções, passagens, tipo, relações)."""
+    return _analyze_job((title, _wikitext_of(parsed), _categories_of(parsed)))
 
-    body = _norm_space(wikitext)
-    if not body:
+
+def extract_passages(title: str, parsed: Any) -> List[Dict]:
+    """
+    Transforma o resultado de get_parse(title) em passagens.
+
+    Divide o wikitext em seções (já sem markup) e cada seção em passagens
+    de até PASSAGE_MAX_CHARS, com sobreposição de PASSAGE_OVERLAP
+    (utils.text.chunk_passages). `offset` é a posição do trecho dentro do
+    texto da seção.
+    """
+    if not _wikitext_of(parsed):
         return []
+    return analyze(title, parsed)["passages"]
 
-    passages.append(
-        {
-            "_id": _stable_id(title, "Intro", "0"),
-            "title": title,
-            "section": "Intro",
-            "url": _page_url(title),
-            "text": body,
-            "offset": 0,
-        }
-    )
 
-    return passages
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def set_parse_workers(n: int):
+    """Define o tamanho do pool de parse (0 = sem pool). Recria o pool."""
+    global PARSE_WORKERS, _parse_pool
+    PARSE_WORKERS = max(0, int(n))
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=True)
+        _parse_pool = None
+
+
+def _analyze_many(
+    jobs: List[Tuple[str, str, List[str]]],
+) -> Iterator[Tuple[Optional[Dict], Optional[str]]]:
+    """
+    Analisa vários jobs; com PARSE_WORKERS > 0 o parse roda num pool de
+    processos e os resultados vêm em ordem, à medida que ficam prontos —
+    o chamador já indexa a página i enquanto as seguintes são parseadas.
+    """
+    global _parse_pool
+    if PARSE_WORKERS <= 0 or len(jobs) < 2:
+        return map(_safe_analyze_job, jobs)
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    return _parse_pool.map(_safe_analyze_job, jobs, chunksize=4)
 
 
 # -----------------------------------------------------------------------------
 # Processamento de um título
 # -----------------------------------------------------------------------------
-def ingest_title(title: str):
+def ingest_title(
+    title: str,
+    parsed: Any = None,
+    flush: bool = True,
+    analysis: Optional[Dict] = None,
+):
     """
     Processa um título:
-      - chama get_parse(title)
-      - extrai passagens
-      - upsert em OpenSearch (sempre)
+      - chama get_parse(title) (a menos que `parsed` já venha pronto,
+        ex.: de get_pages + page_as_parse)
+      - analisa a página (um único parse: passagens, tipo, relações), a
+        menos que `analysis` já venha pronta (ex.: do pool de parse)
+      - upsert em OpenSearch (sempre), via writer bufferizado do processo;
+        com flush=False o envio fica para o próximo flush do writer
       - upsert em Qdrant (se configurado)
       - atualiza grafo em Neo4j (se extract_graph retornar algo)
 
     Retorna tupla (os_docs, qdrant_pts, graph_edges).
     """
     # 1) parse
-    parsed = get_parse(title)
-
-    # 2) passagens
-    passages = extract_passages(title, parsed)
+    if parsed is None:
+        parsed = get_parse(title)
+
+    # 2) análise + passagens
+    if analysis is None:
+        analysis = analyze(title, parsed)
+    if "parse_s" in analysis:
+        metrics.observe("stage_seconds", analysis.pop("parse_s"), stage="parse")
+    passages = analysis["passages"]
     if not passages:
+        if flush:
+            _delete_stale({title: []})
         return (0, 0, 0)
 
-    # 3) upsert OpenSearch (sempre)
-    os_bulk_upsert(passages)
+    # 3) upsert OpenSearch (sempre); com flush=False a limpeza das passagens
+    # antigas fica com quem faz o flush (_ingest_pages)
+    writer = os_writer()
+    writer.add_many(passages)
+    if flush:
+        with metrics.time("opensearch"):
+            results = writer.flush()
+        if not any(r.get("error") for r in results):
+            _delete_stale({title: [p["_id"] for p in passages]})
     os_cnt = len(passages)
 
-    # 4) upsert Qdrant (se disponível)
+    # 4) upsert vetorial (se habilitado): embeddings em lote, com cache
     qdr_cnt = 0
-    if _qdrant_upsert is not None:
-        try:
-            _qdrant_upsert(passages)
-            qdr_cnt = len(passages)
-        except Exception as e:
-            # não bloqueia ingestão se Qdrant falhar — apenas loga
-            print(f"[WARN] Qdrant upsert falhou em '{title}': {e}")
+    try:
+        vw = vec_writer()
+        qdr_cnt = vw.add_many(passages)
+        if flush:
+            vw.flush()
+    except Exception as e:
+        metrics.inc("errors_total", stage="qdrant", type=type(e).__name__)
+        # não bloqueia ingestão se Qdrant falhar — apenas loga
+        print(f"[WARN] Qdrant upsert falhou em '{title}': {e}")
 
     # 5) grafo (nodes, edges)
     g_edges = 0
     try:
         nodes, edges = extract_graph(title, parsed)
+        gw = graph_writer()
         if nodes:
-            upsert_nodes(nodes)
+            gw.add_nodes(nodes)
         if edges:
-            upsert_edges(edges)
+            gw.add_edges(edges)
+        if flush:
+            with metrics.time("neo4j"):
+                gw.flush()
         g_edges = len(edges or [])
     except Exception as e:
+        metrics.inc("errors_total", stage="neo4j", type=type(e).__name__)
         print(f"[WARN] Grafo falhou em '{title}': {e}")
 
     return (os_cnt, qdr_cnt, g_edges)
 
 
+def _delete_stale(keep: Dict[str, List[str]]):
+    """
+    Remove passagens de versões anteriores das páginas, no OpenSearch e no
+    backend vetorial (best-effort).
+    """
+    if not keep:
+        return
+    try:
+        with metrics.time("opensearch"):
+            os_writer().delete_stale(keep)
+    except Exception as e:
+        # sobra de passagens antigas não invalida a ingestão
+        metrics.inc("errors_total", stage="opensearch", type=type(e).__name__)
+        print(f"[WARN] limpeza de passagens antigas falhou: {e}")
+    try:
+        vec_writer().delete_stale(keep)
+    except Exception as e:
+        metrics.inc("errors_total", stage="qdrant", type=type(e).__name__)
+        print(f"[WARN] limpeza de vetores antigos falhou: {e}")
+
+
+def replay(limit: Optional[int] = None) -> Iterator[Tuple[str, Any, Optional[Exception], Dict]]:
+    """
+    Re-ingere a partir do store local (raw_store), sem rede: mesmo fluxo
+    de ingest_titles, mas lendo as páginas gravadas em disco.
+    """
+    store = get_raw_store()
+    if store is None:
+        raise SystemExit("RAW_STORE_DIR vazio — replay precisa do store local")
+    it = store.iter_pages(limit=limit)
+    while True:
+        chunk = list(islice(it, REPLAY_CHUNK))
+        if not chunk:
+            break
+        yield from _ingest_pages(chunk, {})
+
+
+def ingest_titles(
+    titles: Iterable[str],
+    known_hashes: Optional[Dict[str, str]] = None,
+) -> Iterator[Tuple[str, Any, Optional[Exception], Dict]]:
+    """
+    Processa vários títulos buscando o conteúdo em lote (get_pages, até
+    50 títulos por requisição ao MediaWiki) em vez de um action=parse
+    por título.
+
+    Se `known_hashes[title]` bater com o hash do wikitext atual, a página
+    não é re-parseada nem re-indexada (conteúdo inalterado).
+
+    Gera (título pedido, (os_docs, qdrant_pts, graph_edges) | None, erro | None, info)
+    com info = {"revid", "content_hash", "unchanged"}.
+    """
+    known_hashes = known_hashes or {}
+    it = iter(titles)
+
+    def fetch(chunk: List[str]):
+        try:
+            return list(get_pages(chunk)), None
+        except Exception as e:
+            return None, e
+
+    # busca o próximo lote numa thread enquanto o atual é parseado/indexado
+    with ThreadPoolExecutor(max_workers=1) as fetcher:
+        chunk = list(islice(it, MAX_TITLES_PER_QUERY))
+        fut = fetcher.submit(fetch, chunk) if chunk else None
+        while fut is not None:
+            pages, exc = fut.result()
+            cur = chunk
+            chunk = list(islice(it, MAX_TITLES_PER_QUERY))
+            fut = fetcher.submit(fetch, chunk) if chunk else None
+
+            if exc is not None:
+                # falha de rede/API derruba só este lote, não o run inteiro
+                for title in cur:
+                    yield title, None, exc, {}
+                continue
+
+            _store_raw(pages)
+            yield from _ingest_pages(pages, known_hashes)
+
+
+def _store_raw(pages: List[Dict]):
+    store = get_raw_store()
+    if store is None:
+        return
+    for page in pages:
+        if page.get("missing"):
+            continue
+        try:
+            with metrics.time("raw_store"):
+                store.put(page)
+        except Exception as e:
+            metrics.inc("errors_total", stage="raw_store", type=type(e).__name__)
+            # store é auxiliar: nunca bloqueia a ingestão
+            print(f"[WARN] raw store falhou em '{page.get('title')}': {e}")
+
+
+def _ingest_pages(
+    pages: Iterable[Dict],
+    known_hashes: Dict[str, str],
+) -> Iterator[Tuple[str, Any, Optional[Exception], Dict]]:
+    """
+    Ingere um lote de páginas com UM flush do writer do OpenSearch no fim.
+    Só depois do flush os resultados são devolvidos, então um título só
+    sai como sucesso se todos os seus docs foram aceitos pelo OpenSearch.
+    """
+    rows: List[List[Any]] = []
+    todo: List[Tuple[List[Any], Dict]] = []
+    for page in pages:
+        title = page.get("requested") or page.get("title")
+        info = {
+            "revid": page.get("revid"),
+            "content_hash": content_hash(page.get("wikitext") or ""),
+            "unchanged": False,
+        }
+        final = page.get("title") or title
+        row = [title, final, None, None, info]
+        rows.append(row)
+        if not page.get("missing") and known_hashes.get(title) == info["content_hash"]:
+            info["unchanged"] = True
+            row[2] = (0, 0, 0)
+        else:
+            todo.append((row, page))
+
+    # _ids produzidos por página: o que sobrar no índice é da versão anterior
+    keep: Dict[str, List[str]] = {}
+    jobs = [(row[1], page.get("wikitext") or "", page.get("categories") or []) for row, page in todo]
+    for (row, page), (analysis, perr) in zip(todo, _analyze_many(jobs)):
+        if perr is not None:
+            row[3] = RuntimeError(f"parse falhou: {perr}")
+            continue
+        if not page.get("missing"):
+            keep[row[1]] = [p["_id"] for p in analysis["passages"]]
+        try:
+            row[2] = ingest_title(row[1], page_as_parse(page), flush=False, analysis=analysis)
+        except Exception as e:
+            row[3] = e
+
+    failed: Dict[str, Any] = {}
+    try:
+        with metrics.time("opensearch"):
+            results = os_writer().flush()
+        for r in results:
+            if r.get("error"):
+                metrics.inc("errors_total", stage="opensearch", type=str(r.get("status")))
+                failed.setdefault(r.get("title"), r["error"])
+    except Exception as e:
+        # flush inteiro falhou: todo título que mandou docs falha junto
+        metrics.inc("errors_total", stage="opensearch", type=type(e).__name__)
+        for row in rows:
+            if row[2] and row[2][0]:
+                failed.setdefault(row[1], e)
+
+    # só depois do upsert: a página nunca fica sem passagens no índice
+    stale = {t: ids for t, ids in keep.items() if t not in failed}
+    for row in rows:
+        if row[3] is not None:
+            stale.pop(row[1], None)
+    _delete_stale(stale)
+
+    try:
+        vec_writer().flush()
+    except Exception as e:
+        # vetorial é best-effort, como o grafo
+        metrics.inc("errors_total", stage="qdrant", type=type(e).__name__)
+        print(f"[WARN] Qdrant (flush em lote) falhou: {e}")
+
+    try:
+        with metrics.time("neo4j"):
+            graph_writer().flush()
+    except Exception as e:
+        # grafo é best-effort, como no upsert por título
+        metrics.inc("errors_total", stage="neo4j", type=type(e).__name__)
+        print(f"[WARN] Grafo (flush em lote) falhou: {e}")
+
+    for title, final, counts, err, info in rows:
+        if err is None and final in failed:
+            counts, err = None, RuntimeError(f"OpenSearch bulk: {failed[final]}")
+        if err is not None:
+            metrics.inc("errors_total", stage="page", type=type(err).__name__)
+            metrics.inc("pages_total", result="failed")
+        else:
+            metrics.inc("pages_total", result="unchanged" if info["unchanged"] else "ok")
+        yield title, counts, err, info
+
+
+def bump_index_generation():
+    """Avisa o lado de QA (caches) que o índice mudou; falha só gera aviso."""
+    try:
+        bump_generation()
+    except Exception as e:
+        print(f"[WARN] geração do índice não atualizada: {e}")
+
+
 # -----------------------------------------------------------------------------
 # CLI
 # -----------------------------------------------------------------------------
@@ -164,9 +460,13 @@ def main():
     import argparse
 
     os_ensure_index()  # garante o índice lexical em OpenSearch
+    try:
+        graph_ensure_schema()  # constraint :Entity(id) + índices no Neo4j
+    except Exception as e:
+        print(f"[WARN] schema do Neo4j não criado: {e}")
 
     ap = argparse.ArgumentParser("Ingestor Fandom -> OpenSearch/Qdrant/Neo4j")
-    ap.add_argument("--mode", choices=["title", "allpages"], default="allpages")
+    ap.add_argument("--mode", choices=["title", "allpages", "replay"], default="allpages")
     ap.add_argument("--title", type=str, help="Título único (mode=title)")
     ap.add_argument(
         "--ap-namespace", type=int, default=0, help="Namespace MediaWiki (0=artigos)"
@@ -174,31 +474,83 @@ def main():
     ap.add_argument(
         "--limit", type=int, default=0, help="Limite de páginas (0 = sem limite)"
     )
+    ap.add_argument(
+        "--parse-workers",
+        type=int,
+        default=PARSE_WORKERS,
+        help="Processos dedicados ao parse de wikitext (0 = no próprio processo)",
+    )
+    ap.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.getenv("INGEST_METRICS_PORT", "9108")),
+        help="Porta HTTP de /metrics (Prometheus) e /metrics.json (0 = desligado)",
+    )
     args = ap.parse_args()
+    set_parse_workers(args.parse_workers)
+    if args.mode != "title":
+        serve_metrics(args.metrics_port)
 
     if args.mode == "title":
         if not args.title:
             raise SystemExit("--title é obrigatório com --mode title")
-        os_n, qd_n, ge_n = ingest_title(args.title)
-        print(f"[single] {args.title} -> OS={os_n} QD={qd_n} Gedges={ge_n}")
+        for title, counts, err, _info in ingest_titles([args.title]):
+            if err is not None:
+                raise err
+            os_n, qd_n, ge_n = counts
+            print(f"[single] {title} -> OS={os_n} QD={qd_n} Gedges={ge_n}")
+        os_writer().close(refresh=True)
+        vec_writer().close()
+        graph_writer().close()
+        bump_index_generation()
+        return
+
+    if args.mode == "replay":
+        # reconstrói OpenSearch/Neo4j a partir do store local, sem rede
+        total = 0
+        for i, (title, counts, err, _info) in enumerate(
+            replay(limit=(args.limit or None)), start=1
+        ):
+            if err is None:
+                os_n, qd_n, ge_n = counts
+                print(f"[replay {i}] {title} -> OS={os_n} QD={qd_n} Gedges={ge_n}")
+            else:
+                print(f"[WARN] replay('{title}') falhou: {err}")
+            total = i
+        os_writer().close(refresh=True)
+        vec_writer().close()
+        graph_writer().close()
+        bump_index_generation()
+        print(f"[done] replay: {total} páginas")
         return
 
     # mode=allpages
     total = 0
-    for i, title in enumerate(
-        iter_allpages(
-            ap_namespace=args.ap_namespace, limit=(args.limit or None)
+    for i, (title, counts, err, _info) in enumerate(
+        ingest_titles(
+            iter_allpages(
+                ap_namespace=args.ap_namespace, limit=(args.limit or None)
+            )
         ),
         start=1,
     ):
-        try:
-            os_n, qd_n, ge_n = ingest_title(title)
+        if err is None:
+            os_n, qd_n, ge_n = counts
             print(f"[{i}] {title} -> OS={os_n} QD={qd_n} Gedges={ge_n}")
-        except Exception as e:
-            print(f"[WARN] ingest_title('{title}') falhou: {e}")
+        else:
+            print(f"[WARN] ingest_title('{title}') falhou: {err}")
+        if i % 500 == 0:
+            print(f"[api] {rate_snapshot()}")
         total = i
 
-    print(f"[done] processados: {total}")
+    os_writer().close(refresh=True)
+    vec_writer().close()
+    graph_writer().close()
+    bump_index_generation()
+    print(
+        f"[done] processados: {total} | api={rate_snapshot()} | "
+        f"stages={metrics.snapshot()['stages']}"
+    )
 
 
 if __name__ == "__main__":
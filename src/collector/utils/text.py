@@ -1,6 +1,14 @@
 
+import os
 import re
-from typing import Iterable
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+PASSAGE_MAX_CHARS = int(os.getenv("PASSAGE_MAX_CHARS", "1200"))
+PASSAGE_OVERLAP = int(os.getenv("PASSAGE_OVERLAP", "150"))
+
+# parágrafo = trecho sem linha em branco no meio
+_PARA_RE = re.compile(r"\S(?:[^\n]|\n(?![ \t]*\n))*")
+_WS_RE = re.compile(r"\s+")
 
 def yield_passages(title: str, url: str, sections: Iterable):
     for sec_title, body in sections:
@@ -9,3 +17,64 @@ def yield_passages(title: str, url: str, sections: Iterable):
         for p in paras:
             yield {"title":title,"section":sec_title,"url":url,"text":p,"offset":offset}
             offset += len(p) + 2
+
+def _paragraph_spans(body: str) -> List[Tuple[int, int]]:
+    return [(m.start(), len(m.group(0).rstrip()) + m.start()) for m in _PARA_RE.finditer(body)]
+
+def _split_long(body: str, start: int, end: int, budget: int) -> List[Tuple[int, int]]:
+    """Quebra um parágrafo maior que o budget em janelas, cortando em espaço."""
+    spans = []
+    while end - start > budget:
+        cut = body.rfind(" ", start + budget // 2, start + budget)
+        if cut <= start:
+            cut = start + budget
+        spans.append((start, cut))
+        start = cut
+        while start < end and body[start].isspace():
+            start += 1
+    if start < end:
+        spans.append((start, end))
+    return spans
+
+def chunk_spans(body: str, max_chars: int = PASSAGE_MAX_CHARS, overlap: int = PASSAGE_OVERLAP) -> List[Tuple[int, int]]:
+    """
+    Spans (início, fim) no texto da seção: parágrafos agrupados até o budget
+    (max_chars - overlap), parágrafos longos quebrados em espaço, e cada
+    chunk estendido para trás em até `overlap` chars (a partir de início de
+    palavra) para dar contexto. Nenhum span passa de max_chars.
+    """
+    overlap = max(0, min(overlap, max_chars // 2))
+    budget = max(1, max_chars - overlap)
+    units: List[Tuple[int, int]] = []
+    for s, e in _paragraph_spans(body):
+        units.extend(_split_long(body, s, e, budget))
+
+    packed: List[Tuple[int, int]] = []
+    for s, e in units:
+        if packed and e - packed[-1][0] <= budget:
+            packed[-1] = (packed[-1][0], e)
+        else:
+            packed.append((s, e))
+
+    out: List[Tuple[int, int]] = []
+    for i, (s, e) in enumerate(packed):
+        if i and overlap:
+            o = max(packed[i - 1][0], s - overlap)
+            sp = body.find(" ", o, s)
+            s = sp + 1 if sp != -1 else s
+        out.append((s, e))
+    return out
+
+def chunk_passages(title: str, url: str, sections: Iterable[Tuple[str, str]],
+                   max_chars: int = PASSAGE_MAX_CHARS, overlap: int = PASSAGE_OVERLAP) -> Iterator[Dict]:
+    """
+    Como yield_passages, mas limitado em tamanho: gera passagens limpas,
+    rotuladas pela seção, com no máximo `max_chars` e `offset` = posição do
+    trecho dentro do texto da seção.
+    """
+    for sec_title, body in sections:
+        for s, e in chunk_spans(body or "", max_chars, overlap):
+            text = _WS_RE.sub(" ", body[s:e]).strip()
+            if text:
+                yield {"title": title, "section": sec_title, "url": url, "text": text, "offset": s}
+
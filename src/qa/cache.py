@@ -0,0 +1,262 @@
+# src/qa/cache.py
+"""
+Cache de respostas do /qa.
+
+- Local: LRU + TTL em memória (por worker do uvicorn).
+- Compartilhado (opcional, QA_CACHE_SHARED_PATH): SQLite em WAL, visto por
+  todos os workers da máquina/volume; consultado quando o local erra.
+- Chave: consulta normalizada + top_k + use_graph.
+- Cada entrada carrega a geração do índice (contador que a ingestão
+  incrementa no OpenSearch); mudou a geração, o cache local é descartado e
+  entradas compartilhadas de outra geração são ignoradas — nenhuma resposta
+  sobrevive a um reindex.
+- Handlers async usam aget/aset: o SQLite compartilhado (que pode esperar
+  até 5 s pelo lock) roda numa thread, fora do event loop.
+"""
+
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..collector.indexers.opensearch_index import GENERATION_DOC, META_INDEX
+
+QA_CACHE_SIZE = int(os.getenv("QA_CACHE_SIZE", "1024"))
+QA_CACHE_TTL = float(os.getenv("QA_CACHE_TTL", "600"))
+QA_CACHE_SHARED_PATH = os.getenv("QA_CACHE_SHARED_PATH", "")
+# de quanto em quanto tempo (s) consultar a geração do índice no OpenSearch
+QA_GEN_CHECK_SECONDS = float(os.getenv("QA_GEN_CHECK_SECONDS", "5"))
+
+DDL = """
+CREATE TABLE IF NOT EXISTS qa_cache(
+  key     TEXT PRIMARY KEY,
+  gen     INTEGER NOT NULL,
+  expires REAL NOT NULL,
+  value   TEXT NOT NULL
+);
+"""
+
+
+def normalize_query(query: str) -> str:
+    q = unicodedata.normalize("NFKC", query or "").casefold()
+    return " ".join(q.split())
+
+
+def cache_key(query: str, top_k: int, use_graph: bool) -> str:
+    return f"{normalize_query(query)}\x1f{int(top_k)}\x1f{int(bool(use_graph))}"
+
+
+class SharedCache:
+    """Backend compartilhado entre processos (SQLite)."""
+
+    def __init__(self, path: str, max_rows: int):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.max_rows = max_rows
+        self._con = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL;")
+        self._con.executescript(DDL)
+        self._con.commit()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key: str, gen: int) -> Optional[Any]:
+        with self._lock:
+            row = self._con.execute(
+                "SELECT value FROM qa_cache WHERE key=? AND gen=? AND expires>?",
+                (key, gen, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, gen: int, value: Any, ttl: float):
+        with self._lock:
+            self._con.execute(
+                "INSERT INTO qa_cache(key,gen,expires,value) VALUES(?,?,?,?) "
+                "ON CONFLICT(key) DO UPDATE SET gen=excluded.gen, "
+                "expires=excluded.expires, value=excluded.value",
+                (key, gen, time.time() + ttl, json.dumps(value, ensure_ascii=False)),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._prune(gen)
+            self._con.commit()
+
+    def _prune(self, gen: int):
+        # expiradas, de outra geração, e o excedente mais antigo
+        self._con.execute("DELETE FROM qa_cache WHERE expires<=? OR gen<>?", (time.time(), gen))
+        self._con.execute(
+            "DELETE FROM qa_cache WHERE key IN ("
+            " SELECT key FROM qa_cache ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        )
+
+
+class QACache:
+    def __init__(
+        self,
+        maxsize: int = QA_CACHE_SIZE,
+        ttl: float = QA_CACHE_TTL,
+        shared_path: str = QA_CACHE_SHARED_PATH,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._gen: Optional[int] = None
+        self.shared = SharedCache(shared_path, maxsize * 4) if shared_path else None
+        self.hits = self.misses = self.evictions = self.expired = 0
+        self.shared_hits = self.invalidations = 0
+
+    def _sync_generation(self, gen: int) -> bool:
+        """
+        Avança para `gen` (descartando o cache local) se ela for mais nova.
+        Retorna False se `gen` for mais velha que a atual: requisição lenta
+        que leu a geração antes de um bump — não lê nem grava no local.
+        Chamado com o lock.
+        """
+        if self._gen is None or gen > self._gen:
+            if self._gen is not None and self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._gen = gen
+        return gen == self._gen
+
+    def get(self, key: str, gen: int) -> Optional[Any]:
+        found, value = self._get_local(key, gen)
+        return value if found else self._get_shared(key, gen)
+
+    async def aget(self, key: str, gen: int) -> Optional[Any]:
+        """get() para handlers async: a leitura no SQLite compartilhado roda numa thread."""
+        found, value = self._get_local(key, gen)
+        if found:
+            return value
+        if self.shared is None:
+            return self._get_shared(key, gen)
+        return await asyncio.to_thread(self._get_shared, key, gen)
+
+    def _get_local(self, key: str, gen: int) -> Tuple[bool, Optional[Any]]:
+        now = time.monotonic()
+        with self._lock:
+            if not self._sync_generation(gen):
+                return False, None
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, item[1]
+                del self._data[key]
+                self.expired += 1
+        return False, None
+
+    def _get_shared(self, key: str, gen: int) -> Optional[Any]:
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key, gen)
+            except sqlite3.Error as e:
+                print(f"[WARN] cache compartilhado indisponível: {e}")
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                    if gen == self._gen:
+                        self._put(key, value, time.monotonic())
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put(self, key: str, value: Any, now: float):
+        self._data[key] = (now + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key: str, gen: int, value: Any):
+        if self._set_local(key, gen, value):
+            self._set_shared(key, gen, value)
+
+    async def aset(self, key: str, gen: int, value: Any):
+        """set() para handlers async: a escrita no SQLite compartilhado roda numa thread."""
+        if self._set_local(key, gen, value) and self.shared is not None:
+            await asyncio.to_thread(self._set_shared, key, gen, value)
+
+    def _set_local(self, key: str, gen: int, value: Any) -> bool:
+        """Grava no local; False (nada gravado) se `gen` já foi superada."""
+        with self._lock:
+            if not self._sync_generation(gen):
+                return False
+            self._put(key, value, time.monotonic())
+            return True
+
+    def _set_shared(self, key: str, gen: int, value: Any):
+        if self.shared is not None:
+            try:
+                self.shared.set(key, gen, value, self.ttl)
+            except sqlite3.Error as e:
+                print(f"[WARN] cache compartilhado indisponível: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "generation": self._gen,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "shared": self.shared is not None,
+            }
+
+
+qa_cache = QACache()
+
+
+# --- geração do índice (lado QA) ---
+_gen_lock = threading.Lock()
+_gen_value = 0
+_gen_checked = 0.0
+
+
+async def index_generation() -> int:
+    """
+    Geração atual do índice, consultada no OpenSearch no máximo a cada
+    QA_GEN_CHECK_SECONDS. Em erro, mantém o último valor conhecido.
+    """
+    global _gen_value, _gen_checked
+    now = time.monotonic()
+    with _gen_lock:
+        if now - _gen_checked < QA_GEN_CHECK_SECONDS:
+            return _gen_value
+        _gen_checked = now
+    from .search import os_client
+
+    try:
+        doc = await os_client.get(index=META_INDEX, id=GENERATION_DOC)
+        gen = int((doc.get("_source") or {}).get("generation", 0))
+    except Exception as e:
+        if getattr(e, "status_code", None) != 404:
+            print(f"[WARN] geração do índice indisponível: {e}")
+            return _gen_value
+        gen = 0
+    with _gen_lock:
+        _gen_value = gen
+    return gen
@@ -1,5 +1,9 @@
 import os
-from typing import List
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
 from sentence_transformers import SentenceTransformer
 
@@ -8,40 +12,185 @@ EMBEDDING_MODEL = os.getenv(
     "EMBEDDING_MODEL",
     "sentence-transformers/all-MiniLM-L6-v2",
 )
+# Diretório local com o modelo já baixado; se definido, nada vai à rede
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "64"))
+# micro-batching de consultas concorrentes e LRU de embeddings de consulta
+EMBED_QUERY_MAX_BATCH = int(os.getenv("EMBED_QUERY_MAX_BATCH", "32"))
+EMBED_QUERY_MAX_WAIT_MS = float(os.getenv("EMBED_QUERY_MAX_WAIT_MS", "5"))
+EMBED_QUERY_CACHE = int(os.getenv("EMBED_QUERY_CACHE", "4096"))
+
+# identifica o modelo nas chaves de cache (troca de modelo => cache novo)
+MODEL_ID = EMBEDDING_MODEL_PATH or EMBEDDING_MODEL
 
 _model: SentenceTransformer | None = None
+_model_lock = threading.Lock()
+_ready = False
 
 
 def _get_model() -> SentenceTransformer:
     """
-    Lazy-load do modelo de embeddings para não inicializar
-    antes da primeira chamada.
+    Lazy-load do modelo de embeddings (o serviço chama warmup() no
+    startup, então a primeira consulta já encontra o modelo carregado).
     """
     global _model
-    if _model is None:
-        _model = SentenceTransformer(EMBEDDING_MODEL)
+    if _model is not None:
+        return _model
+    with _model_lock:
+        if _model is not None:
+            return _model
+        if EMBEDDING_MODEL_PATH:
+            _model = SentenceTransformer(
+                EMBEDDING_MODEL_PATH, device=EMBEDDING_DEVICE, local_files_only=True
+            )
+        else:
+            _model = SentenceTransformer(EMBEDDING_MODEL, device=EMBEDDING_DEVICE)
     return _model
 
 
+def warmup() -> float:
+    """Carrega o modelo e roda um encode de aquecimento. Retorna os segundos gastos."""
+    global _ready
+    t0 = time.perf_counter()
+    _get_model().encode(["warmup"], normalize_embeddings=True, show_progress_bar=False)
+    _ready = True
+    return time.perf_counter() - t0
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+def embedding_dim() -> int:
+    return int(_get_model().get_sentence_embedding_dimension())
+
+
 def embed_query(text: str) -> List[float]:
     """
     Gera o embedding de uma única string de consulta.
     Retorna uma lista de floats (compatível com Qdrant / OpenSearch).
+    Normalizado (norma 1), como as passagens: cosseno == produto interno.
     """
     if not text:
         return []
     model = _get_model()
-    vec = model.encode(text)
+    vec = model.encode(text, normalize_embeddings=True)
     return vec.tolist()
 
 
-def embed_passages(texts: List[str]) -> List[List[float]]:
+# --- consultas: LRU + micro-batching ---
+_query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def _cache_get(text: str) -> Optional[List[float]]:
+    with _query_cache_lock:
+        vec = _query_cache.get(text)
+        if vec is not None:
+            _query_cache.move_to_end(text)
+        return vec
+
+
+def _cache_put(text: str, vec: List[float]):
+    with _query_cache_lock:
+        _query_cache[text] = vec
+        _query_cache.move_to_end(text)
+        while len(_query_cache) > EMBED_QUERY_CACHE:
+            _query_cache.popitem(last=False)
+
+
+class _QueryBatcher:
     """
-    Gera embeddings para uma lista de textos (passagens).
+    Junta chamadas concorrentes de embed_query_async num único encode:
+    o primeiro pedido abre uma janela de até EMBED_QUERY_MAX_WAIT_MS (ou
+    até EMBED_QUERY_MAX_BATCH pedidos) e o lote roda numa thread.
+    """
+
+    def __init__(self):
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def submit(self, text: str) -> "asyncio.Future":
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((text, fut))
+        if len(self._pending) >= EMBED_QUERY_MAX_BATCH:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(EMBED_QUERY_MAX_WAIT_MS / 1000.0, self._flush)
+        return fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[str, "asyncio.Future"]]):
+        texts = list(dict.fromkeys(t for t, _ in batch))
+        try:
+            vecs = await asyncio.to_thread(_encode_queries, texts)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        by_text: Dict[str, List[float]] = dict(zip(texts, vecs))
+        for t, v in by_text.items():
+            _cache_put(t, v)
+        for t, fut in batch:
+            if not fut.done():
+                fut.set_result(by_text[t])
+
+
+def _encode_queries(texts: List[str]) -> List[List[float]]:
+    vecs = _get_model().encode(
+        texts,
+        batch_size=len(texts),
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    return [v.tolist() for v in vecs]
+
+
+_batchers: Dict[int, _QueryBatcher] = {}
+
+
+async def embed_query_async(text: str) -> List[float]:
+    """
+    Versão assíncrona de embed_query para o serviço: LRU de consultas
+    recentes e micro-batching das chamadas concorrentes.
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+    vec = _cache_get(text)
+    if vec is not None:
+        return vec
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(id(loop))
+    if batcher is None:
+        batcher = _batchers[id(loop)] = _QueryBatcher()
+    return await batcher.submit(text)
+
+
+def embed_passages(texts: List[str], batch_size: int = EMBED_BATCH) -> List[List[float]]:
+    """
+    Gera embeddings para uma lista de textos (passagens), em lotes de
+    `batch_size` no modelo.
     """
     if not texts:
         return []
     model = _get_model()
-    vecs = model.encode(texts)
+    vecs = model.encode(
+        texts,
+        batch_size=batch_size,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
     return [v.tolist() for v in vecs]
-
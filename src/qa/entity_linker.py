@@ -0,0 +1,274 @@
+# src/qa/entity_linker.py
+"""
+Entity linking da consulta do /qa contra o grafo.
+
+- Superfícies de cada :Entity (name, aliases e o próprio id "blood-magic")
+  são normalizadas em tokens (casefold, sem acento) e vão para um autômato
+  Aho–Corasick sobre tokens: uma passada linear na consulta acha todas as
+  menções, respeitando fronteira de palavra.
+- Sobreposições: fica a menção mais longa à esquerda ("Blood Magic" ganha
+  de "Blood").
+- Carga completa no startup (paginada por id) e refresh incremental: só
+  nós com updated_at (gravado pelo neo4j_store) posterior à última marca
+  são buscados, via índice entity_updated; o autômato novo é montado numa
+  thread e trocado de uma vez.
+- A carga completa se repete a cada LINKER_FULL_SECONDS e descarta as
+  entidades que sumiram do grafo (o incremental não vê remoções).
+"""
+
+import os
+import re
+import time
+import asyncio
+import unicodedata
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from .graph_queries import GRAPH_MAX_ROWS, run_cypher
+
+LINKER_REFRESH_SECONDS = float(os.getenv("LINKER_REFRESH_SECONDS", "60"))
+LINKER_FULL_SECONDS = float(os.getenv("LINKER_FULL_SECONDS", "3600"))
+# superfícies de um token só mais curtas que isso são ignoradas ("of", "id")
+LINKER_MIN_CHARS = int(os.getenv("LINKER_MIN_CHARS", "3"))
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# predicados direto na propriedade: o planner usa o índice entity_updated
+CHANGED_Q = """
+MATCH (n:Entity)
+WHERE n.updated_at > $ts OR (n.updated_at = $ts AND n.id > $id)
+RETURN n.id AS id, n.name AS name, n.aliases AS aliases, n.updated_at AS ts
+ORDER BY n.updated_at, n.id
+LIMIT $limit
+"""
+
+# carga completa, paginada pela constraint de unicidade em :Entity(id)
+ALL_Q = """
+MATCH (n:Entity)
+WHERE n.id > $id
+RETURN n.id AS id, n.name AS name, n.aliases AS aliases
+ORDER BY n.id
+LIMIT $limit
+"""
+
+NOW_Q = "RETURN timestamp() AS now"
+
+
+def tokens(text: str) -> List[str]:
+    t = unicodedata.normalize("NFKD", text or "")
+    t = "".join(c for c in t if not unicodedata.combining(c)).casefold()
+    return _TOKEN_RE.findall(t)
+
+
+class Automaton:
+    """Aho–Corasick sobre sequências de tokens (transições por dict)."""
+
+    def __init__(self, patterns: Dict[Tuple[str, ...], Set[str]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # out[s]: padrões (tuplas de tokens) que terminam no estado s
+        self.out: List[List[Tuple[str, ...]]] = [[]]
+        self.ids = patterns
+        for pat in patterns:
+            s = 0
+            for tok in pat:
+                nxt = self.goto[s].get(tok)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[s][tok] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                s = nxt
+            self.out[s].append(pat)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            s = queue.popleft()
+            for tok, nxt in self.goto[s].items():
+                queue.append(nxt)
+                f = self.fail[s]
+                while f and tok not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(tok, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def scan(self, toks: List[str]) -> List[Tuple[int, int, Tuple[str, ...]]]:
+        """Todas as ocorrências como (início, fim_exclusivo, padrão)."""
+        hits = []
+        s = 0
+        for i, tok in enumerate(toks):
+            while s and tok not in self.goto[s]:
+                s = self.fail[s]
+            s = self.goto[s].get(tok, 0)
+            for pat in self.out[s]:
+                hits.append((i + 1 - len(pat), i + 1, pat))
+        return hits
+
+
+class EntityLinker:
+    def __init__(self):
+        # superfície (tokens) -> ids; id -> superfícies atuais (para trocar aliases)
+        self._surfaces: Dict[Tuple[str, ...], Set[str]] = {}
+        self._by_id: Dict[str, Set[Tuple[str, ...]]] = {}
+        self._names: Dict[str, str] = {}
+        self._aliases: Dict[str, List[str]] = {}
+        self._automaton: Optional[Automaton] = None
+        self._mark: Tuple[int, str] = (-1, "")
+        self._full_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._automaton is not None
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    @staticmethod
+    def _aliases_of(row: Dict) -> List[str]:
+        aliases = row.get("aliases")
+        if isinstance(aliases, str):
+            aliases = [aliases]
+        return [str(a) for a in aliases or [] if a]
+
+    def _surfaces_of(self, row: Dict) -> Set[Tuple[str, ...]]:
+        raw = [row.get("id"), row.get("name")]
+        raw.extend(self._aliases_of(row))
+        out = set()
+        for r in raw:
+            toks = tuple(tokens(str(r or "")))
+            if not toks or (len(toks) == 1 and len(toks[0]) < LINKER_MIN_CHARS):
+                continue
+            out.add(toks)
+        return out
+
+    def _drop_surfaces(self, eid: str):
+        for old in self._by_id.get(eid, ()):
+            ids = self._surfaces.get(old)
+            if ids is not None:
+                ids.discard(eid)
+                if not ids:
+                    del self._surfaces[old]
+
+    def _remove(self, eid: str):
+        self._drop_surfaces(eid)
+        self._by_id.pop(eid, None)
+        self._names.pop(eid, None)
+        self._aliases.pop(eid, None)
+
+    def _apply(self, rows: List[Dict]):
+        for row in rows:
+            eid = row.get("id")
+            if not eid:
+                continue
+            self._drop_surfaces(eid)
+            new = self._surfaces_of(row)
+            for s in new:
+                self._surfaces.setdefault(s, set()).add(eid)
+            self._by_id[eid] = new
+            self._names[eid] = row.get("name") or eid
+            self._aliases[eid] = self._aliases_of(row)
+
+    async def _full_load(self) -> int:
+        """Todas as entidades; remove as que não existem mais. Retorna quantas mudaram."""
+        # marca = relógio do servidor antes do scan: o que mudar durante a
+        # carga tem updated_at >= now e volta no próximo incremental
+        now = (await run_cypher(NOW_Q))[0]["now"]
+        seen: Set[str] = set()
+        last_id = ""
+        while True:
+            rows = await run_cypher(ALL_Q, {"id": last_id, "limit": GRAPH_MAX_ROWS})
+            if not rows:
+                break
+            self._apply(rows)
+            seen.update(r["id"] for r in rows if r.get("id"))
+            last_id = rows[-1]["id"]
+            if len(rows) < GRAPH_MAX_ROWS:
+                break
+        gone = [eid for eid in self._by_id if eid not in seen]
+        for eid in gone:
+            self._remove(eid)
+        self._mark = (int(now), "")
+        self._full_at = time.monotonic()
+        return len(seen) + len(gone)
+
+    async def refresh(self, full: bool = False) -> int:
+        """
+        Busca os nós alterados desde a última marca (ou tudo, na carga
+        completa) e remonta o autômato. Retorna quantos mudaram.
+        """
+        async with self._lock:
+            if (
+                full
+                or self._full_at is None
+                or time.monotonic() - self._full_at >= LINKER_FULL_SECONDS
+            ):
+                changed = await self._full_load()
+                patterns = {k: set(v) for k, v in self._surfaces.items()}
+                self._automaton = await asyncio.to_thread(Automaton, patterns)
+                return changed
+            changed = 0
+            while True:
+                ts, last_id = self._mark
+                rows = await run_cypher(
+                    CHANGED_Q, {"ts": ts, "id": last_id, "limit": GRAPH_MAX_ROWS}
+                )
+                if not rows:
+                    break
+                self._apply(rows)
+                changed += len(rows)
+                self._mark = (int(rows[-1]["ts"]), rows[-1]["id"])
+                if len(rows) < GRAPH_MAX_ROWS:
+                    break
+            if changed or self._automaton is None:
+                patterns = {k: set(v) for k, v in self._surfaces.items()}
+                self._automaton = await asyncio.to_thread(Automaton, patterns)
+            return changed
+
+    def entries(self) -> List[Tuple[str, str, List[str]]]:
+        """(id, nome, aliases) de todas as entidades carregadas."""
+        return [(eid, self._names.get(eid, eid), self._aliases.get(eid, [])) for eid in self._by_id]
+
+    def link(self, text: str) -> List[Dict]:
+        """
+        Menções de entidades em `text`, sem sobreposição (mais longa à
+        esquerda), na ordem em que aparecem.
+        """
+        automaton = self._automaton
+        if automaton is None:
+            return []
+        hits = automaton.scan(tokens(text))
+        hits.sort(key=lambda h: (h[0], -(h[1] - h[0])))
+        out: List[Dict] = []
+        end = 0
+        for start, stop, pat in hits:
+            if start < end:
+                continue
+            end = stop
+            ids = sorted(automaton.ids.get(pat, ()))
+            out.append(
+                {
+                    "surface": " ".join(pat),
+                    "ids": ids,
+                    "names": [self._names.get(i, i) for i in ids],
+                }
+            )
+        return out
+
+
+linker = EntityLinker()
+
+
+async def refresh_loop():
+    """Carga inicial e refresh periódico (task de background do serviço)."""
+    while True:
+        try:
+            changed = await linker.refresh()
+            if changed:
+                print(f"[linker] {changed} entidades atualizadas ({len(linker)} no total)", flush=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARN] refresh do entity linker falhou: {e}")
+        await asyncio.sleep(LINKER_REFRESH_SECONDS)
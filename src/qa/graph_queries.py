@@ -1,29 +1,226 @@
 # src/qa/graph_queries.py
+"""
+Acesso read-only ao Neo4j para o serviço de QA.
+
+- Toda consulta roda numa transação de leitura (READ_ACCESS: em cluster é
+  roteada para os leitores; num servidor único, escrita é recusada pelo
+  próprio Neo4j) com timeout aplicado no servidor (GRAPH_TIMEOUT).
+- Os registros são consumidos em streaming (fetch_size) e cortados em
+  GRAPH_MAX_ROWS: um MATCH sem LIMIT não carrega o grafo inteiro no worker.
+- CATALOG: consultas nomeadas e parametrizadas. O texto é constante, então
+  o Neo4j reaproveita o plano em cache; os resultados ficam num LRU+TTL
+  invalidado pela geração do índice (como as respostas do /qa).
+"""
+
 import os
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from neo4j import AsyncGraphDatabase, READ_ACCESS
 
-from neo4j import GraphDatabase
+from .cache import QACache
 
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://neo4j:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "please_change_me")
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+NEO4J_ACQUIRE_TIMEOUT = float(os.getenv("NEO4J_ACQUIRE_TIMEOUT", "10"))
+# limites de toda consulta vinda do /graph
+GRAPH_MAX_ROWS = int(os.getenv("GRAPH_MAX_ROWS", "1000"))
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", "10"))
+GRAPH_FETCH_SIZE = int(os.getenv("GRAPH_FETCH_SIZE", "200"))
+# cache de resultados das consultas nomeadas
+GRAPH_CACHE_SIZE = int(os.getenv("GRAPH_CACHE_SIZE", "256"))
+GRAPH_CACHE_TTL = float(os.getenv("GRAPH_CACHE_TTL", "600"))
+
+# Driver assíncrono global, com pool de conexões dimensionado explicitamente
+_driver = AsyncGraphDatabase.driver(
+    NEO4J_URI,
+    auth=(NEO4J_USER, NEO4J_PASSWORD),
+    max_connection_pool_size=NEO4J_POOL_SIZE,
+    connection_acquisition_timeout=NEO4J_ACQUIRE_TIMEOUT,
+)
+
+
+async def close():
+    """Fecha o driver (shutdown do app)."""
+    await _driver.close()
+
+
+def _plain(x: Any) -> Any:
+    """Valor do driver -> JSON puro (Node/Relationship viram dict de propriedades)."""
+    if x is None or isinstance(x, (str, int, float, bool)):
+        return x
+    if isinstance(x, (list, tuple)):
+        return [_plain(i) for i in x]
+    if isinstance(x, dict) or hasattr(x, "items"):
+        return {str(k): _plain(v) for k, v in x.items()}
+    return str(x)
+
 
-# Driver global simples. Se quiser, depois podemos adicionar close() etc.
-_driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+class RowLimitReached(Exception):
+    """Sinaliza (para quem quiser saber) que o resultado foi truncado."""
+
+
+async def stream_cypher(
+    query: str,
+    params: Dict[str, Any] | None = None,
+    limit: int = GRAPH_MAX_ROWS,
+    timeout: float = GRAPH_TIMEOUT,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Executa `query` numa transação de leitura e devolve os registros um a
+    um (dicts). Para depois de `limit` registros (no máximo GRAPH_MAX_ROWS)
+    e levanta RowLimitReached se ainda havia mais; a transação é sempre
+    desfeita no fim, inclusive se o cliente desconectar no meio.
+    """
+    limit = max(0, min(int(limit), GRAPH_MAX_ROWS))
+    n = 0
+    async for row in stream_read(query, params, timeout):
+        if n >= limit:
+            raise RowLimitReached(limit)
+        n += 1
+        yield row
+
+
+async def stream_read(
+    query: str,
+    params: Dict[str, Any] | None = None,
+    timeout: float = GRAPH_TIMEOUT,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Transação de leitura em streaming, sem limite de linhas: só para
+    consultas internas (export do snapshot); o que vem de fora usa stream_cypher.
+    """
+    async with _driver.session(default_access_mode=READ_ACCESS, fetch_size=GRAPH_FETCH_SIZE) as session:
+        tx = await session.begin_transaction(timeout=timeout)
+        try:
+            result = await tx.run(query, params or {})
+            async for record in result:
+                yield {k: _plain(v) for k, v in record.items()}
+        finally:
+            await tx.close()
 
 
-def run_cypher(query: str, params: Dict[str, Any] | None = None) -> List[Dict[str, Any]]:
+async def run_cypher(
+    query: str,
+    params: Dict[str, Any] | None = None,
+    limit: int = GRAPH_MAX_ROWS,
+) -> List[Dict[str, Any]]:
     """
-    Executa uma query Cypher read-only e retorna lista de dicts,
-    no formato que o /graph e o /qa esperam.
+    Executa uma query Cypher read-only e retorna lista de dicts (no máximo
+    `limit`; o excedente é descartado), no formato que o /graph e o /qa esperam.
 
     Exemplo:
-        rows = run_cypher("RETURN 1 AS x")
+        rows = await run_cypher("RETURN 1 AS x")
         -> [ {"x": 1} ]
     """
-    params = params or {}
-    with _driver.session() as session:
-        result = session.run(query, params)
-        # result.data() já traz uma lista de dicts, mas vamos garantir:
-        rows: List[Dict[str, Any]] = [dict(r) for r in result]
+    rows: List[Dict[str, Any]] = []
+    try:
+        async for row in stream_cypher(query, params, limit):
+            rows.append(row)
+    except RowLimitReached:
+        pass
     return rows
+
+
+# --- catálogo de consultas nomeadas ---
+# params: defaults (o tipo do default define a conversão do que vem na URL)
+CATALOG: Dict[str, Dict[str, Any]] = {
+    "clan_disciplines": {
+        "description": "Disciplinas de cada clã",
+        "cypher": (
+            'MATCH (c:Entity {type:"Clan"})-[:REL {rel:"HAS_DISCIPLINE"}]->(d:Entity {type:"Discipline"}) '
+            "RETURN c.id AS clan, collect(d.id)[0..$per_clan] AS disciplines "
+            "ORDER BY clan LIMIT $limit"
+        ),
+        "params": {"per_clan": 5, "limit": 50},
+    },
+    "entity_neighbors": {
+        "description": "Vizinhos diretos de uma entidade (por id)",
+        "cypher": (
+            "MATCH (a:Entity {id:$id})-[r:REL]-(b:Entity) "
+            "RETURN a.id AS src, r.rel AS rel, b.id AS dst, b.type AS dst_type, "
+            "startNode(r) = a AS outgoing LIMIT $limit"
+        ),
+        "params": {"id": "", "limit": 100},
+    },
+    "entities_by_type": {
+        "description": "Entidades de um tipo (Clan, Discipline, ...)",
+        "cypher": (
+            "MATCH (n:Entity {type:$type}) "
+            "RETURN n.id AS id, n.name AS name ORDER BY id LIMIT $limit"
+        ),
+        "params": {"type": "Clan", "limit": 100},
+    },
+}
+
+_named_cache = QACache(maxsize=GRAPH_CACHE_SIZE, ttl=GRAPH_CACHE_TTL, shared_path="")
+
+
+def catalog() -> List[Dict[str, Any]]:
+    return [
+        {"name": name, "description": q["description"], "params": q["params"]}
+        for name, q in CATALOG.items()
+    ]
+
+
+def _coerce(name: str, raw: Dict[str, Any]) -> Dict[str, Any]:
+    spec = CATALOG[name]["params"]
+    params: Dict[str, Any] = {}
+    for key, default in spec.items():
+        value = raw.get(key, default)
+        try:
+            if isinstance(default, bool):
+                value = str(value).lower() in ("1", "true", "yes")
+            elif isinstance(default, int):
+                value = int(value)
+            elif isinstance(default, float):
+                value = float(value)
+            else:
+                value = str(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"parâmetro inválido {key}={value!r}")
+        params[key] = value
+    if "limit" in params:
+        params["limit"] = max(1, min(params["limit"], GRAPH_MAX_ROWS))
+    return params
+
+
+async def run_named(name: str, raw_params: Dict[str, Any], gen: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]], bool]:
+    """
+    Executa a consulta nomeada `name` (KeyError se não existir) com os
+    parâmetros convertidos. Retorna (params, rows, veio_do_cache).
+    """
+    params = _coerce(name, raw_params)
+    key = name + "\x1f" + "\x1f".join(f"{k}={params[k]!r}" for k in sorted(params))
+    rows: Optional[List[Dict[str, Any]]] = _named_cache.get(key, gen)
+    if rows is not None:
+        return params, rows, True
+    rows = await run_cypher(CATALOG[name]["cypher"], params)
+    _named_cache.set(key, gen, rows)
+    return params, rows, False
+
+
+def named_cache_stats() -> Dict[str, Any]:
+    return _named_cache.stats()
+
+
+# --- vizinhança das entidades linkadas no /qa ---
+NEIGHBORHOOD_Q = """
+UNWIND $ids AS eid
+MATCH (a:Entity {id: eid})-[r:REL]-(b:Entity)
+WITH a, r, b
+ORDER BY a.id, CASE r.confidence WHEN 'high' THEN 0 ELSE 1 END, b.id
+WITH a, collect({rel: r.rel, id: b.id, name: b.name, type: b.type, out: startNode(r) = a})[0..$per_entity] AS ns
+UNWIND ns AS nb
+RETURN a.id AS entity, a.name AS entity_name, nb.rel AS rel,
+       CASE WHEN nb.out THEN 'out' ELSE 'in' END AS direction,
+       nb.id AS neighbor, nb.name AS neighbor_name, nb.type AS neighbor_type
+"""
+
+
+async def neighborhoods(ids: List[str], per_entity: int = 10) -> List[Dict[str, Any]]:
+    """Vizinhos diretos de várias entidades numa única ida ao Neo4j."""
+    if not ids:
+        return []
+    return await run_cypher(NEIGHBORHOOD_Q, {"ids": list(ids), "per_entity": int(per_entity)})
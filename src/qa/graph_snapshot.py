@@ -0,0 +1,383 @@
+# src/qa/graph_snapshot.py
+"""
+Snapshot em memória do grafo :Entity-[:REL]->:Entity para o serviço de QA.
+
+- Exportado do Neo4j (uma transação de leitura em streaming) para arrays
+  NumPy em CSR: indptr/indices/rel/high por direção (saída e entrada),
+  mais o mapa id -> índice. Strings (ids, nomes, tipos) ficam num blob
+  UTF-8 com offsets, não em arrays de largura fixa.
+- Salvo em GRAPH_SNAPSHOT_PATH (.npz, troca atômica) junto com a geração do
+  índice: os workers do uvicorn carregam o arquivo em vez de reexportar;
+  quando a geração muda (ingestão nova), o primeiro a notar reexporta.
+- Responde vizinhança k-hop, expansão filtrada por relação e caminho
+  mínimo sem sair do processo; Neo4j fica só para Cypher ad-hoc (/graph)
+  e como fallback enquanto não há snapshot carregado.
+"""
+
+import os
+import time
+import asyncio
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .cache import index_generation
+from .graph_queries import stream_read
+
+GRAPH_SNAPSHOT = os.getenv("GRAPH_SNAPSHOT", "1") not in ("0", "false", "no", "")
+GRAPH_SNAPSHOT_PATH = os.getenv("GRAPH_SNAPSHOT_PATH", "checkpoints/graph_snapshot.npz")
+GRAPH_SNAPSHOT_CHECK_SECONDS = float(os.getenv("GRAPH_SNAPSHOT_CHECK_SECONDS", "30"))
+GRAPH_SNAPSHOT_TIMEOUT = float(os.getenv("GRAPH_SNAPSHOT_TIMEOUT", "300"))
+
+NODES_Q = "MATCH (n:Entity) RETURN n.id AS id, n.name AS name, n.type AS type"
+EDGES_Q = (
+    "MATCH (a:Entity)-[r:REL]->(b:Entity) "
+    "RETURN a.id AS src, b.id AS dst, r.rel AS rel, r.confidence AS confidence"
+)
+
+DIRECTIONS = ("out", "in", "both")
+
+
+def _pack(strings: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    data = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in data])
+    return np.frombuffer(b"".join(data), dtype=np.uint8).copy(), offsets
+
+
+def _unpack(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    raw = blob.tobytes()
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def _csr(src: np.ndarray, dst: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(indptr, order): order ordena as arestas por (src, dst)."""
+    order = np.lexsort((dst, src))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(src, minlength=n))
+    return indptr, order
+
+
+class GraphSnapshot:
+    def __init__(
+        self,
+        ids: List[str],
+        names: List[str],
+        types: List[str],
+        rels: List[str],
+        src: np.ndarray,
+        dst: np.ndarray,
+        rel: np.ndarray,
+        high: np.ndarray,
+        generation: int = 0,
+    ):
+        self.ids = ids
+        self.names = names
+        self.types = types
+        self.rels = rels
+        self.generation = generation
+        self.index: Dict[str, int] = {i: k for k, i in enumerate(ids)}
+        self.rel_index: Dict[str, int] = {r: k for k, r in enumerate(rels)}
+        n = len(ids)
+        self.src, self.dst = src.astype(np.int32), dst.astype(np.int32)
+        self.rel, self.high = rel.astype(np.int16), high.astype(bool)
+        # CSR de saída (por src) e de entrada (por dst); guardam a posição da aresta
+        self.out_ptr, out_order = _csr(self.src, self.dst, n)
+        self.in_ptr, in_order = _csr(self.dst, self.src, n)
+        self.out_edge = out_order.astype(np.int64)
+        self.in_edge = in_order.astype(np.int64)
+        self.out_nb = self.dst[out_order]
+        self.in_nb = self.src[in_order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def n_edges(self) -> int:
+        return int(self.src.shape[0])
+
+    def degrees(self) -> np.ndarray:
+        """Grau (entrada + saída) de cada nó."""
+        return np.diff(self.out_ptr) + np.diff(self.in_ptr)
+
+    # --- persistência ---
+    def save(self, path: str):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        arrays: Dict[str, np.ndarray] = {}
+        for name, values in (("ids", self.ids), ("names", self.names), ("types", self.types), ("rels", self.rels)):
+            arrays[f"{name}_blob"], arrays[f"{name}_off"] = _pack(values)
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp,
+            src=self.src,
+            dst=self.dst,
+            rel=self.rel,
+            high=self.high,
+            generation=np.int64(self.generation),
+            **arrays,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "GraphSnapshot":
+        with np.load(path, allow_pickle=False) as z:
+            strings = {name: _unpack(z[f"{name}_blob"], z[f"{name}_off"]) for name in ("ids", "names", "types", "rels")}
+            return cls(
+                strings["ids"], strings["names"], strings["types"], strings["rels"],
+                z["src"], z["dst"], z["rel"], z["high"], int(z["generation"]),
+            )
+
+    @staticmethod
+    def file_generation(path: str) -> Optional[int]:
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                return int(z["generation"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    # --- travessias ---
+    def _rel_mask(self, rels: Optional[Sequence[str]]) -> Optional[np.ndarray]:
+        if not rels:
+            return None
+        mask = np.zeros(len(self.rels), dtype=bool)
+        for r in rels:
+            k = self.rel_index.get(r)
+            if k is not None:
+                mask[k] = True
+        return mask
+
+    def _expand(self, frontier: np.ndarray, direction: str, mask: Optional[np.ndarray]):
+        """
+        Todas as arestas que saem de `frontier` (vetorizado).
+        Retorna (pai, vizinho, aresta, sentido) com sentido 1=out, 0=in.
+        """
+        parts = []
+        for sense, ptr, nb, edge in (
+            (1, self.out_ptr, self.out_nb, self.out_edge),
+            (0, self.in_ptr, self.in_nb, self.in_edge),
+        ):
+            if direction == ("in" if sense else "out"):
+                continue
+            starts, ends = ptr[frontier], ptr[frontier + 1]
+            counts = ends - starts
+            total = int(counts.sum())
+            if not total:
+                continue
+            base = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            pos = base + np.arange(total)
+            e = edge[pos]
+            parent = np.repeat(frontier, counts)
+            nbr = nb[pos]
+            if mask is not None:
+                keep = mask[self.rel[e]]
+                parent, nbr, e = parent[keep], nbr[keep], e[keep]
+            parts.append((parent, nbr, e, np.full(len(e), sense, dtype=np.int8)))
+        if not parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, np.zeros(0, dtype=np.int8)
+        return tuple(np.concatenate(p) for p in zip(*parts))
+
+    def _bfs(self, start: int, k: int, direction: str, mask: Optional[np.ndarray], target: int = -1):
+        """BFS por níveis; pai/aresta/sentido de cada nó alcançado (-1 = não alcançado)."""
+        n = len(self.ids)
+        depth = np.full(n, -1, dtype=np.int32)
+        parent = np.full(n, -1, dtype=np.int64)
+        via = np.full(n, -1, dtype=np.int64)
+        sense = np.zeros(n, dtype=np.int8)
+        depth[start] = 0
+        frontier = np.array([start], dtype=np.int64)
+        for level in range(1, k + 1):
+            p, nbr, e, s = self._expand(frontier, direction, mask)
+            if not len(nbr):
+                break
+            # primeira descoberta de cada nó novo (ordem estável: arestas 'high' primeiro)
+            order = np.lexsort((~self.high[e], nbr))
+            p, nbr, e, s = p[order], nbr[order], e[order], s[order]
+            first = np.ones(len(nbr), dtype=bool)
+            first[1:] = nbr[1:] != nbr[:-1]
+            new = first & (depth[nbr] < 0)
+            nbr, p, e, s = nbr[new], p[new], e[new], s[new]
+            if not len(nbr):
+                break
+            depth[nbr], parent[nbr], via[nbr], sense[nbr] = level, p, e, s
+            if target >= 0 and depth[target] >= 0:
+                break
+            frontier = nbr.astype(np.int64)
+        return depth, parent, via, sense
+
+    def _step(self, node: int, parent: int, edge: int, sense: int) -> Dict[str, Any]:
+        return {
+            "from": self.ids[parent],
+            "rel": self.rels[self.rel[edge]],
+            "direction": "out" if sense else "in",
+            "to": self.ids[node],
+        }
+
+    def neighborhood(
+        self,
+        entity_id: str,
+        k: int = 1,
+        rels: Optional[Sequence[str]] = None,
+        direction: str = "both",
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """Nós a até `k` saltos (filtrando por tipo de relação), mais próximos primeiro."""
+        start = self.index.get(entity_id)
+        if start is None:
+            return []
+        depth, parent, via, sense = self._bfs(start, k, direction, self._rel_mask(rels))
+        reached = np.nonzero(depth > 0)[0]
+        reached = reached[np.argsort(depth[reached], kind="stable")][:limit]
+        return [
+            {
+                "id": self.ids[i],
+                "name": self.names[i],
+                "type": self.types[i],
+                "depth": int(depth[i]),
+                **self._step(int(i), int(parent[i]), int(via[i]), int(sense[i])),
+            }
+            for i in reached
+        ]
+
+    def neighbor_rows(self, ids: Sequence[str], per_entity: int = 10) -> List[Dict[str, Any]]:
+        """Mesmo formato de graph_queries.neighborhoods (vizinhos diretos, 'high' primeiro)."""
+        rows: List[Dict[str, Any]] = []
+        for eid in ids:
+            a = self.index.get(eid)
+            if a is None:
+                continue
+            _, nbr, e, s = self._expand(np.array([a], dtype=np.int64), "both", None)
+            order = np.lexsort((nbr, ~self.high[e]))[:per_entity]
+            for j in order:
+                b = int(nbr[j])
+                rows.append(
+                    {
+                        "entity": eid,
+                        "entity_name": self.names[a],
+                        "rel": self.rels[self.rel[e[j]]],
+                        "direction": "out" if s[j] else "in",
+                        "neighbor": self.ids[b],
+                        "neighbor_name": self.names[b],
+                        "neighbor_type": self.types[b],
+                    }
+                )
+        return rows
+
+    def shortest_path(
+        self,
+        src_id: str,
+        dst_id: str,
+        rels: Optional[Sequence[str]] = None,
+        direction: str = "both",
+        max_depth: int = 6,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Passos do caminho mínimo (em saltos) de src a dst; None se não houver."""
+        a, b = self.index.get(src_id), self.index.get(dst_id)
+        if a is None or b is None:
+            return None
+        if a == b:
+            return []
+        depth, parent, via, sense = self._bfs(a, max_depth, direction, self._rel_mask(rels), target=b)
+        if depth[b] < 0:
+            return None
+        steps = []
+        node = b
+        while node != a:
+            steps.append(self._step(node, int(parent[node]), int(via[node]), int(sense[node])))
+            node = int(parent[node])
+        return steps[::-1]
+
+
+async def export(generation: int = 0) -> GraphSnapshot:
+    """Lê nós e arestas do Neo4j (read tx em streaming) e monta o snapshot."""
+    ids: List[str] = []
+    names: List[str] = []
+    types: List[str] = []
+    index: Dict[str, int] = {}
+
+    def node(eid: str, name: Optional[str] = None, typ: Optional[str] = None) -> int:
+        k = index.get(eid)
+        if k is None:
+            k = index[eid] = len(ids)
+            ids.append(eid)
+            names.append(name or eid)
+            types.append(typ or "")
+        return k
+
+    async for row in stream_read(NODES_Q, timeout=GRAPH_SNAPSHOT_TIMEOUT):
+        if row.get("id"):
+            node(str(row["id"]), row.get("name"), row.get("type"))
+
+    rels: List[str] = []
+    rel_index: Dict[str, int] = {}
+    src: List[int] = []
+    dst: List[int] = []
+    rel: List[int] = []
+    high: List[bool] = []
+    async for row in stream_read(EDGES_Q, timeout=GRAPH_SNAPSHOT_TIMEOUT):
+        if not row.get("src") or not row.get("dst"):
+            continue
+        r = str(row.get("rel") or "")
+        if r not in rel_index:
+            rel_index[r] = len(rels)
+            rels.append(r)
+        src.append(node(str(row["src"])))
+        dst.append(node(str(row["dst"])))
+        rel.append(rel_index[r])
+        high.append(row.get("confidence") == "high")
+
+    return GraphSnapshot(
+        ids, names, types, rels,
+        np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32),
+        np.array(rel, dtype=np.int16), np.array(high, dtype=bool),
+        generation,
+    )
+
+
+# --- snapshot do processo ---
+_snapshot: Optional[GraphSnapshot] = None
+
+
+def get_snapshot() -> Optional[GraphSnapshot]:
+    """Snapshot atual; None enquanto não carregou (ou GRAPH_SNAPSHOT=0)."""
+    return _snapshot
+
+
+async def reload(generation: int) -> GraphSnapshot:
+    """Usa o arquivo compartilhado se for da geração atual; senão reexporta do Neo4j."""
+    global _snapshot
+    t0 = time.perf_counter()
+    snap = None
+    if GRAPH_SNAPSHOT_PATH and await asyncio.to_thread(GraphSnapshot.file_generation, GRAPH_SNAPSHOT_PATH) == generation:
+        snap = await asyncio.to_thread(GraphSnapshot.load, GRAPH_SNAPSHOT_PATH)
+        source = "arquivo"
+    if snap is None:
+        snap = await export(generation)
+        source = "neo4j"
+        if GRAPH_SNAPSHOT_PATH:
+            await asyncio.to_thread(snap.save, GRAPH_SNAPSHOT_PATH)
+    _snapshot = snap
+    print(
+        f"[graph] snapshot g{generation} ({source}): {len(snap)} nós, {snap.n_edges} arestas "
+        f"em {time.perf_counter() - t0:.1f}s",
+        flush=True,
+    )
+    return snap
+
+
+async def refresh_loop():
+    """Recarrega o snapshot quando a geração do índice muda (task de background)."""
+    if not GRAPH_SNAPSHOT:
+        return
+    while True:
+        try:
+            gen = await index_generation()
+            if _snapshot is None or _snapshot.generation != gen:
+                await reload(gen)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARN] snapshot do grafo indisponível: {e!r} — usando Neo4j")
+        await asyncio.sleep(GRAPH_SNAPSHOT_CHECK_SECONDS)
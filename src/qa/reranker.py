@@ -1,22 +1,189 @@
 # src/qa/reranker.py
+"""
+Reranking com cross-encoder em CPU.
+
+- Modelo local (RERANK_MODEL_PATH), carregado uma vez por processo:
+    RERANK_BACKEND=cross-encoder  sentence_transformers.CrossEncoder
+    RERANK_BACKEND=onnx           onnxruntime + tokenizer do mesmo diretório
+                                  (RERANK_ONNX_FILE, ex.: model_quantized.onnx)
+    RERANK_BACKEND=none           só ordena pelo score da fusão (antigo)
+  Default: cross-encoder se RERANK_MODEL_PATH existir, senão none.
+- Todos os pares (query, passagem) ainda não vistos vão num único batch.
+- Scores ficam num LRU por (query normalizada, hash da passagem).
+- Orçamento de latência (RERANK_BUDGET_MS): com o custo por par medido
+  (média móvel), só os top-N da fusão que cabem no orçamento são
+  reranqueados; o resto mantém a ordem da fusão, depois deles.
+"""
+
 import os
-from typing import List, Dict
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
 COHERE_API_KEY = os.getenv("COHERE_API_KEY") or ""
 RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_MODEL_PATH = os.getenv("RERANK_MODEL_PATH", "")
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "cross-encoder" if RERANK_MODEL_PATH else "none")
+RERANK_ONNX_FILE = os.getenv("RERANK_ONNX_FILE", "model.onnx")
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_MIN_N = int(os.getenv("RERANK_MIN_N", "5"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
 
-# Versão simplificada: se não houver reranker configurado, apenas ordena pelos scores existentes
 
-def rerank(query: str, docs: List[Dict], top_k: int | None = None) -> List[Dict]:
-    """
-    Recebe uma lista de docs do search.hybrid, já no formato:
-        { "title": ..., "url": ..., "text": ..., "score": ... }
+class _CrossEncoderScorer:
+    def __init__(self, path: str):
+        from sentence_transformers import CrossEncoder
 
-    Retorna a mesma lista, possivelmente reordenada, e opcionalmente truncada em top_k.
+        self.model = CrossEncoder(path, device="cpu", max_length=RERANK_MAX_LENGTH)
+
+    def score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        return [float(s) for s in self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+
+class _OnnxScorer:
+    def __init__(self, path: str):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(path, local_files_only=True)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(path, RERANK_ONNX_FILE), opts, providers=["CPUExecutionProvider"]
+        )
+        self.inputs = {i.name for i in self.session.get_inputs()}
+
+    def score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        enc = self.tokenizer(
+            [q for q, _ in pairs],
+            [p for _, p in pairs],
+            padding=True,
+            truncation=True,
+            max_length=RERANK_MAX_LENGTH,
+            return_tensors="np",
+        )
+        feed = {k: v for k, v in enc.items() if k in self.inputs}
+        logits = self.session.run(None, feed)[0]
+        col = 0 if logits.shape[1] == 1 else -1
+        return [float(x) for x in logits[:, col]]
+
+
+_SCORERS = {"cross-encoder": _CrossEncoderScorer, "onnx": _OnnxScorer}
+
+_scorer = None
+_scorer_failed = False
+_model_lock = threading.Lock()  # uma inferência por vez: o torch/ort já usa todos os cores
+
+
+def get_scorer():
+    """Scorer do processo; None se desligado ou se o modelo não carregar."""
+    global _scorer, _scorer_failed
+    if _scorer is not None or _scorer_failed or RERANK_BACKEND == "none":
+        return _scorer
+    with _model_lock:
+        if _scorer is None and not _scorer_failed:
+            try:
+                _scorer = _SCORERS[RERANK_BACKEND](RERANK_MODEL_PATH or RERANK_MODEL)
+            except Exception as e:
+                _scorer_failed = True
+                print(f"[WARN] reranker indisponível ({RERANK_BACKEND}): {e!r} — usando score da fusão")
+    return _scorer
+
+
+def warmup() -> float:
+    """Carrega o cross-encoder e pontua um par de aquecimento (segundos gastos)."""
+    t0 = time.perf_counter()
+    scorer = get_scorer()
+    if scorer is not None:
+        with _model_lock:
+            scorer.score([("warmup", "warmup")])
+    return time.perf_counter() - t0
+
+
+# --- cache de scores ---
+_cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+_cache_lock = threading.Lock()
+# custo médio por par (s), atualizado a cada batch
+_per_pair_s = 0.005
+
+
+def _passage_hash(d: Dict) -> str:
+    return hashlib.sha1((d.get("text") or "").encode("utf-8")).hexdigest()
+
+
+def _norm_query(q: str) -> str:
+    return " ".join((q or "").casefold().split())
+
+
+def _score_docs(query: str, docs: List[Dict], budget_s: float) -> Tuple[List[Optional[float]], int]:
+    """
+    Score do cross-encoder para um prefixo de `docs` que cabe no orçamento.
+    Retorna (scores, n): scores[i] para i < n; o resto não foi reranqueado.
     """
-    # Se quiser integrar com Cohere / outro reranker no futuro, pluga aqui.
-    # Por enquanto: apenas ordena por 'score' desc.
+    global _per_pair_s
+    scorer = get_scorer()
+    if scorer is None or not docs:
+        return [], 0
+
+    q = _norm_query(query)
+    keys = [(q, _passage_hash(d)) for d in docs]
+    with _cache_lock:
+        cached = [_cache.get(k) for k in keys]
+
+    # maior prefixo cujo número de pares não cacheados cabe no orçamento
+    affordable = max(RERANK_MIN_N, int(budget_s / max(_per_pair_s, 1e-6)))
+    n, uncached = 0, 0
+    for c in cached:
+        if c is None:
+            if uncached >= affordable:
+                break
+            uncached += 1
+        n += 1
+
+    todo = [i for i in range(n) if cached[i] is None]
+    if todo:
+        pairs = [(query, docs[i].get("text") or "") for i in todo]
+        t0 = time.perf_counter()
+        with _model_lock:
+            scores = scorer.score(pairs)
+        elapsed = time.perf_counter() - t0
+        _per_pair_s = 0.8 * _per_pair_s + 0.2 * (elapsed / len(pairs))
+        with _cache_lock:
+            for i, s in zip(todo, scores):
+                cached[i] = s
+                _cache[keys[i]] = s
+                _cache.move_to_end(keys[i])
+            while len(_cache) > RERANK_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return cached[:n], n
+
+
+def _rerank_sync(query: str, docs: List[Dict], top_k: Optional[int]) -> List[Dict]:
+    # entrada já vem na ordem da fusão; sem modelo, mantém a ordem por score
     ordered = sorted(docs, key=lambda d: float(d.get("score", 0.0)), reverse=True)
+    scores, n = _score_docs(query, ordered, RERANK_BUDGET_MS / 1000.0)
+    if n:
+        head = [dict(d, rerank_score=s) for d, s in zip(ordered[:n], scores)]
+        head.sort(key=lambda d: d["rerank_score"], reverse=True)
+        ordered = head + ordered[n:]
     if top_k is not None:
         ordered = ordered[:top_k]
     return ordered
+
+
+async def rerank(query: str, docs: List[Dict], top_k: int | None = None) -> List[Dict]:
+    """
+    Recebe uma lista de docs do search.hybrid, já no formato:
+        { "title": ..., "url": ..., "text": ..., "score": ... }
+
+    Retorna a mesma lista, possivelmente reordenada, e opcionalmente truncada em top_k.
+    Com cross-encoder configurado, cada doc reranqueado ganha "rerank_score".
+    A inferência roda numa thread para não bloquear o event loop.
+    """
+    if RERANK_BACKEND == "none" or _scorer_failed:
+        return _rerank_sync(query, docs, top_k)
+    return await asyncio.to_thread(_rerank_sync, query, docs, top_k)
@@ -1,19 +1,48 @@
 import os
-from typing import List, Dict
-from opensearchpy import OpenSearch, RequestsHttpConnection
+import asyncio
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, Tuple
+from opensearchpy import AsyncOpenSearch
+
+from ..collector.indexers.qdrant_index import get_backend as get_vector_backend
 
 OPENSEARCH_URL = os.getenv("OPENSEARCH_URL", "http://opensearch:9200")
 OPENSEARCH_INDEX = os.getenv("OPENSEARCH_INDEX", "passages-wod")
+# conexões HTTP simultâneas por worker (pool do aiohttp)
+OPENSEARCH_POOL_SIZE = int(os.getenv("OPENSEARCH_POOL_SIZE", "64"))
+
+# --- Híbrido: pernas em paralelo, cada uma com seu timeout (segundos) ---
+HYBRID_LEX_TIMEOUT = float(os.getenv("HYBRID_LEX_TIMEOUT", "2.0"))
+HYBRID_VEC_TIMEOUT = float(os.getenv("HYBRID_VEC_TIMEOUT", "2.0"))
+# fusão: "rrf" (reciprocal rank fusion) ou "weighted" (scores min-max normalizados)
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")
+HYBRID_W_LEX = float(os.getenv("HYBRID_W_LEX", "1.0"))
+HYBRID_W_VEC = float(os.getenv("HYBRID_W_VEC", "1.0"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# trechos destacados (highlight) devolvidos no lugar do texto inteiro no /qa/stream
+HIGHLIGHT_FRAGMENT_SIZE = int(os.getenv("HIGHLIGHT_FRAGMENT_SIZE", "160"))
+HIGHLIGHT_FRAGMENTS = int(os.getenv("HIGHLIGHT_FRAGMENTS", "2"))
 
-os_client = OpenSearch(
+# cliente assíncrono (aiohttp): uma consulta em voo não prende thread nenhuma
+os_client = AsyncOpenSearch(
     hosts=[OPENSEARCH_URL],
     http_compress=True,
     use_ssl=False,
     verify_certs=False,
-    connection_class=RequestsHttpConnection,
+    maxsize=OPENSEARCH_POOL_SIZE,
 )
 
-def lexical_search(query: str, k_lex: int = 20) -> List[Dict]:
+
+async def close():
+    """Fecha o pool HTTP (shutdown do app)."""
+    await os_client.close()
+
+
+async def lexical_search(
+    query: str,
+    k_lex: int = 20,
+    timeout: Optional[float] = None,
+    highlight: bool = False,
+) -> List[Dict]:
     body = {
         "size": k_lex,
         "query": {
@@ -29,14 +58,27 @@ def lexical_search(query: str, k_lex: int = 20) -> List[Dict]:
         },
         "_source": ["title", "url", "text", "section"],
     }
+    if highlight:
+        # sem match no texto (hit só pelo título), no_match_size devolve o começo
+        body["highlight"] = {
+            "fields": {
+                "text": {
+                    "fragment_size": HIGHLIGHT_FRAGMENT_SIZE,
+                    "number_of_fragments": HIGHLIGHT_FRAGMENTS,
+                    "no_match_size": HIGHLIGHT_FRAGMENT_SIZE,
+                }
+            }
+        }
 
-    res = os_client.search(index=OPENSEARCH_INDEX, body=body)
+    params = {"request_timeout": timeout} if timeout else {}
+    res = await os_client.search(index=OPENSEARCH_INDEX, body=body, **params)
     docs: List[Dict] = []
 
     for hit in res.get("hits", {}).get("hits", []):
         src = hit.get("_source", {})
         docs.append(
             {
+                "id": hit.get("_id"),
                 "title": src.get("title"),
                 "url": src.get("url"),
                 "text": src.get("text"),
@@ -44,39 +86,163 @@ def lexical_search(query: str, k_lex: int = 20) -> List[Dict]:
                 "score": float(hit.get("_score", 0.0)),
             }
         )
+        if highlight:
+            docs[-1]["fragments"] = (hit.get("highlight") or {}).get("text", [])
 
     return docs
 
-def vector_search(query: str, k_vec: int = 20) -> List[Dict]:
-    # Desabilitado por enquanto
-    return []
+async def vector_search(query: str, k_vec: int = 20) -> List[Dict]:
+    """
+    Busca vetorial no backend configurado (VECTOR_BACKEND: qdrant, memory...).
+    Sem backend (none), devolve [] e o híbrido fica só lexical.
+    O embedding da consulta passa pelo LRU/micro-batching de embeddings;
+    a busca no backend é bloqueante e roda numa thread, fora do loop.
+    """
+    backend = get_vector_backend()
+    if backend is None:
+        return []
+    from .embeddings import embed_query_async
+
+    vec = await embed_query_async(query)
+    if not vec:
+        return []
 
-def hybrid(query: str, k_lex: int = 20, k_vec: int = 20) -> List[Dict]:
     docs: List[Dict] = []
+    for score, src in await asyncio.to_thread(backend.search, vec, k_vec):
+        docs.append(
+            {
+                "id": src.get("passage_id"),
+                "title": src.get("title"),
+                "url": src.get("url"),
+                "text": src.get("text"),
+                "section": src.get("section"),
+                "score": float(score),
+            }
+        )
+    return docs
+
+def _doc_key(d: Dict) -> tuple:
+    # id da passagem (_id no OpenSearch == passage_id no vetorial); sem ele,
+    # cai na chave antiga (title, url, section)
+    if d.get("id"):
+        return ("id", d["id"])
+    return (d.get("title"), d.get("url"), d.get("section"))
 
-    if k_lex > 0:
-        try:
-            docs.extend(lexical_search(query, k_lex))
-        except Exception as e:
-            print(f"[ERRO] lexical_search falhou: {e}")
 
+async def _leg(name: str, coro: Awaitable[List[Dict]], timeout: float) -> List[Dict]:
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        print(f"[WARN] {name}_search excedeu {timeout:.2f}s — ignorada nesta consulta")
+    except Exception as e:
+        print(f"[ERRO] {name}_search falhou: {e}")
+    return []
+
+
+async def _run_legs(legs: Dict[str, Tuple[Awaitable[List[Dict]], float]]) -> Dict[str, List[Dict]]:
+    """
+    Dispara todas as pernas ao mesmo tempo; cada uma tem até o seu timeout
+    para responder (é cancelada depois disso). Perna lenta ou com erro vira [].
+    Latência total ~= max(pernas), limitada pelo maior timeout.
+    """
+    names = list(legs)
+    results = await asyncio.gather(
+        *(_leg(name, coro, timeout) for name, (coro, timeout) in legs.items())
+    )
+    return dict(zip(names, results))
+
+
+def fuse(
+    results: Dict[str, List[Dict]],
+    weights: Dict[str, float],
+    method: str = HYBRID_FUSION,
+) -> List[Dict]:
+    """
+    Combina as listas de cada perna num único ranking:
+      - rrf:      score = soma_w  w / (RRF_K + rank)
+      - weighted: score = soma_w  w * (s - min) / (max - min), por perna
+    O score bruto de cada perna fica em doc["scores"][perna].
+    """
+    fused: Dict[tuple, Dict] = {}
+    for leg, docs in results.items():
+        w = weights.get(leg, 1.0)
+        if not docs or w == 0:
+            continue
+        raw = [float(d.get("score", 0.0)) for d in docs]
+        lo, hi = min(raw), max(raw)
+        for rank, (d, s) in enumerate(zip(docs, raw), start=1):
+            if method == "weighted":
+                contrib = w * ((s - lo) / (hi - lo) if hi > lo else 1.0)
+            else:
+                contrib = w / (RRF_K + rank)
+            key = _doc_key(d)
+            cur = fused.get(key)
+            if cur is None:
+                cur = fused[key] = {**d, "score": 0.0, "scores": {}}
+            cur["score"] += contrib
+            cur["scores"][leg] = s
+
+    return sorted(fused.values(), key=lambda d: d["score"], reverse=True)
+
+
+async def hybrid(
+    query: str,
+    k_lex: int = 20,
+    k_vec: int = 20,
+    fusion: Optional[str] = None,
+) -> List[Dict]:
+    legs: Dict[str, Tuple[Awaitable[List[Dict]], float]] = {}
+    if k_lex > 0:
+        legs["lexical"] = (
+            lexical_search(query, k_lex, timeout=HYBRID_LEX_TIMEOUT),
+            HYBRID_LEX_TIMEOUT,
+        )
     if k_vec > 0:
-        try:
-            docs.extend(vector_search(query, k_vec))
-        except Exception as e:
-            print(f"[ERRO] vector_search falhou: {e}")
-
-    # De-duplicação por (title, url, section)
-    seen: Dict[tuple, Dict] = {}
-    for d in docs:
-        key = (d.get("title"), d.get("url"), d.get("section"))
-        score = float(d.get("score", 0.0))
-        if key not in seen or score > float(seen[key].get("score", 0.0)):
-            seen[key] = d
-
-    final = sorted(
-        seen.values(),
-        key=lambda d: float(d.get("score", 0.0)),
-        reverse=True,
+        legs["vector"] = (vector_search(query, k_vec), HYBRID_VEC_TIMEOUT)
+    if not legs:
+        return []
+
+    results = await _run_legs(legs)
+    return fuse(
+        results,
+        {"lexical": HYBRID_W_LEX, "vector": HYBRID_W_VEC},
+        fusion or HYBRID_FUSION,
     )
-    return final
+
+
+async def hybrid_stream(
+    query: str,
+    k_lex: int = 20,
+    k_vec: int = 20,
+    fusion: Optional[str] = None,
+    highlight: bool = False,
+) -> AsyncIterator[Tuple[str, List[Dict]]]:
+    """
+    Como hybrid(), mas em etapas: ("lexical", hits) assim que o OpenSearch
+    responde (a perna vetorial continua rodando) e depois ("fused", ranking).
+    """
+    tasks: Dict[str, "asyncio.Task[List[Dict]]"] = {}
+    if k_lex > 0:
+        tasks["lexical"] = asyncio.create_task(
+            _leg("lexical", lexical_search(query, k_lex, HYBRID_LEX_TIMEOUT, highlight), HYBRID_LEX_TIMEOUT)
+        )
+    if k_vec > 0:
+        tasks["vector"] = asyncio.create_task(
+            _leg("vector", vector_search(query, k_vec), HYBRID_VEC_TIMEOUT)
+        )
+    try:
+        results: Dict[str, List[Dict]] = {}
+        if "lexical" in tasks:
+            results["lexical"] = await tasks["lexical"]
+            yield "lexical", results["lexical"]
+        if "vector" in tasks:
+            results["vector"] = await tasks["vector"]
+        yield "fused", fuse(
+            results,
+            {"lexical": HYBRID_W_LEX, "vector": HYBRID_W_VEC},
+            fusion or HYBRID_FUSION,
+        )
+    finally:
+        # cliente desconectou no meio: não deixa perna órfã rodando
+        for t in tasks.values():
+            t.cancel()
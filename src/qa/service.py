@@ -1,16 +1,38 @@
 # src/qa/service.py
 import os
+import json
+import asyncio
 from typing import List, Dict, Any
 
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from .search import hybrid
+from .search import HIGHLIGHT_FRAGMENT_SIZE, hybrid, hybrid_stream, close as close_search
 from .reranker import rerank
-from .graph_queries import run_cypher
+from .graph_queries import (
+    GRAPH_MAX_ROWS,
+    RowLimitReached,
+    catalog as graph_catalog,
+    close as close_graph,
+    named_cache_stats,
+    neighborhoods,
+    run_named,
+    stream_cypher,
+)
+from .cache import cache_key, index_generation, qa_cache
+from .entity_linker import linker, refresh_loop as linker_refresh_loop
+from .graph_snapshot import DIRECTIONS, get_snapshot, refresh_loop as snapshot_refresh_loop
+from .suggest import SUGGEST_K, get_index as get_suggest_index, lookup as suggest_lookup
+from .suggest import refresh_loop as suggest_refresh_loop
+from ..collector.indexers.qdrant_index import VECTOR_BACKEND
+from . import embeddings, reranker
 
 QA_HOST = os.getenv("QA_HOST", "0.0.0.0")
 QA_PORT = int(os.getenv("QA_PORT", "8000"))
+# contexto de grafo no /qa: entidades linkadas por consulta e vizinhos por entidade
+QA_GRAPH_MAX_ENTITIES = int(os.getenv("QA_GRAPH_MAX_ENTITIES", "5"))
+QA_GRAPH_NEIGHBORS = int(os.getenv("QA_GRAPH_NEIGHBORS", "10"))
 
 app = FastAPI(title="WoD Fandom RAG")
 
@@ -24,18 +46,180 @@ app.add_middleware(
 )
 
 
+# --- warmup / readiness ---
+# modelos carregados no startup (em thread); /ready só dá 200 depois disso
+_warm: Dict[str, Any] = {"ready": False, "models": {}}
+
+
+def _warmup_models():
+    if VECTOR_BACKEND != "none":
+        try:
+            _warm["models"]["embeddings"] = round(embeddings.warmup(), 3)
+        except Exception as e:
+            # sem modelo, a perna vetorial falha e o híbrido fica só lexical
+            _warm["models"]["embeddings"] = f"erro: {e!r}"
+            print(f"[WARN] warmup de embeddings falhou: {e!r}")
+    if reranker.RERANK_BACKEND != "none":
+        try:
+            _warm["models"]["reranker"] = round(reranker.warmup(), 3)
+        except Exception as e:
+            # sem reranker, a ordem fica a da fusão
+            _warm["models"]["reranker"] = f"erro: {e!r}"
+            print(f"[WARN] warmup do reranker falhou: {e!r}")
+    _warm["ready"] = True
+    print(f"[qa] modelos aquecidos: {_warm['models']}", flush=True)
+
+
+@app.on_event("startup")
+async def _startup():
+    # em background: o processo sobe na hora e o balanceador espera o /ready
+    _warm["task"] = asyncio.create_task(asyncio.to_thread(_warmup_models))
+    _warm["loops"] = [
+        asyncio.create_task(linker_refresh_loop()),
+        asyncio.create_task(snapshot_refresh_loop()),
+        asyncio.create_task(suggest_refresh_loop()),
+    ]
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: 503 até os modelos (embeddings/reranker) estarem carregados."""
+    snap = get_snapshot()
+    body = {
+        "ready": _warm["ready"],
+        "models": _warm["models"],
+        "linker": linker.ready,
+        "graph_snapshot": snap.generation if snap is not None else None,
+    }
+    return JSONResponse(body, status_code=200 if _warm["ready"] else 503)
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    for task in _warm.get("loops", []):
+        task.cancel()
+    await close_search()
+    await close_graph()
+
+
+def _ndjson(obj: Dict[str, Any]) -> str:
+    return json.dumps(obj, ensure_ascii=False, default=str) + "\n"
+
+
 @app.get("/graph")
-def graph(query: str = Query(..., description="Cypher read-only")):
+async def graph(
+    query: str = Query(..., description="Cypher read-only"),
+    limit: int = Query(GRAPH_MAX_ROWS, ge=1, le=GRAPH_MAX_ROWS),
+):
     """
-    Endpoint genérico de Cypher (read-only).
-    Continua igual: você manda um Cypher e recebe rows de volta.
+    Endpoint genérico de Cypher (read-only), em NDJSON:
+        {"row": {...}}                                  uma linha por registro
+        {"done": true, "rows": n, "truncated": bool}    última linha
+        {"error": "..."}                                se o Neo4j recusar/estourar o timeout
+    Transação de leitura com timeout e limite de linhas no servidor.
     """
-    rows = run_cypher(query)
-    return {"query": query, "rows": rows}
+
+    async def body():
+        n, truncated = 0, False
+        try:
+            async for row in stream_cypher(query, limit=limit):
+                n += 1
+                yield _ndjson({"row": row})
+        except RowLimitReached:
+            truncated = True
+        except Exception as e:
+            yield _ndjson({"error": str(e)})
+        yield _ndjson({"done": True, "rows": n, "truncated": truncated})
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@app.get("/graph/catalog")
+def graph_catalog_list():
+    """Consultas nomeadas disponíveis (nome, descrição, parâmetros default)."""
+    return {"queries": graph_catalog()}
+
+
+@app.get("/graph/named/{name}")
+async def graph_named(name: str, request: Request):
+    """
+    Executa uma consulta do catálogo; parâmetros vêm da query string.
+    Resultados ficam em cache até a próxima geração do índice.
+    """
+    gen = await index_generation()
+    try:
+        params, rows, cached = await run_named(name, dict(request.query_params), gen)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"consulta desconhecida: {name}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"name": name, "params": params, "rows": rows, "cached": cached}
+
+
+def _snapshot_or_503():
+    snap = get_snapshot()
+    if snap is None:
+        raise HTTPException(status_code=503, detail="snapshot do grafo ainda não carregado")
+    return snap
+
+
+def _check_direction(direction: str):
+    if direction not in DIRECTIONS:
+        raise HTTPException(status_code=422, detail=f"direction deve ser um de {DIRECTIONS}")
+
+
+@app.get("/graph/neighbors")
+def graph_neighbors(
+    id: str,
+    k: int = Query(1, ge=1, le=4),
+    rel: List[str] = Query(None, description="filtra por tipo de relação (repetível)"),
+    direction: str = "both",
+    limit: int = Query(100, ge=1, le=GRAPH_MAX_ROWS),
+):
+    """Vizinhança k-hop de uma entidade, servida do snapshot em memória."""
+    _check_direction(direction)
+    snap = _snapshot_or_503()
+    rows = snap.neighborhood(id, k=k, rels=rel, direction=direction, limit=limit)
+    return {"id": id, "k": k, "generation": snap.generation, "rows": rows}
+
+
+@app.get("/graph/path")
+def graph_path(
+    src: str,
+    dst: str,
+    rel: List[str] = Query(None, description="filtra por tipo de relação (repetível)"),
+    direction: str = "both",
+    max_depth: int = Query(6, ge=1, le=12),
+):
+    """Caminho mínimo (em saltos) entre duas entidades, servido do snapshot."""
+    _check_direction(direction)
+    snap = _snapshot_or_503()
+    steps = snap.shortest_path(src, dst, rels=rel, direction=direction, max_depth=max_depth)
+    return {"src": src, "dst": dst, "found": steps is not None, "path": steps or []}
+
+
+@app.get("/suggest")
+async def suggest(
+    q: str = "",
+    k: int = Query(SUGGEST_K, ge=1, le=50),
+):
+    """Typeahead: títulos e aliases que começam com `q`, só da memória."""
+    index = get_suggest_index()
+    return {
+        "q": q,
+        "generation": index.generation if index is not None else None,
+        "suggestions": suggest_lookup(q, k),
+    }
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hits/misses/evictions dos caches do /qa e das consultas nomeadas (deste worker)."""
+    return {**qa_cache.stats(), "graph_named": named_cache_stats()}
 
 
 @app.get("/qa")
-def qa(
+async def qa(
     query: str,
     top_k: int = 5,
     use_graph: bool = True,
@@ -47,52 +231,182 @@ def qa(
     - 'answer' vem do melhor trecho recuperado.
     - O grafo é retornado apenas como contexto (por enquanto),
       não como resposta fixa.
+    - Respostas ficam em cache (LRU+TTL) até a próxima geração do índice.
     """
+    key = cache_key(query, top_k, use_graph)
+    gen = await index_generation()
+    cached = await qa_cache.aget(key, gen)
+    if cached is not None:
+        return cached
+
+    result = await _answer(query, top_k, use_graph)
+    await qa_cache.aset(key, gen, result)
+    return result
+
+
+async def _answer(query: str, top_k: int, use_graph: bool) -> Dict[str, Any]:
+
+    # --- 1) Busca híbrida no OpenSearch/Qdrant + vizinhança no grafo ---
+    k_lex = k_vec = _candidates(top_k)
 
-    # --- 1) Busca híbrida no OpenSearch/Qdrant ---
-    # pegamos um pouco mais que top_k para o reranker poder escolher bem
-    k_lex = max(top_k, 10)
-    k_vec = max(top_k, 10)
+    # menções de entidades: uma passada no autômato do linker (microssegundos);
+    # a vizinhança vem numa única consulta ao Neo4j, em paralelo com a busca
+    entities, ids = _link(query, use_graph)
 
-    passages = hybrid(query, k_lex=k_lex, k_vec=k_vec)
+    passages, graph_rows = await asyncio.gather(
+        hybrid(query, k_lex=k_lex, k_vec=k_vec),
+        _graph_context(ids),
+    )
 
     # --- 2) Rerank (hoje só ordena por score, mas já está plugado) ---
-    passages = rerank(query, passages, top_k=top_k)
-
-    # --- 3) GRAFO: por enquanto, só como dado bruto opcional ---
-    graph_rows: List[Dict[str, Any]] = []
-    if use_graph:
-        # Ainda não temos NLU -> Cypher automático.
-        # Em vez de rodar uma query fixa que ignora a pergunta
-        # (e gera respostas erradas), deixamos o grafo vazio aqui.
-        #
-        # Quando você quiser, podemos:
-        #  - detectar intents simples (ex: "disciplinas do clã X")
-        #  - montar um Cypher parametrizado
-        #  - e preencher graph_rows de forma alinhada à query.
-        graph_rows = []
-
-    # --- 4) Montar 'answer' a partir das passagens ---
-    if passages:
-        best = passages[0]
-        raw_text = (best.get("text") or "").strip()
-
-        # Opcional: limitar tamanho pra não jogar um testamento na tela.
-        # Ajuste esse número conforme a UI (500, 1000, 1500, etc).
-        max_chars = 1200
-        if len(raw_text) > max_chars:
-            raw_text = raw_text[:max_chars].rsplit(" ", 1)[0] + "..."
-
-        answer = raw_text
-    else:
-        answer = (
-            "Não encontrei nenhum trecho relevante no índice para essa pergunta. "
-            "Talvez o artigo ainda não tenha sido ingerido ou o índice precise ser atualizado."
-        )
+    passages = await rerank(query, passages, top_k=top_k)
 
+    # --- 3) Montar 'answer' a partir das passagens ---
     return {
         "query": query,
-        "answer": answer,
+        "answer": _build_answer(passages),
         "passages": passages,
         "graph": graph_rows,
+        "entities": entities,
     }
+
+
+def _candidates(top_k: int) -> int:
+    """Candidatos por perna: um pouco mais que top_k para o reranker poder escolher bem."""
+    return max(top_k, 10)
+
+
+def _link(query: str, use_graph: bool):
+    entities = linker.link(query) if use_graph else []
+    ids = list(dict.fromkeys(i for e in entities for i in e["ids"]))[:QA_GRAPH_MAX_ENTITIES]
+    return entities, ids
+
+
+def _build_answer(passages: List[Dict[str, Any]]) -> str:
+    if not passages:
+        return (
+            "Não encontrei nenhum trecho relevante no índice para essa pergunta. "
+            "Talvez o artigo ainda não tenha sido ingerido ou o índice precise ser atualizado."
+        )
+    raw_text = (passages[0].get("text") or "").strip()
+
+    # Opcional: limitar tamanho pra não jogar um testamento na tela.
+    # Ajuste esse número conforme a UI (500, 1000, 1500, etc).
+    max_chars = 1200
+    if len(raw_text) > max_chars:
+        raw_text = raw_text[:max_chars].rsplit(" ", 1)[0] + "..."
+    return raw_text
+
+
+async def _graph_context(ids: List[str]) -> List[Dict[str, Any]]:
+    # snapshot em memória quando carregado; senão uma ida ao Neo4j.
+    # grafo é contexto: falha no Neo4j não derruba o /qa
+    snap = get_snapshot()
+    if snap is not None:
+        return snap.neighbor_rows(ids, QA_GRAPH_NEIGHBORS)
+    try:
+        return await neighborhoods(ids, QA_GRAPH_NEIGHBORS)
+    except Exception as e:
+        print(f"[WARN] vizinhança no grafo indisponível: {e}")
+        return []
+
+
+# --- /qa em streaming (SSE) ---
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _snippet(text: str, query: str) -> str:
+    """Trecho em volta do primeiro termo da consulta (hits só vetoriais não têm highlight)."""
+    text = " ".join((text or "").split())
+    low = text.casefold()
+    pos = -1
+    for term in sorted(query.casefold().split(), key=len, reverse=True):
+        if len(term) > 2:
+            pos = low.find(term)
+            if pos >= 0:
+                break
+    start = max(0, pos - HIGHLIGHT_FRAGMENT_SIZE // 3) if pos >= 0 else 0
+    out = text[start:start + HIGHLIGHT_FRAGMENT_SIZE]
+    return ("..." if start else "") + out + ("..." if start + HIGHLIGHT_FRAGMENT_SIZE < len(text) else "")
+
+
+def _compact(passages: List[Dict[str, Any]], query: str) -> List[Dict[str, Any]]:
+    """Passagens para a UI: trechos destacados no lugar do texto inteiro."""
+    out = []
+    for p in passages:
+        c = {k: v for k, v in p.items() if k not in ("text", "fragments")}
+        c["fragments"] = p.get("fragments") or [_snippet(p.get("text") or "", query)]
+        out.append(c)
+    return out
+
+
+@app.get("/qa/stream")
+async def qa_stream(
+    query: str,
+    top_k: int = 5,
+    use_graph: bool = True,
+):
+    """
+    Variante em streaming do /qa (text/event-stream), na ordem:
+        lexical  hits do OpenSearch assim que chegam (antes da perna vetorial)
+        ranked   ranking final (fusão + rerank), top_k
+        graph    vizinhança das entidades linkadas
+        answer   resposta montada
+        done     fim ({"cached": bool})
+    Passagens vêm com "fragments" (highlight) em vez do texto inteiro.
+    Compartilha o cache de respostas com o /qa.
+    """
+
+    async def events():
+        try:
+            key = cache_key(query, top_k, use_graph)
+            gen = await index_generation()
+            cached = await qa_cache.aget(key, gen)
+            if cached is not None:
+                yield _sse("ranked", {"passages": _compact(cached["passages"], query)})
+                yield _sse("graph", {"rows": cached["graph"], "entities": cached.get("entities", [])})
+                yield _sse("answer", {"answer": cached["answer"]})
+                yield _sse("done", {"cached": True})
+                return
+
+            entities, ids = _link(query, use_graph)
+            graph_task = asyncio.create_task(_graph_context(ids))
+            try:
+                k = _candidates(top_k)
+                fused: List[Dict[str, Any]] = []
+                async for stage, docs in hybrid_stream(query, k_lex=k, k_vec=k, highlight=True):
+                    if stage == "lexical":
+                        yield _sse("lexical", {"passages": _compact(docs[:top_k], query)})
+                    else:
+                        fused = docs
+                passages = await rerank(query, fused, top_k=top_k)
+                yield _sse("ranked", {"passages": _compact(passages, query)})
+                graph_rows = await graph_task
+            finally:
+                graph_task.cancel()
+            yield _sse("graph", {"rows": graph_rows, "entities": entities})
+
+            result = {
+                "query": query,
+                "answer": _build_answer(passages),
+                "passages": passages,
+                "graph": graph_rows,
+                "entities": entities,
+            }
+            yield _sse("answer", {"answer": result["answer"]})
+            # mesma chave do /qa: o payload em cache tem de ser o do /qa (sem highlight)
+            result["passages"] = [
+                {f: v for f, v in p.items() if f != "fragments"} for p in passages
+            ]
+            await qa_cache.aset(key, gen, result)
+            yield _sse("done", {"cached": False})
+        except Exception as e:
+            print(f"[ERRO] /qa/stream falhou: {e!r}")
+            yield _sse("error", {"error": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
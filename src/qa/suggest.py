@@ -0,0 +1,194 @@
+# src/qa/suggest.py
+"""
+Typeahead do /suggest, servido só da memória.
+
+- Entradas: títulos indexados no OpenSearch (agregação composite sobre o
+  campo keyword `title`; doc_count = nº de passagens da página) e nome +
+  aliases das entidades do grafo (entity linker).
+- Prior de popularidade: log(1 + passagens da página) + peso * log(1 +
+  grau no grafo) — páginas grandes e entidades muito citadas sobem.
+- Índice: array ordenado de chaves normalizadas (casefold, sem acento),
+  uma por início de palavra ("house tremere" e "tremere" -> "House
+  Tremere"), com busca binária pelo intervalo do prefixo. Prefixos curtos
+  (até SUGGEST_PRECOMPUTE chars), onde o intervalo é enorme, têm o top-k
+  pré-computado.
+- Reconstruído numa thread quando a geração do índice (ou o grafo
+  carregado) muda; troca atômica da referência.
+"""
+
+import os
+import math
+import time
+import asyncio
+import heapq
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from ..collector.parsers import to_id
+from .cache import index_generation
+from .entity_linker import linker, tokens
+from .graph_snapshot import get_snapshot
+
+SUGGEST_K = int(os.getenv("SUGGEST_K", "8"))
+SUGGEST_PRECOMPUTE = int(os.getenv("SUGGEST_PRECOMPUTE", "3"))
+SUGGEST_MAX_WORDS = int(os.getenv("SUGGEST_MAX_WORDS", "4"))
+SUGGEST_DEGREE_WEIGHT = float(os.getenv("SUGGEST_DEGREE_WEIGHT", "0.5"))
+SUGGEST_CHECK_SECONDS = float(os.getenv("SUGGEST_CHECK_SECONDS", "30"))
+
+# entrada: (texto exibido, tipo "title" | "alias", id da entidade ou "")
+Entry = Tuple[str, str, str]
+
+
+def normalize(text: str) -> str:
+    return " ".join(tokens(text))
+
+
+class SuggestIndex:
+    def __init__(self, entries: List[Entry], scores: List[float], generation: int = 0):
+        self.entries = entries
+        self.scores = scores
+        self.generation = generation
+        self.norms: List[str] = []
+        keyed: List[Tuple[str, int]] = []
+        for i, (text, _, _) in enumerate(entries):
+            words = tokens(text)
+            self.norms.append(" ".join(words))
+            for w in range(min(len(words), SUGGEST_MAX_WORDS)):
+                keyed.append((" ".join(words[w:]), i))
+        keyed.sort()
+        self.keys = [k for k, _ in keyed]
+        self.rows = [i for _, i in keyed]
+        self._top: Dict[str, List[int]] = {}
+        if SUGGEST_PRECOMPUTE > 0:
+            by_prefix: Dict[str, set] = {}
+            for key, i in keyed:
+                for n in range(1, min(len(key), SUGGEST_PRECOMPUTE) + 1):
+                    by_prefix.setdefault(key[:n], set()).add(i)
+            self._top = {p: self._best(ids, SUGGEST_K * 4) for p, ids in by_prefix.items()}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _best(self, ids, k: int) -> List[int]:
+        return heapq.nlargest(k, ids, key=lambda i: (self.scores[i], -len(self.entries[i][0])))
+
+    def lookup(self, prefix: str, k: int = SUGGEST_K) -> List[Dict]:
+        p = normalize(prefix)
+        if not p:
+            return []
+        # prefixo que termina em espaço: só palavras completas ("blood " != "bloodline")
+        if prefix[-1:].isspace():
+            p += " "
+        # o top pré-computado só tem SUGGEST_K * 4 ids: k maior vai pela busca binária
+        if k <= SUGGEST_K and len(p) <= SUGGEST_PRECOMPUTE and p in self._top:
+            ids = self._top[p]
+        else:
+            lo = bisect_left(self.keys, p)
+            hi = bisect_left(self.keys, p + "\uffff", lo)
+            ids = self._best(set(self.rows[lo:hi]), k * 4)
+        out: List[Dict] = []
+        seen = set()
+        for i in ids:
+            text, kind, eid = self.entries[i]
+            if self.norms[i] in seen:
+                continue
+            seen.add(self.norms[i])
+            item = {"text": text, "kind": kind, "score": round(self.scores[i], 3)}
+            if eid:
+                item["id"] = eid
+            out.append(item)
+            if len(out) >= k:
+                break
+        return out
+
+
+def build(titles: Dict[str, int], generation: int = 0) -> SuggestIndex:
+    """Monta o índice a partir de {título: nº de passagens} + entidades do linker."""
+    snap = get_snapshot()
+    degree: Dict[str, int] = {}
+    if snap is not None:
+        deg = snap.degrees()
+        degree = {eid: int(deg[i]) for eid, i in snap.index.items()}
+    by_norm = {normalize(t): c for t, c in titles.items()}
+
+    entries: List[Entry] = []
+    scores: List[float] = []
+    for title, count in titles.items():
+        # entidades do grafo usam to_id(título) como id
+        entries.append((title, "title", ""))
+        scores.append(math.log1p(count) + SUGGEST_DEGREE_WEIGHT * math.log1p(degree.get(to_id(title), 0)))
+    for eid, name, aliases in linker.entries():
+        prior = math.log1p(by_norm.get(normalize(name), 0)) + SUGGEST_DEGREE_WEIGHT * math.log1p(degree.get(eid, 0))
+        for alias in aliases:
+            if normalize(alias) and normalize(alias) not in by_norm:
+                entries.append((alias, "alias", eid))
+                scores.append(prior)
+        if normalize(name) not in by_norm:
+            entries.append((name, "alias", eid))
+            scores.append(prior)
+    return SuggestIndex(entries, scores, generation)
+
+
+async def fetch_titles(page: int = 5000) -> Dict[str, int]:
+    """Todos os títulos do índice com o nº de passagens (composite agg, paginada)."""
+    from .search import OPENSEARCH_INDEX, os_client
+
+    titles: Dict[str, int] = {}
+    after = None
+    while True:
+        comp = {"size": page, "sources": [{"title": {"terms": {"field": "title"}}}]}
+        if after:
+            comp["after"] = after
+        res = await os_client.search(
+            index=OPENSEARCH_INDEX, body={"size": 0, "aggs": {"titles": {"composite": comp}}}
+        )
+        agg = res.get("aggregations", {}).get("titles", {})
+        for b in agg.get("buckets", []):
+            titles[b["key"]["title"]] = int(b["doc_count"])
+        after = agg.get("after_key")
+        if not after or len(agg.get("buckets", [])) < page:
+            break
+    return titles
+
+
+_index: Optional[SuggestIndex] = None
+
+
+def get_index() -> Optional[SuggestIndex]:
+    return _index
+
+
+def lookup(prefix: str, k: int = SUGGEST_K) -> List[Dict]:
+    index = _index
+    return index.lookup(prefix, k) if index is not None else []
+
+
+async def rebuild(generation: int) -> SuggestIndex:
+    global _index
+    t0 = time.perf_counter()
+    titles = await fetch_titles()
+    index = await asyncio.to_thread(build, titles, generation)
+    _index = index
+    print(
+        f"[suggest] g{generation}: {len(index)} entradas, {len(index.keys)} chaves "
+        f"em {time.perf_counter() - t0:.1f}s",
+        flush=True,
+    )
+    return index
+
+
+async def refresh_loop():
+    """Reconstrói quando a geração do índice, o linker ou o snapshot mudam (task de background)."""
+    built = None
+    while True:
+        try:
+            snap = get_snapshot()
+            sig = (await index_generation(), len(linker), snap.generation if snap is not None else None)
+            if sig != built:
+                await rebuild(sig[0])
+                built = sig
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARN] índice do /suggest não reconstruído: {e!r}")
+        await asyncio.sleep(SUGGEST_CHECK_SECONDS)
@@ -0,0 +1,120 @@
+# tests/test_ingest_incremental.py
+import time
+
+import pytest
+
+ii = pytest.importorskip("src.collector.ingest_incremental")
+
+
+@pytest.fixture
+def con(tmp_path, monkeypatch):
+    monkeypatch.setattr(ii, "DB_PATH", str(tmp_path / "ingest.db"))
+    c = ii.open_db()
+    yield c
+    c.close()
+
+
+def test_failed_page_is_retried_not_skipped(con):
+    ii.seed_pending(con, ["Tremere"])
+    info = {"revid": 42, "content_hash": "abc", "unchanged": False}
+
+    # 1ª tentativa: falha depois de o hash já estar no info
+    assert ii.claim_batch(con, "w1", 10, 3, 900) == ["Tremere"]
+    ii.record_results(con, [("Tremere", "failed", "boom", False, info)], owner="w1")
+    con.commit()
+    assert ii.page_revisions(con, ["Tremere"])["Tremere"] == (None, None)
+
+    # retry: a página volta à fila e não há hash conhecido para pulá-la
+    assert ii.claim_batch(con, "w1", 10, 3, 900) == ["Tremere"]
+    known = {t: h for t, (_r, h) in ii.page_revisions(con, ["Tremere"]).items() if h}
+    assert known == {}
+    ii.record_results(con, [("Tremere", "ok", None, True, info)], owner="w1")
+    con.commit()
+    assert ii.page_revisions(con, ["Tremere"])["Tremere"] == (42, "abc")
+    assert ii.status_counts(con, 3)["ok"] == 1
+
+
+def test_heartbeat_renews_without_results(con, tmp_path):
+    ii.seed_pending(con, ["Brujah"])
+    ii.claim_batch(con, "w1", 10, 3, 1)
+    before = con.execute("SELECT lease_until FROM pages").fetchone()[0]
+
+    hb = ii.LeaseHeartbeat("w1", 900, every=0.05, db_path=str(tmp_path / "ingest.db")).start()
+    try:
+        deadline = time.time() + 2
+        while time.time() < deadline:
+            after = con.execute("SELECT lease_until FROM pages").fetchone()[0]
+            if after > before + 100:
+                break
+            time.sleep(0.02)
+    finally:
+        hb.stop()
+    assert after > before + 100
+
+
+def test_refresh_does_not_touch_claimed_pages(con, monkeypatch):
+    ii.seed_pending(con, ["Tremere", "Ventrue"])
+    ii.claim_batch(con, "w1", 10, 3, 900)
+    ii.record_results(con, [("Ventrue", "ok", None, True, {"revid": 1, "content_hash": "v"})], owner="w1")
+    con.execute("UPDATE pages SET revid=1 WHERE title='Tremere'")
+    con.commit()
+
+    monkeypatch.setattr(ii, "iter_allpages_revisions", lambda **kw: iter([("Tremere", 2), ("Ventrue", 2)]))
+    st = ii.refresh_from_api(con, 0)
+    assert (st["changed"], st["claimed"]) == (1, 1)
+    rows = dict(con.execute("SELECT title, status || ':' || coalesce(claimed_by, '') FROM pages"))
+    assert rows == {"Tremere": "claimed:w1", "Ventrue": "pending:"}
+
+
+def _row(con, title):
+    return con.execute(
+        "SELECT status, tries, claimed_by FROM pages WHERE title=?", (title,)
+    ).fetchone()
+
+
+def test_claims_do_not_overlap(con):
+    ii.seed_pending(con, [f"T{i}" for i in range(5)])
+    a = ii.claim_batch(con, "w1", 3, 3, 900)
+    b = ii.claim_batch(con, "w2", 3, 3, 900)
+    assert len(a) == 3 and len(b) == 2 and not set(a) & set(b)
+    assert ii.claim_batch(con, "w3", 3, 3, 900) == []
+    assert ii.status_counts(con, 3)["claimed"] == 5
+
+
+def test_expired_lease_is_reclaimed_and_stale_owner_rejected(con):
+    ii.seed_pending(con, ["Tremere"])
+    assert ii.claim_batch(con, "w1", 10, 3, -1) == ["Tremere"]  # lease já vencido
+
+    # outro worker devolve o lease expirado à fila e o reivindica
+    assert ii.claim_batch(con, "w2", 10, 3, 900) == ["Tremere"]
+    assert _row(con, "Tremere") == ("claimed", 2, "w2")
+
+    # resultado atrasado do dono antigo não sobrescreve o claim atual
+    info = {"revid": 1, "content_hash": "old"}
+    ii.record_results(con, [("Tremere", "ok", None, True, info)], owner="w1")
+    con.commit()
+    assert _row(con, "Tremere") == ("claimed", 2, "w2")
+    assert ii.page_revisions(con, ["Tremere"])["Tremere"] == (None, None)
+
+    ii.record_results(con, [("Tremere", "ok", None, True, {"revid": 2, "content_hash": "new"})], owner="w2")
+    con.commit()
+    assert _row(con, "Tremere") == ("ok", 0, None)
+    assert ii.page_revisions(con, ["Tremere"])["Tremere"] == (2, "new")
+
+
+def test_renewed_lease_is_not_reclaimed(con):
+    ii.seed_pending(con, ["Tremere"])
+    ii.claim_batch(con, "w1", 10, 3, -1)
+    ii.renew_leases(con, "w1", 900)
+    con.commit()
+    assert ii.claim_batch(con, "w2", 10, 3, 900) == []
+    assert _row(con, "Tremere") == ("claimed", 1, "w1")
+
+
+def test_release_claims_only_releases_own(con):
+    ii.seed_pending(con, ["A", "B"])
+    ii.claim_batch(con, "w1", 1, 3, 900)
+    ii.claim_batch(con, "w2", 1, 3, 900)
+    assert ii.release_claims(con, "w1") == 1
+    assert sorted(r[0] for r in con.execute("SELECT status FROM pages")) == ["claimed", "pending"]
+    assert ii.status_counts(con, 3)["pending"] == 1
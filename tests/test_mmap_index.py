@@ -0,0 +1,69 @@
+# tests/test_mmap_index.py
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from src.collector.indexers.mmap_index import MmapBackend  # noqa: E402
+
+
+def _vectors(n, dim=16, seed=0):
+    v = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _points(vecs, title="T", start=0):
+    return [(f"p{start + i}", v.tolist(), {"title": title, "text": f"t{start + i}"}) for i, v in enumerate(vecs)]
+
+
+@pytest.mark.parametrize("dtype,tol", [("float16", 1e-3), ("int8", 2e-2)])
+def test_round_trip(tmp_path, dtype, tol):
+    vecs = _vectors(50)
+    b = MmapBackend(str(tmp_path), dtype=dtype)
+    b.upsert(_points(vecs))
+    # outra instância (leitor) no mesmo diretório
+    r = MmapBackend(str(tmp_path), dtype=dtype)
+    for i in (0, 17, 49):
+        score, pl = r.search(vecs[i].tolist(), 1)[0]
+        assert pl["text"] == f"t{i}"
+        assert score == pytest.approx(1.0, abs=tol)
+
+
+def test_overwrite_keeps_row(tmp_path):
+    vecs = _vectors(3)
+    b = MmapBackend(str(tmp_path))
+    b.upsert(_points(vecs))
+    b.upsert([("p1", vecs[2].tolist(), {"title": "T", "text": "novo"})])
+    assert len(b) == 3
+    hits = b.search(vecs[2].tolist(), 2)
+    assert {pl["text"] for _s, pl in hits} == {"t2", "novo"}
+    assert all(pl["text"] != "t1" for _s, pl in b.search(vecs[1].tolist(), 3))
+
+
+def test_ivf_and_tail(tmp_path):
+    vecs = _vectors(210, seed=1)
+    b = MmapBackend(str(tmp_path))
+    b.upsert(_points(vecs[:200]))
+    assert b.build_ivf(nlist=4, iters=5)["rows"] == 200
+    # gravadas depois do build: só a cauda cobre estas linhas
+    b.upsert(_points(vecs[200:], start=200))
+    r = MmapBackend(str(tmp_path))
+    assert r.search_batch([vecs[205].tolist()], 1, nprobe=1)[0][0][1]["text"] == "t205"
+    assert r.search_batch([vecs[3].tolist()], 1, nprobe=4)[0][0][1]["text"] == "t3"
+
+
+def test_delete_stale(tmp_path):
+    vecs = _vectors(6, seed=2)
+    b = MmapBackend(str(tmp_path))
+    b.upsert(_points(vecs[:4], title="A") + _points(vecs[4:], title="B", start=4))
+    r = MmapBackend(str(tmp_path))
+    r.search(vecs[0].tolist(), 1)  # leitor já com a matriz mapeada
+
+    assert b.delete_stale({"A": ["p0"]}) == 3
+    assert len(b) == 3
+    texts = [pl["text"] for _s, pl in r.search(vecs[1].tolist(), 6)]
+    assert sorted(texts) == ["t0", "t4", "t5"]
+
+    # pid removido volta numa linha nova, sem reaproveitar o slot
+    b.upsert([("p1", vecs[1].tolist(), {"title": "A", "text": "volta"})])
+    assert r.search(vecs[1].tolist(), 1)[0][1]["text"] == "volta"
+    assert len(b) == 4
@@ -1,6 +1,6 @@
 // ui/src/App.jsx
 import { useState } from 'react'
-import { askQA, queryGraph } from './api'
+import { askQAStream, queryGraph, queryNamedGraph } from './api'
 import SearchBar from './components/SearchBar'
 import ResultCard from './components/ResultCard'
 import GraphView from './components/GraphView'
@@ -17,10 +17,17 @@ function App() {
     setLoading(true)
     setError(null)
     try {
-      const data = await askQA(query, top_k, use_graph)
-      setLastQuery(data.query || query)
+      setLastQuery(query)
+      // hits lexicais aparecem assim que chegam; o ranking final os substitui
+      const data = await askQAStream(query, top_k, use_graph, {
+        onLexical: (passages) => {
+          setResults(passages)
+          setLoading(false)
+        },
+        onRanked: (passages) => setResults(passages),
+        onGraph: (d) => setGraphRows(use_graph ? (d.rows || []) : []),
+      })
       setResults(data.passages || [])
-      setGraphRows(use_graph ? (data.graph || []) : [])
     } catch (e) {
       console.error(e)
       setError(e.message || 'Erro ao buscar')
@@ -40,6 +47,17 @@ function App() {
     }
   }
 
+  const handleGraphNamed = async (name, params) => {
+    setError(null)
+    try {
+      const data = await queryNamedGraph(name, params)
+      setGraphRows(data.rows || [])
+    } catch (e) {
+      console.error(e)
+      setError(e.message || 'Erro ao consultar o grafo')
+    }
+  }
+
   return (
     <div className="min-h-screen bg-slate-950 text-slate-100">
       <div className="max-w-6xl mx-auto py-6 px-4 flex flex-col gap-4">
@@ -91,7 +109,7 @@ function App() {
             <h2 className="text-sm font-semibold text-slate-300 uppercase tracking-wide">
               Consulta ao grafo (Cypher, read-only)
             </h2>
-            <GraphView onExecute={handleGraphExecute} rows={graphRows} />
+            <GraphView onExecute={handleGraphExecute} onNamed={handleGraphNamed} rows={graphRows} />
           </section>
         </div>
       </div>
@@ -5,8 +5,92 @@ const api = axios.create({ baseURL })
 export const askQA = async (query, top_k = 5, use_graph = true) =>
   (await api.get('/qa', { params: { query, top_k, use_graph } })).data
 
-export const queryGraph = async (cypher) =>
-  (await api.get('/graph', { params: { query: cypher } })).data
+// /qa/stream (SSE): lexical -> ranked -> graph -> answer -> done.
+// handlers: { onLexical, onRanked, onGraph, onAnswer }; resolve com o resultado final.
+export const askQAStream = (query, top_k = 5, use_graph = true, handlers = {}) =>
+  new Promise((resolve, reject) => {
+    const url = new URL('/qa/stream', baseURL)
+    url.searchParams.set('query', query)
+    url.searchParams.set('top_k', top_k)
+    url.searchParams.set('use_graph', use_graph)
+
+    const es = new EventSource(url)
+    const result = { query, passages: [], graph: [], entities: [], answer: '' }
+    const on = (name, fn) =>
+      es.addEventListener(name, (ev) => fn(JSON.parse(ev.data)))
+
+    on('lexical', (d) => handlers.onLexical && handlers.onLexical(d.passages))
+    on('ranked', (d) => {
+      result.passages = d.passages
+      if (handlers.onRanked) handlers.onRanked(d.passages)
+    })
+    on('graph', (d) => {
+      result.graph = d.rows || []
+      result.entities = d.entities || []
+      if (handlers.onGraph) handlers.onGraph(d)
+    })
+    on('answer', (d) => {
+      result.answer = d.answer
+      if (handlers.onAnswer) handlers.onAnswer(d.answer)
+    })
+    on('done', () => {
+      es.close()
+      resolve(result)
+    })
+    // 'error' chega do servidor (com data) ou do próprio EventSource (conexão)
+    es.addEventListener('error', (ev) => {
+      es.close()
+      let msg = 'Erro no streaming do /qa'
+      try { msg = JSON.parse(ev.data).error || msg } catch (_) { /* erro de conexão */ }
+      reject(new Error(msg))
+    })
+  })
+
+// /graph responde NDJSON: {"row": {...}} por linha e {"done": true, ...} no fim.
+// onRow (opcional) recebe cada linha assim que chega.
+export const suggest = async (q, k = 8) =>
+  (await api.get('/suggest', { params: { q, k } })).data
+
+export const queryGraph = async (cypher, onRow) => {
+  const url = new URL('/graph', baseURL)
+  url.searchParams.set('query', cypher)
+  const res = await fetch(url)
+  if (!res.ok) throw new Error(`HTTP ${res.status}`)
+
+  const rows = []
+  let meta = {}
+  const handle = (line) => {
+    if (!line.trim()) return
+    const msg = JSON.parse(line)
+    if (msg.error) throw new Error(msg.error)
+    if (msg.row) {
+      rows.push(msg.row)
+      if (onRow) onRow(msg.row)
+    } else if (msg.done) {
+      meta = msg
+    }
+  }
+
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let buf = ''
+  for (;;) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buf += decoder.decode(value, { stream: true })
+    const lines = buf.split('\n')
+    buf = lines.pop()
+    lines.forEach(handle)
+  }
+  handle(buf)
+  return { query: cypher, rows, truncated: !!meta.truncated }
+}
+
+export const graphCatalog = async () =>
+  (await api.get('/graph/catalog')).data
+
+export const queryNamedGraph = async (name, params = {}) =>
+  (await api.get(`/graph/named/${encodeURIComponent(name)}`, { params })).data
 
 export const adminListLow = async (token, limit=50) =>
   (await api.get('/admin/edges/low', {
@@ -1,7 +1,16 @@
 // ui/src/components/GraphView.jsx
-import { useState } from 'react'
+import { useEffect, useState } from 'react'
+import { graphCatalog } from '../api'
+
+export default function GraphView({ onExecute, onNamed, rows }) {
+  // consultas prontas do servidor (plano e resultado ficam em cache lá)
+  const [named, setNamed] = useState([])
+  useEffect(() => {
+    graphCatalog()
+      .then(data => setNamed(data.queries || []))
+      .catch(() => setNamed([]))
+  }, [])
 
-export default function GraphView({ onExecute, rows }) {
   const [cypher, setCypher] = useState(
     `MATCH (c:Entity {type:"Clan"})-[:REL {rel:"HAS_DISCIPLINE"}]->(d:Entity {type:"Discipline"})
 RETURN c.id AS clan, collect(d.id)[0..5] AS disciplines
@@ -19,6 +28,22 @@ LIMIT 10`
 
   return (
     <div className="p-4 bg-slate-900 rounded-xl flex flex-col gap-3">
+      {named.length > 0 && onNamed && (
+        <div className="flex flex-wrap gap-2">
+          {named.map(q => (
+            <button
+              key={q.name}
+              type="button"
+              title={q.description}
+              onClick={() => onNamed(q.name)}
+              className="px-3 py-1 rounded-lg bg-slate-800 hover:bg-slate-700 text-slate-200 text-xs border border-slate-700"
+            >
+              {q.description || q.name}
+            </button>
+          ))}
+        </div>
+      )}
+
       <form onSubmit={handleSubmit} className="flex flex-col gap-2">
         <textarea
           className="w-full min-h-[120px] px-3 py-2 rounded-lg bg-slate-800 text-slate-100 border border-slate-700 font-mono text-xs"
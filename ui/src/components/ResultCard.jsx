@@ -1,6 +1,16 @@
 // ui/src/components/ResultCard.jsx
+
+// trechos do highlight do OpenSearch vêm com <em>...</em>; viram <mark> sem innerHTML
+function Fragment({ value }) {
+  return value.split(/(<em>.*?<\/em>)/g).map((part, i) =>
+    part.startsWith('<em>')
+      ? <mark key={i} className="bg-amber-400/30 text-slate-50 rounded px-0.5">{part.slice(4, -5)}</mark>
+      : <span key={i}>{part}</span>
+  )
+}
+
 export default function ResultCard({ passage }) {
-  const { title, url, text, score, section } = passage
+  const { title, url, text, fragments, score, section } = passage
 
   return (
     <div className="p-4 rounded-xl bg-slate-900 border border-slate-800 shadow-sm">
@@ -17,9 +27,17 @@ export default function ResultCard({ passage }) {
           Seção: {section}
         </p>
       )}
-      <p className="mt-2 text-sm text-slate-200 whitespace-pre-wrap">
-        {text}
-      </p>
+      {fragments && fragments.length > 0 ? (
+        fragments.map((f, i) => (
+          <p key={i} className="mt-2 text-sm text-slate-200 whitespace-pre-wrap">
+            <Fragment value={f} />
+          </p>
+        ))
+      ) : (
+        <p className="mt-2 text-sm text-slate-200 whitespace-pre-wrap">
+          {text}
+        </p>
+      )}
       {url && (
         <a
           href={url}
@@ -1,10 +1,30 @@
 // ui/src/components/SearchBar.jsx
-import { useState } from 'react'
+import { useRef, useState } from 'react'
+import { suggest } from '../api'
 
 export default function SearchBar({ onSearch }) {
   const [query, setQuery] = useState('')
   const [topK, setTopK] = useState(6)
   const [useGraph, setUseGraph] = useState(true)
+  const [suggestions, setSuggestions] = useState([])
+  const latest = useRef('')
+
+  // /suggest responde da memória do serviço: dá para chamar a cada tecla
+  const handleChange = async (value) => {
+    setQuery(value)
+    latest.current = value
+    if (!value.trim()) {
+      setSuggestions([])
+      return
+    }
+    try {
+      const data = await suggest(value)
+      // respostas fora de ordem (digitação rápida) são descartadas
+      if (latest.current === value) setSuggestions(data.suggestions || [])
+    } catch (_) {
+      setSuggestions([])
+    }
+  }
 
   const handleSubmit = (e) => {
     e.preventDefault()
@@ -19,8 +39,15 @@ export default function SearchBar({ onSearch }) {
           className="flex-1 px-3 py-2 rounded-lg bg-slate-800 text-slate-100 border border-slate-700"
           placeholder="Faça uma pergunta sobre o universo de World of Darkness..."
           value={query}
-          onChange={e => setQuery(e.target.value)}
+          onChange={e => handleChange(e.target.value)}
+          list="qa-suggestions"
+          autoComplete="off"
         />
+        <datalist id="qa-suggestions">
+          {suggestions.map(s => (
+            <option key={`${s.kind}:${s.text}`} value={s.text} />
+          ))}
+        </datalist>
         <button
           type="submit"
           className="px-4 py-2 rounded-lg bg-emerald-500 hover:bg-emerald-400 text-slate-900 font-semibold"